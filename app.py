@@ -1,59 +1,205 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 from flask_cors import CORS
 import requests
 import os
 import logging
 import config
-from uuid import UUID
-import threading
+from uuid import UUID, uuid4
+from collections import namedtuple
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from functools import partial
 import time
-import random
+import itertools
 import utils
-from utils import fetch_url_html_content, convert_html_to_markdown, chunk_data, compress_content, encode_b64, decode_b64
+import retry
+import ratelimit
+import breaker
+import cache
+import jobs
+import outbox
+import idempotency
+import events
+import receive
+import conversations
+import chunk_codecs
+import metrics
+import spans
+import profiler
+import logs
+from utils import fetch_url_html_content, convert_html_to_markdown, chunk_data
 from google import genai
 import json
+import sqlite3
+import functools
+import hmac
+import pstats
 
 app = Flask(__name__)
 CORS(app)
 app.secret_key = os.urandom(24)
-logging.basicConfig(level=logging.INFO)
 
 # Load configuration
 NOMI_API_KEY = config.config.get("NOMI_API_KEY")
 COLLIN_UUID = config.config.get("COLLIN_UUID")
 GEMINI_API_KEY = config.config.get("GEMINI_API_KEY")
 SEND_TO_EXISTING_API = config.config.get("SEND_TO_EXISTING_API")
-API_BASE_URL = "https://api.nomi.ai/v1"
+# NOMI_API_BASE_URL (environment) or API_BASE_URL (config) points the app elsewhere, e.g. at mock_nomi.py
+API_BASE_URL = os.environ.get("NOMI_API_BASE_URL") or config.config.get("API_BASE_URL", "https://api.nomi.ai/v1")
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL") or config.config.get("GEMINI_BASE_URL")  # None for the Gemini default
 MAX_MESSAGE_LENGTH = 450  # Adjust based on NOMI API limit
-MAX_RETRIES = 5  # Maximum number of retry attempts
-INITIAL_BACKOFF = 1  # Initial backoff time in seconds
-JITTER_RANGE = 0.5  # Range for random jitter (plus or minus this value)
+MAX_RETRIES = config.config.get("MAX_RETRIES", retry.MAX_RETRIES)  # Maximum number of attempts per send
+INITIAL_BACKOFF = config.config.get("INITIAL_BACKOFF", retry.INITIAL_BACKOFF)  # Initial backoff time in seconds
+RETRY_DEADLINE = config.config.get("RETRY_DEADLINE", retry.DEFAULT_DEADLINE)  # Give up retrying a single send after this many seconds
+RETRY_POLICY = retry.RetryPolicy(max_attempts=MAX_RETRIES, base=INITIAL_BACKOFF, deadline=RETRY_DEADLINE)
+ENCODED_CODEC = config.config.get("ENCODED_CODEC", "auto")  # Compression codec for URL mode, see chunk_codecs
+ENCODED_ENCODING = config.config.get("ENCODED_ENCODING", "base64")  # base64, base85, ascii85 or nomi-radix
+DIRECT_SEND_WINDOW = config.config.get("DIRECT_SEND_WINDOW", 1)  # Direct message chunks in flight at once (1 = one after another, in order)
+DIRECT_SEND_WINDOW_MAX = config.config.get("DIRECT_SEND_WINDOW_MAX", 8)  # Largest window a request may ask for; larger ones are clamped
+BROADCAST_CONCURRENCY = config.config.get("BROADCAST_CONCURRENCY", 8)  # Rooms a /broadcast sends to at once (NOMI_RATE_LIMITS still applies)
+BROADCAST_MAX_ROOMS = config.config.get("BROADCAST_MAX_ROOMS", 50)  # Most rooms one /broadcast may target
+NOMI_POOL_CONNECTIONS = config.config.get("NOMI_POOL_CONNECTIONS", 4)  # Number of per-host pools to keep
+NOMI_POOL_MAXSIZE = config.config.get("NOMI_POOL_MAXSIZE", 20)  # Keep-alive connections kept per host
+NOMI_POOL_BLOCK = config.config.get("NOMI_POOL_BLOCK", False)  # Block instead of opening extra connections per host
+NOMI_KEEP_ALIVE = config.config.get("NOMI_KEEP_ALIVE", True)
+NOMI_RATE_LIMITS = config.config.get("NOMI_RATE_LIMITS", ratelimit.DEFAULT_LIMITS)  # {"chat": (per second, burst), "rooms": ...}; unset families only back off on 429s
+BREAKER_FAILURE_THRESHOLD = config.config.get("BREAKER_FAILURE_THRESHOLD", 5)  # Consecutive upstream failures that open a circuit
+BREAKER_RECOVERY_TIMEOUT = config.config.get("BREAKER_RECOVERY_TIMEOUT", 30)  # Seconds an open circuit fails fast before probing
+LISTING_CACHE_TTL = config.config.get("LISTING_CACHE_TTL", cache.LISTING_TTL)  # Seconds /get_rooms and /get_nomis are served from cache
+LISTING_CACHE_STALE_TTL = config.config.get("LISTING_CACHE_STALE_TTL", cache.LISTING_STALE_TTL)  # Further seconds served stale while refreshing
+SEND_JOB_WORKERS = config.config.get("SEND_JOB_WORKERS", jobs.JOB_WORKERS)  # Background threads running /send jobs
+SEND_JOB_QUEUE_SIZE = config.config.get("SEND_JOB_QUEUE_SIZE", jobs.JOB_QUEUE_SIZE)  # Jobs waiting beyond those before /send answers 503
+OUTBOX_PATH = config.config.get("OUTBOX_PATH")  # SQLite file persisting chunked sends (e.g. "outbox.db"); None sends without it
+OUTBOX_COMMIT_EVERY = config.config.get("OUTBOX_COMMIT_EVERY", outbox.OUTBOX_COMMIT_EVERY)  # Delivered chunks per outbox commit
+OUTBOX_ENQUEUE_BATCH = config.config.get("OUTBOX_ENQUEUE_BATCH", outbox.OUTBOX_ENQUEUE_BATCH)  # Chunks written per outbox transaction
+IDEMPOTENCY_MAX_KEYS = config.config.get("IDEMPOTENCY_MAX_KEYS", idempotency.IDEMPOTENCY_MAX_KEYS)  # Idempotency-Key values remembered
+IDEMPOTENCY_TTL = config.config.get("IDEMPOTENCY_TTL", idempotency.IDEMPOTENCY_TTL)  # Seconds a key is remembered after its last use
+# The NOMI API documents no endpoint listing a room's messages; point this at whatever
+# returns them for your account ({room_uuid} is filled in). The response may be a list or {"messages": [...]}.
+# Unset, receiving is off: /rooms/<room_uuid>/events answers 404.
+ROOM_MESSAGES_PATH = config.config.get("ROOM_MESSAGES_PATH")
+ROOM_POLL_INTERVAL = config.config.get("ROOM_POLL_INTERVAL", receive.ROOM_POLL_INTERVAL)  # Seconds between upstream polls of a watched room
+CONVERSATION_DB_PATH = config.config.get("CONVERSATION_DB_PATH", None)  # SQLite file of sent messages and replies, e.g. "conversations.db"; unset leaves /search off
+LOG_FORMAT = config.config.get("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+LOG_QUEUE_SIZE = config.config.get("LOG_QUEUE_SIZE", logs.LOG_QUEUE_SIZE)  # Log records waiting to be written before new ones are dropped
+CHUNK_LOG_SAMPLE_EVERY = config.config.get("CHUNK_LOG_SAMPLE_EVERY", logs.CHUNK_LOG_SAMPLE_EVERY)  # Log 1 in N successful chunk sends
+ADMIN_TOKEN = config.config.get("ADMIN_TOKEN")  # Bearer token for the /debug/profile endpoints; None disables them
+SEND_TRACE_BUFFER = config.config.get("SEND_TRACE_BUFFER", spans.TRACE_BUFFER_SIZE)  # Per-stage timings of the last N sends kept for /debug/send_traces
+
+chunk_log = logs.Sampled(logging.getLogger(), every=CHUNK_LOG_SAMPLE_EVERY)
 
 if not NOMI_API_KEY or not COLLIN_UUID:
     raise RuntimeError("NOMI API Key or COLLIN UUID not configured.")
 
+ratelimit.limiter.configure(NOMI_RATE_LIMITS)
+breaker.breakers.configure(failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_timeout=BREAKER_RECOVERY_TIMEOUT)
+
+# Metrics served at /metrics (retry counters live in retry.py)
+REQUEST_LATENCY = metrics.registry.histogram(
+    "http_request_duration_seconds", "Latency of requests to this app by route", ["route", "method", "status"])
+UPSTREAM_LATENCY = metrics.registry.histogram(
+    "upstream_request_duration_seconds", "Latency of one upstream call (a single attempt)", ["upstream", "operation"])
+UPSTREAM_ERRORS = metrics.registry.counter(
+    "upstream_errors", "Upstream calls that failed or raised", ["upstream", "operation"])
+CHUNKS_SENT = metrics.registry.counter("nomi_chunks_sent", "Messages and chunks delivered to NOMI", ["target"])
+CHUNK_BYTES = metrics.registry.counter("nomi_chunk_bytes_sent", "UTF-8 bytes of delivered messages and chunks", ["target"])
+PAYLOAD_BYTES = metrics.registry.counter(
+    "url_payload_bytes", "URL mode payload size per stage: fetched html, markdown, compressed (codec output), encoded (text chunks)", ["stage"])
+SEND_STAGE_LATENCY = metrics.registry.histogram(
+    "send_stage_duration_seconds", "Wall time of each /send pipeline stage, summed over the send's chunks", ["mode", "stage"])
+ROOM_SENT = (CHUNKS_SENT.labels("room"), CHUNK_BYTES.labels("room"))
+DIRECT_SENT = (CHUNKS_SENT.labels("direct"), CHUNK_BYTES.labels("direct"))
+
+def upstream_call(operation, upstream="nomi"):
+    """Decorator timing each call in UPSTREAM_LATENCY; a Nomi-style error result (or an exception) counts as an error."""
+    latency, errors = UPSTREAM_LATENCY.labels(upstream, operation), UPSTREAM_ERRORS.labels(upstream, operation)
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+            if retry.is_failure(result[0] if isinstance(result, tuple) else result):
+                errors.inc()
+            return result
+        return wrapper
+    return decorate
+
+def count_sent(sent, text):
+    chunks, size = sent
+    chunks.inc()
+    size.inc(len(text.encode('utf-8')))
+
+def count_bytes(chunks, counter):
+    """Pass chunks (bytes) through, adding their sizes to counter."""
+    for chunk in chunks:
+        counter.inc(len(chunk))
+        yield chunk
+
 # Initialize NOMI client
 class Nomi:
-    def __init__(self, api_key):
+    def __init__(self, api_key, pool_connections=NOMI_POOL_CONNECTIONS, pool_maxsize=NOMI_POOL_MAXSIZE,
+                 pool_block=NOMI_POOL_BLOCK, keep_alive=NOMI_KEEP_ALIVE):
         self.api_key = api_key
         self.headers = {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'}
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+        # One shared session so every call reuses pooled keep-alive connections
+        # instead of paying a fresh TCP+TLS handshake. Sessions are safe to share
+        # across request threads; pool_maxsize/pool_block bound connections per host.
+        self.session = requests.Session()
+        # The adapter also queues each call behind the process-wide rate limiter and
+        # fails fast while the endpoint family's circuit breaker is open.
+        self._adapter = breaker.GuardedAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block)
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        # Room and NOMI listings only change through create_room/delete_room, which invalidate them.
+        self.listings = cache.TTLCache(LISTING_CACHE_TTL, LISTING_CACHE_STALE_TTL,
+                                       cacheable=lambda value: not retry.is_failure(value))
+
+    def pool_stats(self):
+        """Report how many upstream requests reused a pooled connection vs. opened a new one."""
+        pools = self._adapter.poolmanager.pools
+        with pools.lock:
+            host_pools = list(pools._container.items())
+        hosts = {}
+        for key, pool in host_pools:
+            opened = pool.num_connections
+            reused = max(pool.num_requests - opened, 0)
+            hosts[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "requests": pool.num_requests, "connections_opened": opened,
+                "connections_reused": reused}
+        return {
+            "connections_opened": sum(h["connections_opened"] for h in hosts.values()),
+            "connections_reused": sum(h["connections_reused"] for h in hosts.values()),
+            "hosts": hosts,
+        }
 
+    @upstream_call("get_rooms")
     def get_rooms(self):
         try:
-            response = requests.get(f'{API_BASE_URL}/rooms', headers=self.headers, timeout=10)
+            response = self.session.get(f'{API_BASE_URL}/rooms', headers=self.headers, timeout=10)
             response.raise_for_status()
             return response.json().get('rooms', [])
         except requests.exceptions.RequestException as e:
             logging.error(f"Error fetching rooms: {e}")
             return {"error": f"Error fetching rooms: {e}"}
 
+    @upstream_call("send_direct_message")
     def _send_single_direct_message(self, recipient_nomi_uuid, message_text):
         try:
             url = f'{API_BASE_URL}/nomis/{recipient_nomi_uuid}/chat'
             payload = {"messageText": message_text}
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
+            response = self.session.post(url, headers=self.headers, json=payload, timeout=30)
             response.raise_for_status()
-            logging.info(f"Direct message sent to NOMI {recipient_nomi_uuid}: {message_text[:50]}...")
+            chunk_log.info("Direct message sent to NOMI %s: %.50s...", recipient_nomi_uuid, message_text,
+                           nomi=recipient_nomi_uuid, chars=len(message_text))
             return response.json()
         except requests.exceptions.HTTPError as e:
             logging.error(f"HTTP error sending direct message to {recipient_nomi_uuid}: {e.response.status_code}, {e.response.text}")
@@ -62,44 +208,111 @@ class Nomi:
             logging.error(f"Error sending direct message to {recipient_nomi_uuid}: {e}")
             return {"error": f"Error sending direct message: {e}"}
 
-    def send_direct_message(self, recipient_nomi_uuid, message_text):
+    def _send_direct_chunk(self, recipient_nomi_uuid, index, chunk_text, job=None):
+        """
+        Start sending one chunk with retries on retry.scheduler.
+        Returns a Future of (response_data or None, timing).
+        """
+        started = time.perf_counter()
+
+        def settle(sending):
+            outcome = sending.result()
+            timing = {"chunk": index, "attempts": outcome.attempts, "latency": time.perf_counter() - started}
+            if retry.is_failure(outcome.result):
+                if job:
+                    job.chunk_failed(index, outcome.result["error"], outcome.attempts)
+                return None, dict(timing, error=outcome.result["error"], fatal=outcome.fatal)
+            count_sent(DIRECT_SENT, chunk_text)
+            if job:
+                job.chunk_sent(index, len(chunk_text), outcome.attempts, timing["latency"], reply_text(outcome.result))
+            return outcome.result, timing
+
+        return retry.chain(retry.scheduler.submit(lambda: self._send_single_direct_message(recipient_nomi_uuid, chunk_text),
+                                                  RETRY_POLICY, label=f"direct message chunk {index}",
+                                                  on_retry=partial(job.chunk_retrying, index) if job else None,
+                                                  bucket="chat"), settle)
+
+    def send_direct_message(self, recipient_nomi_uuid, message_text, window=1, job=None):
         """
         Sends a direct message to a specific NOMI, handling chunking if necessary.
+
+        With window > 1, up to that many chunks are in flight at once, each retried
+        independently, so they can arrive out of order. Every header then carries a
+        stream id ([DIRECT_CHUNK i/n #id]) and order survives only in those i/n
+        sequence numbers: the NOMI itself reads chunks as they arrive and never
+        reassembles them, only a reader using reassembly.Reassembler does. That is
+        why window=1 (strictly in order) is the default.
+        Per-chunk results are reported to job (a jobs.Job) when given.
         """
         if not self.api_key:
             logging.error("NOMI API Key not set.")
             return {"error": "NOMI API Key not configured."}
 
         if len(message_text) <= MAX_MESSAGE_LENGTH:
-            return self._send_single_direct_message(recipient_nomi_uuid, message_text)
+            if job:
+                job.set_total(1)
+            started = time.perf_counter()
+            result = self._send_single_direct_message(recipient_nomi_uuid, message_text)
+            if not retry.is_failure(result):
+                count_sent(DIRECT_SENT, message_text)
+            if job:
+                if retry.is_failure(result):
+                    job.chunk_failed(1, result["error"])
+                else:
+                    job.chunk_sent(1, len(message_text), 1, time.perf_counter() - started, reply_text(result))
+            return result
         else:
             chunks = utils.chunk_data(message_text, MAX_MESSAGE_LENGTH)
-            status_messages = []
-            final_response = None
-            for i, chunk in enumerate(chunks):
-                chunk_text = f"[DIRECT_CHUNK {i+1}/{len(chunks)}] {chunk}"
-                attempts = 0
-                success = False
-                while attempts < MAX_RETRIES:
-                    response_data = self._send_single_direct_message(recipient_nomi_uuid, chunk_text)
-                    if "error" not in response_data:
-                        status_messages.append(f"Direct message chunk {i+1} sent successfully.")
-                        final_response = response_data  # Keep the last response
-                        success = True
+            if job:
+                job.set_total(len(chunks))
+            stream_tag = f"#{uuid4().hex[:8]}" if window > 1 else None
+            chunk_texts = [f"{utils.format_chunk_header('DIRECT_CHUNK', i + 1, len(chunks), stream_tag)} {chunk}"
+                           for i, chunk in enumerate(chunks)]
+            started = time.perf_counter()
+            results = []
+            if window > 1:
+                # Up to window chunks in flight as scheduler submits; only this thread waits on them.
+                waiting = iter(enumerate(chunk_texts, 1))
+                sending = {self._send_direct_chunk(recipient_nomi_uuid, index, text, job): index
+                           for index, text in itertools.islice(waiting, window)}
+                finished = {}
+                while sending:
+                    done, _ = wait(sending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finished[sending.pop(future)] = future.result()
+                    if any(response_data is None for response_data, _ in finished.values()):
+                        for pending in sending:
+                            pending.cancel()  # No further attempts; a request already out still completes
+                        break
+                    for index, text in itertools.islice(waiting, len(done)):
+                        sending[self._send_direct_chunk(recipient_nomi_uuid, index, text, job)] = index
+                for index in sorted(finished):
+                    results.append(finished[index])
+                    if results[-1][0] is None:
                         break
-                    else:
-                        logging.warning(f"Retrying direct message chunk {i+1} (attempt {attempts}): {response_data['error']}")
-                        attempts += 1
-                        time.sleep((INITIAL_BACKOFF * (2 ** attempts)) + random.uniform(-JITTER_RANGE, JITTER_RANGE))
-                if not success:
-                    return {"error": f"Failed to send direct message chunk {i+1} after {MAX_RETRIES} retries."}
-            return {"status": "Direct message sent in multiple chunks.", "details": status_messages, "last_response": final_response}
+            else:
+                for i, text in enumerate(chunk_texts):
+                    results.append(self._send_direct_chunk(recipient_nomi_uuid, i + 1, text, job).result())
+                    if results[-1][0] is None:
+                        break
+            timings = {"wall_time": time.perf_counter() - started, "window": window,
+                       "chunks": [timing for _, timing in results]}
+            for response_data, timing in results:
+                if response_data is None:
+                    if timing["fatal"]:
+                        return {"error": timing["error"], "timings": timings}
+                    return {"error": f"Failed to send direct message chunk {timing['chunk']} after {MAX_RETRIES} retries.",
+                            "timings": timings}
+            status_messages = [f"Direct message chunk {i+1} sent successfully." for i in range(len(results))]
+            return {"status": "Direct message sent in multiple chunks.", "details": status_messages,
+                    "last_response": results[-1][0], "timings": timings}
 
+    @upstream_call("delete_room")
     def delete_room(self, room_uuid):
         try:
-            response = requests.delete(f'{API_BASE_URL}/rooms/{room_uuid}', headers=self.headers, timeout=10)
+            response = self.session.delete(f'{API_BASE_URL}/rooms/{room_uuid}', headers=self.headers, timeout=10)
             response.raise_for_status()
-            return {"status": f"Room '{room_uuid}' deleted successfully."}
+            return {"status": f"Room '{room_uuid}' deleted successfully."}, 200
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 404:
                 return {"error": "Room not found."}, 404
@@ -112,20 +325,37 @@ class Nomi:
             logging.error(f"Error deleting room {room_uuid}: {e}")
             return {"error": f"Error deleting room: {e}"}, 500
 
+    @upstream_call("get_room_messages")
+    def get_room_messages(self, room_uuid):
+        """Fetch a room's messages (oldest first) from ROOM_MESSAGES_PATH."""
+        try:
+            url = API_BASE_URL + ROOM_MESSAGES_PATH.format(room_uuid=room_uuid)
+            response = self.session.get(url, headers=self.headers, timeout=10)
+            response.raise_for_status()
+            data = response.json()
+            messages = data if isinstance(data, list) else data.get('messages', [])
+            if all(m.get('sent') for m in messages):
+                messages = sorted(messages, key=lambda m: m['sent'])
+            return messages
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching messages for room {room_uuid}: {e}")
+            return {"error": f"Error fetching room messages: {e}"}
+
+    @upstream_call("get_nomis")
     def get_nomis(self):
         """Fetch NOMIs from the NOMI API."""
         try:
-            response = requests.get(f'{API_BASE_URL}/nomis', headers=self.headers, timeout=10)
+            response = self.session.get(f'{API_BASE_URL}/nomis', headers=self.headers, timeout=10)
             response.raise_for_status()
             return response.json().get('nomis', [])
         except requests.exceptions.RequestException as e:
             logging.error(f"Error fetching NOMIs: {e}")
             return {"error": f"Error fetching NOMIs: {e}"}
 
+    @upstream_call("send_message")
     def send_message(self, room_uuid, payload):
         try:
-            import json
-            response = requests.post(
+            response = self.session.post(
                 f'{API_BASE_URL}/rooms/{room_uuid}/chat',
                 headers=self.headers,
                 data=json.dumps(payload),
@@ -140,19 +370,21 @@ class Nomi:
             logging.error(f"Error sending message to room {room_uuid}: {e}")
             return {"error": f"Error sending message: {e}"}
 
+    @upstream_call("start_loop")
     def start_loop(self, room_uuid, duration, start_prompt, nomi_id, mode):
         payload = {"duration": duration, "start_prompt": start_prompt, "nomi_id": nomi_id, "mode": mode}
         try:
-            response = requests.post(f'{API_BASE_URL}/rooms/{room_uuid}/loop', headers=self.headers, json=payload, timeout=10)
+            response = self.session.post(f'{API_BASE_URL}/rooms/{room_uuid}/loop', headers=self.headers, json=payload, timeout=10)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             logging.error(f"Error starting loop in room {room_uuid}: {e}")
             return {"error": f"Error starting loop: {e}"}
 
+    @upstream_call("stop_loop")
     def stop_loop(self, room_uuid):
         try:
-            response = requests.post(f'{API_BASE_URL}/rooms/{room_uuid}/loop/stop', headers=self.headers, timeout=10)
+            response = self.session.post(f'{API_BASE_URL}/rooms/{room_uuid}/loop/stop', headers=self.headers, timeout=10)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -160,6 +392,43 @@ class Nomi:
             return {"error": f"Error stopping loop: {e}"}
 
 nomi = Nomi(NOMI_API_KEY)
+send_events = events.Broker()
+send_jobs = jobs.JobQueue(SEND_JOB_WORKERS, SEND_JOB_QUEUE_SIZE, broker=send_events)
+room_events = events.Broker()
+room_watcher = receive.RoomWatcher(nomi.get_room_messages, room_events,
+                                   interval=ROOM_POLL_INTERVAL) if ROOM_MESSAGES_PATH else None
+send_keys = idempotency.IdempotencyStore(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL)
+send_outbox = outbox.Outbox(OUTBOX_PATH, commit_every=OUTBOX_COMMIT_EVERY,
+                            enqueue_batch=OUTBOX_ENQUEUE_BATCH) if OUTBOX_PATH else None
+send_traces = spans.TraceBuffer(SEND_TRACE_BUFFER)
+stack_sampler = profiler.StackSampler()
+request_profiles = profiler.RequestProfiles()
+conversation_store = conversations.ConversationStore(CONVERSATION_DB_PATH) if CONVERSATION_DB_PATH else None
+
+def record_conversation(room, direction, text, sender=None, mode=None):
+    """Queue a sent message or a reply for the conversation store, if it is enabled."""
+    if conversation_store is not None and isinstance(text, str):
+        conversation_store.record(room, direction, text, sender, mode)
+
+def record_sent(room, data, text):
+    """
+    Record a successful /send or /broadcast. text is what went out before
+    chunking: in URL mode the fetched markdown, recorded under its URL so a
+    search finds the page's content and not just its address.
+    """
+    mode = data.get('mode', 'plaintext')
+    if mode == 'URL':
+        text = f"{data.get('message')}\n\n{text}"
+    record_conversation(room, conversations.SENT, text, mode=mode)
+
+def reply_text(result):
+    """The NOMI's reply text in a chat API response, if it has one."""
+    reply = result.get("replyMessage") if isinstance(result, dict) else None
+    return reply.get("text") if isinstance(reply, dict) else None
+
+def gemini_http_options():
+    """Point the Gemini client at GEMINI_BASE_URL (e.g. mock_nomi.py) when it is set."""
+    return {"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None
 
 def is_valid_uuid(uuid_string):
     try:
@@ -168,6 +437,38 @@ def is_valid_uuid(uuid_string):
     except ValueError:
         return False
 
+def admin_authorized():
+    """True if the request carries Authorization: Bearer <ADMIN_TOKEN> (never when no token is configured)."""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {ADMIN_TOKEN}")
+
+@app.before_request
+def start_request_timer():
+    request.environ['app.started'] = time.perf_counter()
+    # X-Profile: 1 (from an admin) runs cProfile for this request; see /debug/profile/<profile_id>
+    if 'X-Profile' in request.headers and admin_authorized():
+        request.environ['app.profile'] = request_profiles.start()
+
+@app.after_request
+def observe_request_latency(response):
+    started = request.environ.get('app.started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(time.perf_counter() - started)
+    if 'app.profile' in request.environ:
+        profile = request.environ.pop('app.profile')
+        if profile is None:
+            response.headers['X-Profile-Error'] = "Another profiler is active in this process."
+        else:
+            profile_id = request_profiles.finish(profile, f"{request.method} {request.path} -> {response.status_code}")
+            response.headers['X-Profile-Id'] = profile_id
+    return response
+
+@app.teardown_request
+def stop_abandoned_profile(error=None):
+    profile = request.environ.pop('app.profile', None)  # Left running only if the response was never finalized
+    if profile is not None:
+        profile.disable()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -184,7 +485,7 @@ def get_nomis_route():
     try:
         # Even though we're hardcoding Collin, we might still want to fetch
         # NOMIs for other potential uses or for logging/monitoring.
-        nomis_data = nomi.get_nomis()
+        nomis_data = nomi.listings.get("nomis", nomi.get_nomis)
         if isinstance(nomis_data, list):
             return jsonify({"nomis": nomis_data}), 200
         else:
@@ -193,6 +494,12 @@ def get_nomis_route():
         logging.error(f"Error fetching NOMIs for route: {e}")
         return jsonify({"error": f"Error fetching NOMIs: {e}"}), 500
 
+@upstream_call("create_room")
+def post_create_room(room_data):
+    response = nomi.session.post(f'{API_BASE_URL}/rooms', json=room_data, headers=nomi.headers, timeout=10)
+    response.raise_for_status()
+    return response
+
 @app.route('/create_room', methods=['POST'])
 def create_room():
     data = request.get_json()
@@ -219,8 +526,8 @@ def create_room():
     }
 
     try:
-        response = requests.post(f'{API_BASE_URL}/rooms', json=room_data, headers=nomi.headers, timeout=10)
-        response.raise_for_status()
+        response = post_create_room(room_data)
+        nomi.listings.invalidate("rooms")
         return jsonify(response.json()), 200
     except requests.exceptions.RequestException as e:
         if hasattr(e.response, 'text'):
@@ -242,12 +549,14 @@ def delete_room():
         return jsonify({"error": "Missing room_uuid"}), 400
 
     result, status_code = nomi.delete_room(room_uuid)
+    if status_code == 200:
+        nomi.listings.invalidate("rooms")
     return jsonify(result), status_code
 
 @app.route('/get_rooms')
 def get_rooms():
     try:
-        rooms = nomi.get_rooms()
+        rooms = nomi.listings.get("rooms", nomi.get_rooms)
         if isinstance(rooms, list):
             room_names = [{'name': room['name'], 'uuid': room['uuid']} for room in rooms]
             return jsonify({'rooms': room_names}), 200
@@ -257,9 +566,218 @@ def get_rooms():
         logging.error(f"Error fetching rooms: {e}")
         return jsonify({"error": f"Error fetching rooms: {e}"}), 500
 
-@app.route('/send', methods=['POST'])
-def send_message():
-    data = request.get_json()
+def chunk_retry_hook(job, trace, index):
+    """on_retry callback for chunk index: tells job, and adds the backoff to trace as retry_sleep."""
+    if not trace:
+        return partial(job.chunk_retrying, index) if job else None
+
+    def on_retry(attempts, delay, error):
+        trace.add("retry_sleep", delay)
+        if job:
+            job.chunk_retrying(index, attempts, delay, error)
+    return on_retry
+
+def finish_trace(trace, status_code):
+    """Close a /send or /broadcast trace: feed its stages to SEND_STAGE_LATENCY and keep it in send_traces."""
+    trace.finish(status_code)
+    mode = trace.attrs.get("mode") if trace.attrs.get("mode") in ("URL", "Code") else "plaintext"
+    for stage in list(trace.stages.values()):
+        SEND_STAGE_LATENCY.labels(mode, stage.name).observe(stage.wall)
+    send_traces.record(trace)
+
+def send_chunks(room_uuid, chunks, kind, label, total_chunks=None, first_tag=None, job=None, record=None, trace=None):
+    """
+    Send chunks to a room in order, each with retries.
+
+    Returns (status_messages, error, status_code); error is None on success.
+    Per-chunk results are reported to job (a jobs.Job) when given. With the
+    outbox enabled the chunks are persisted before they are sent (a list all
+    at once, a streamed iterable a batch at a time), so an interrupted send
+    resumes after a restart (see resume_outbox). With an idempotency record
+    (a retried request), chunks an earlier attempt delivered are skipped.
+    Stage timings go to trace (a spans.Trace) when given.
+    """
+    return send_chunks_later(room_uuid, chunks, kind, label, total_chunks, first_tag, job, record, trace).result()
+
+def send_chunks_later(room_uuid, chunks, kind, label, total_chunks=None, first_tag=None, job=None, record=None, trace=None):
+    """send_chunks without waiting: returns a Future of (status_messages, error, status_code)."""
+    total_chunks = total_chunks or len(chunks)
+    if trace:
+        trace.set(chunks=total_chunks)
+    messages = ((i + 1, f"{utils.format_chunk_header(kind, i + 1, total_chunks, first_tag if i == 0 else None)} {chunk}")
+                for i, chunk in enumerate(chunks))
+    if record:
+        def skipped(index, size):
+            send_keys.skipped()
+            if job:
+                job.chunk_skipped(index, size)
+        messages = record.resume(kind, total_chunks, messages, on_skip=skipped)
+    if send_outbox is None:
+        return deliver_chunks_later(room_uuid, messages, label, total_chunks, job, record=record, trace=trace)
+    stream = job.id if job else uuid4().hex
+    if isinstance(chunks, list):
+        # Every chunk is known, so write them all first: a crash at any point can then be resumed.
+        with spans.span(trace, "outbox_enqueue"):
+            send_outbox.enqueue(stream, room_uuid, label, total_chunks, messages)
+        return deliver_outbox_stream_later(stream, job, record, trace)
+    with spans.span(trace, "outbox_enqueue"):
+        messages = send_outbox.enqueue_streaming(stream, room_uuid, label, total_chunks, messages)
+    # Batches are written as delivery pulls them, so their writes are timed there.
+    return deliver_outbox_stream_later(stream, job, record, trace, spans.iterate(trace, "outbox_enqueue", messages))
+
+def deliver_chunks_later(room_uuid, messages, label, total_chunks, job=None, delivery=None, record=None, trace=None):
+    """
+    Send (index, text) messages to a room in order, each with retries.
+    Returns a Future of (status_messages, error, status_code). delivery (an
+    outbox.Delivery) and record (an idempotency.Record) are told about each sent chunk.
+
+    No thread is held while a chunk waits: each one is a retry.scheduler.submit
+    (its backoffs and rate-limit waits are timer entries), and the next chunk is
+    submitted once it is delivered.
+    """
+    if job:
+        job.set_total(total_chunks)
+    finished = Future()
+    status_messages = []
+    messages = iter(messages)
+    send = spans.wrap(trace, "send", nomi.send_message)
+
+    def send_next():
+        try:
+            message = next(messages, None)
+            if message is None:
+                finished.set_result((status_messages, None, 200))
+                return
+            index, text = message
+            started = time.perf_counter()
+            sending = retry.scheduler.submit(lambda: send(room_uuid, {"messageText": text}), RETRY_POLICY,
+                                             label=f"{label.lower()} chunk {index}",
+                                             on_retry=chunk_retry_hook(job, trace, index), bucket="chat")
+            sending.add_done_callback(lambda sending: sent(sending, index, text, started))
+        except BaseException as e:
+            finished.set_exception(e)
+
+    def sent(sending, index, text, started):
+        try:
+            outcome = sending.result()
+            if retry.is_failure(outcome.result):
+                if job:
+                    job.chunk_failed(index, outcome.result["error"], outcome.attempts)
+                if outcome.fatal:
+                    error = outcome.result["error"]
+                    finished.set_result((status_messages, error, 503 if breaker.is_circuit_open(error) else 400))
+                else:
+                    finished.set_result((status_messages,
+                                         f"Failed to send {label.lower()} chunk {index} after {MAX_RETRIES} retries.", 500))
+                return
+            count_sent(ROOM_SENT, text)
+            if delivery:
+                delivery.delivered(index)
+            if record:
+                record.chunk_delivered(index, text)
+            if job:
+                job.chunk_sent(index, len(text), outcome.attempts, time.perf_counter() - started, reply_text(outcome.result))
+            status_messages.append(f"{label} chunk {index} sent successfully.")
+        except BaseException as e:
+            finished.set_exception(e)
+            return
+        retry.scheduler.call_later(0, send_next)  # Through the timer, so chunks that complete at once do not recurse
+
+    send_next()
+    return finished
+
+def deliver_outbox_stream(stream, job=None, record=None, trace=None, messages=None):
+    """
+    Deliver an outbox stream: messages as send_outbox.enqueue_streaming yields
+    them, or by default its undelivered chunks. Returns (status_messages, error, status_code).
+    """
+    return deliver_outbox_stream_later(stream, job, record, trace, messages).result()
+
+def deliver_outbox_stream_later(stream, job=None, record=None, trace=None, messages=None):
+    """deliver_outbox_stream without waiting: returns a Future of (status_messages, error, status_code)."""
+    info = send_outbox.stream(stream)
+    delivery = send_outbox.delivery(stream)
+
+    def settle(sending):
+        try:
+            status_messages, error, status_code = sending.result()
+        except Exception:
+            # Leave the stream 'sending' (e.g. interrupted by shutdown) so a later start resumes it.
+            delivery.flush()
+            raise
+        if error:
+            delivery.fail(error)
+        else:
+            delivery.complete()
+        return status_messages, error, status_code
+
+    return retry.chain(deliver_chunks_later(info.room, send_outbox.pending_chunks(stream) if messages is None else messages,
+                                            info.label, info.total, job, delivery, record, trace), settle)
+
+def resume_outbox():
+    """Queue jobs finishing the sends an earlier process left part-way through."""
+    def resume(stream, job):
+        status_messages, error, status_code = deliver_outbox_stream(stream, job)
+        if error:
+            return {"error": error}, status_code
+        return {"status": "Interrupted send resumed.", "details": status_messages}, 200
+
+    for stream in send_outbox.resume_orphans():
+        send_jobs.submit("resume", lambda job, stream=stream: resume(stream, job))
+
+def send_single(room_uuid, message_to_send, job=None, trace=None):
+    """Send an unchunked message with retries. Returns (result, error, status_code)."""
+    return send_single_later(room_uuid, message_to_send, job, trace).result()
+
+def send_single_later(room_uuid, message_to_send, job=None, trace=None):
+    """send_single without waiting: returns a Future of (result, error, status_code)."""
+    logging.info("Sending plaintext: Room='%s', Message='%.50s'", room_uuid, message_to_send,
+                 extra=logs.fields(room=room_uuid, chars=len(message_to_send)))
+    if job:
+        job.set_total(1)
+    if trace:
+        trace.set(chunks=1)
+    started = time.perf_counter()
+    send = spans.wrap(trace, "send", nomi.send_message)
+
+    def settle(sending):
+        outcome = sending.result()
+        if retry.is_failure(outcome.result):
+            error_message = outcome.result["error"]
+            if job:
+                job.chunk_failed(1, error_message, outcome.attempts)
+            if outcome.fatal:
+                return None, error_message, 503 if breaker.is_circuit_open(error_message) else 400
+            return None, f"Failed to send message after {outcome.attempts} retries.  Last error: {error_message}", 500
+        count_sent(ROOM_SENT, message_to_send)
+        if job:
+            job.chunk_sent(1, len(message_to_send), outcome.attempts, time.perf_counter() - started,
+                           reply_text(outcome.result))
+        return outcome.result, None, 200
+
+    return retry.chain(retry.scheduler.submit(lambda: send(room_uuid, {"messageText": message_to_send}), RETRY_POLICY,
+                                              label="message", on_retry=chunk_retry_hook(job, trace, 1), bucket="chat"),
+                       settle)
+
+def fetch_markdown(url, trace=None):
+    """Fetch a page and convert it to markdown (URL mode). Returns None if the fetch failed."""
+    with UPSTREAM_LATENCY.labels("url", "fetch").time(), spans.span(trace, "fetch"):
+        html_content = fetch_url_html_content(url)
+    if not html_content:
+        UPSTREAM_ERRORS.labels("url", "fetch").inc()
+        return None
+    html_bytes = len(html_content.encode('utf-8'))
+    PAYLOAD_BYTES.labels("html").inc(html_bytes)
+    with spans.span(trace, "markdown"):
+        markdown = convert_html_to_markdown(html_content)
+    markdown_bytes = len(markdown.encode('utf-8'))
+    PAYLOAD_BYTES.labels("markdown").inc(markdown_bytes)
+    if trace:
+        trace.set(html_bytes=html_bytes, markdown_bytes=markdown_bytes)
+    return markdown
+
+def run_send(data, job=None, record=None, trace=None):
+    """Carry out a /send request body. Returns (response_body, status_code). Stages are timed into trace."""
     message_content = data.get('message')
     room_uuid = data.get('room')
     mode = data.get('mode', 'plaintext') # Get the selected mode
@@ -267,127 +785,327 @@ def send_message():
     try:
         message_to_send = message_content
         if mode == 'URL':
-            html_content = fetch_url_html_content(message_content)
-            if not html_content:
-                return jsonify({"error": "Failed to fetch URL content."}), 400
-            message_to_send = convert_html_to_markdown(html_content)
-            if len(message_to_send) > MAX_MESSAGE_LENGTH:
-                compressed_data = compress_content(message_to_send.encode('utf-8'))
-                encoded_content = encode_b64(compressed_data).decode('utf-8')
-                chunks = chunk_data(encoded_content, MAX_MESSAGE_LENGTH)
-                status_messages = []
-                for i, chunk in enumerate(chunks):
-                    payload = {"messageText": f"[ENCODED_CHUNK {i+1}/{len(chunks)}] {chunk}"}
-                    success = False
-                    attempts = 0
-                    while attempts < MAX_RETRIES:
-                        result = nomi.send_message(room_uuid, payload)
-                        if "error" in result:
-                            logging.warning(f"Retrying URL (encoded) chunk {i+1} (attempt {attempts}): {result['error']}")
-                            attempts += 1
-                            time.sleep((INITIAL_BACKOFF * (2 ** attempts)) + random.uniform(-JITTER_RANGE, JITTER_RANGE))
-                        else:
-                            status_messages.append(f"URL (encoded) chunk {i+1} sent successfully.")
-                            success = True
-                            break
-                    if not success:
-                        return jsonify({"error": f"Failed to send URL (encoded) chunk {i+1} after {MAX_RETRIES} retries."}), 500
-                return jsonify({"status": "URL content sent in multiple encoded chunks.", "details": status_messages}), 200
-            else:
-                attempts = 0
-                while attempts < MAX_RETRIES:
-                    result = nomi.send_message(room_uuid, {"messageText": message_to_send})
-                    if "error" in result:
-                        logging.warning(f"Retrying non-chunked URL message (attempt {attempts}): {result['error']}")
-                        attempts += 1
-                        time.sleep((INITIAL_BACKOFF * (2 ** attempts)) + random.uniform(-JITTER_RANGE, JITTER_RANGE))
-                    else:
-                        return jsonify({'response': {'replyMessage': {'text': result.get('sentMessage', {}).get('text')}}}, 200)
-                return jsonify({"error": f"Failed to send non-chunked URL message after {MAX_RETRIES} retries."}), 500
-
-        elif mode == 'Code':
+            message_to_send = fetch_markdown(message_content, trace)
+            if message_to_send is None:
+                return {"error": "Failed to fetch URL content."}, 400
             if len(message_to_send) > MAX_MESSAGE_LENGTH:
+                # Compress once here, then encode and chunk on a background thread so
+                # encoding overlaps with sending and only a few chunks are held at once.
+                total_chunks, codec, encoding, compressed_bytes, chunks = utils.stream_encoded_chunks(
+                    message_to_send, MAX_MESSAGE_LENGTH, data.get('codec', ENCODED_CODEC),
+                    data.get('encoding', ENCODED_ENCODING), trace=trace)
+                PAYLOAD_BYTES.labels("compressed").inc(compressed_bytes)
+                if trace:
+                    trace.set(codec=codec.name, encoding=encoding.name, compressed_bytes=compressed_bytes)
+                # The first header carries the codec/encoding tag so a decoder knows how to reverse it.
+                # encoder_wait is time the sender spends blocked on the background encoder.
+                chunks = (str(chunk, encoding.charset) for chunk in count_bytes(
+                    spans.iterate(trace, "encoder_wait", utils.prefetch(chunks)), PAYLOAD_BYTES.labels("encoded")))
+                status_messages, error, status_code = send_chunks(
+                    room_uuid, chunks, "ENCODED_CHUNK", "URL (encoded)", total_chunks,
+                    first_tag=chunk_codecs.header_tag(codec, encoding), job=job, record=record, trace=trace)
+                if error:
+                    return {"error": error}, status_code
+                record_sent(room_uuid, data, message_to_send)
+                return {"status": "URL content sent in multiple encoded chunks.", "details": status_messages}, 200
+
+        elif mode == 'Code' and len(message_to_send) > MAX_MESSAGE_LENGTH:
+            with spans.span(trace, "chunk"):
                 chunks = chunk_data(message_to_send, MAX_MESSAGE_LENGTH)
-                status_messages = []
-                for i, chunk in enumerate(chunks):
-                    payload = {"messageText": f"[CODE_CHUNK {i+1}/{len(chunks)}] {chunk}"}
-                    success = False
-                    attempts = 0
-                    while attempts < MAX_RETRIES:
-                        result = nomi.send_message(room_uuid, payload)
-                        if "error" in result:
-                            logging.warning(f"Retrying code chunk {i+1} (attempt {attempts}): {result['error']}")
-                            attempts += 1
-                            time.sleep((INITIAL_BACKOFF *(2 ** attempts)) + random.uniform(-JITTER_RANGE, JITTER_RANGE))
-                        else:
-                            status_messages.append(f"Code chunk {i+1} sent successfully.")
-                            success = True
-                            break
-                    if not success:
-                        return jsonify({"error": f"Failed to send code chunk {i+1} after {MAX_RETRIES} retries."}), 500
-                return jsonify({"status": "Code sent in multiple chunks.", "details": status_messages}), 200
-            else:
-                attempts = 0
-                while attempts < MAX_RETRIES:
-                    result = nomi.send_message(room_uuid, {"messageText": message_to_send})
-                    if "error" in result:
-                        logging.warning(f"Retrying non-chunked code (attempt {attempts}): {result['error']}")
-                        attempts += 1
-                        time.sleep((INITIAL_BACKOFF * (2 ** attempts)) + random.uniform(-JITTER_RANGE, JITTER_RANGE))
-                    else:
-                        return jsonify({'response': {'replyMessage': {'text': result.get('sentMessage', {}).get('text')}}}, 200)
-                return jsonify({"error": f"Failed to send code after {MAX_RETRIES} retries."}), 500
+            status_messages, error, status_code = send_chunks(room_uuid, chunks, "CODE_CHUNK", "Code", job=job,
+                                                              record=record, trace=trace)
+            if error:
+                return {"error": error}, status_code
+            record_sent(room_uuid, data, message_to_send)
+            return {"status": "Code sent in multiple chunks.", "details": status_messages}, 200
 
         elif len(message_to_send) > MAX_MESSAGE_LENGTH:
-            chunks = chunk_data(message_to_send, MAX_MESSAGE_LENGTH)
-            status_messages = []
-            for i, chunk in enumerate(chunks):
-                payload = {"messageText": f"[TEXT_CHUNK {i+1}/{len(chunks)}] {chunk}"}
-                success = False
-                attempts = 0
-                while attempts < MAX_RETRIES:
-                    result = nomi.send_message(room_uuid, payload)
-                    if "error" in result:
-                        logging.warning(f"Retrying text chunk {i+1} (attempt {attempts}): {result['error']}")
-                        attempts += 1
-                        time.sleep((INITIAL_BACKOFF * (2 ** attempts)) + random.uniform(-JITTER_RANGE, JITTER_RANGE))
-                    else:
-                        status_messages.append(f"Text chunk {i+1} sent successfully.")
-                        success = True
-                        break
-                if not success:
-                    return jsonify({"error": f"Failed to send text chunk {i+1} after {MAX_RETRIES} retries."}), 500
-            return jsonify({"status": "Message sent in multiple chunks.", "details": status_messages}), 200
-        else:
-            attempts = 0
-            while attempts < MAX_RETRIES:
-                logging.info(f"Sending plaintext: Room='{room_uuid}', Type='{type(message_to_send)}', Message='{message_to_send[:50]}'")
-                result = nomi.send_message(room_uuid, {"messageText": message_to_send})
-                if "error" not in result and "sentMessage" in result:
-                    return jsonify({'response': {'replyMessage': {'text': result['sentMessage']['text']}}}), 200
-                elif "error" not in result and "status" in result:
-                    return jsonify({"status": result["status"]}), 200
-                elif "error" in result:
-                    error_message = result["error"]
-                    logging.warning(f"Nomi API error (attempt {attempts + 1}): {error_message}")
-                    if "Invalid room UUID" in error_message or "Message length limit exceeded" in error_message:
-                        return jsonify({"error": error_message}), 400
-                    attempts += 1
-                    backoff_time = (INITIAL_BACKOFF * (2 ** attempts)) + random.uniform(-JITTER_RANGE, JITTER_RANGE)
-                    if backoff_time > 0:
-                        time.sleep(backoff_time)
-                else:
-                    logging.error(f"Unexpected response from Nomi API (attempt {attempts+1}): {result}")
-                    attempts += 1
-                    backoff_time = (INITIAL_BACKOFF * (2 ** attempts)) + random.uniform(-JITTER_RANGE, JITTER_RANGE)
-                    if backoff_time > 0:
-                        time.sleep(backoff_time)
+            with spans.span(trace, "chunk"):
+                chunks = chunk_data(message_to_send, MAX_MESSAGE_LENGTH)
+            status_messages, error, status_code = send_chunks(room_uuid, chunks, "TEXT_CHUNK", "Text", job=job,
+                                                              record=record, trace=trace)
+            if error:
+                return {"error": error}, status_code
+            record_sent(room_uuid, data, message_to_send)
+            return {"status": "Message sent in multiple chunks.", "details": status_messages}, 200
 
-            return jsonify({"error": f"Failed to send message after {MAX_RETRIES} retries.  Last error: {error_message if 'error_message' in locals() else 'Unknown error'}"}), 500
+        result, error, status_code = send_single(room_uuid, message_to_send, job, trace)
+        if error:
+            return {"error": error}, status_code
+        record_sent(room_uuid, data, message_to_send)
+        if "sentMessage" in result:
+            return {'response': {'replyMessage': {'text': result['sentMessage']['text']}}}, 200
+        return {"status": result.get("status")}, 200
 
     except Exception as e:
         logging.error(f"An unexpected error occurred in /send: {e}")
-        return jsonify({"error": f"An unexpected server error occurred: {str(e)}"}), 500
+        return {"error": f"An unexpected server error occurred: {str(e)}"}, 500
+
+ChunkedPayload = namedtuple("ChunkedPayload", ["kind", "label", "chunks", "first_tag", "text"])  # A chunked broadcast payload: chunks are headed per room by send_chunks; text is what was chunked
+
+def prepare_broadcast(data, trace=None):
+    """
+    Do the content work of a send (fetch, convert, compress, encode, chunk) once for all rooms.
+    Returns (payload, error): payload is the message text when it fits in one message,
+    else a ChunkedPayload.
+    """
+    message = data.get('message')
+    mode = data.get('mode', 'plaintext')
+    if mode == 'URL':
+        message = fetch_markdown(message, trace)
+        if message is None:
+            return None, "Failed to fetch URL content."
+        if len(message) > MAX_MESSAGE_LENGTH:
+            total_chunks, codec, encoding, compressed_bytes, chunks = utils.stream_encoded_chunks(
+                message, MAX_MESSAGE_LENGTH, data.get('codec', ENCODED_CODEC), data.get('encoding', ENCODED_ENCODING),
+                trace=trace)
+            PAYLOAD_BYTES.labels("compressed").inc(compressed_bytes)
+            if trace:
+                trace.set(codec=codec.name, encoding=encoding.name, compressed_bytes=compressed_bytes)
+            chunks = [str(chunk, encoding.charset) for chunk in count_bytes(chunks, PAYLOAD_BYTES.labels("encoded"))]
+            return ChunkedPayload("ENCODED_CHUNK", "URL (encoded)", chunks, chunk_codecs.header_tag(codec, encoding),
+                                  message), None
+    if len(message) <= MAX_MESSAGE_LENGTH:
+        return message, None
+    with spans.span(trace, "chunk"):
+        chunks = chunk_data(message, MAX_MESSAGE_LENGTH)
+    if mode == 'Code':
+        return ChunkedPayload("CODE_CHUNK", "Code", chunks, None, message), None
+    return ChunkedPayload("TEXT_CHUNK", "Text", chunks, None, message), None
+
+def broadcast_to_room(room_uuid, payload, started, trace=None):
+    """
+    Start sending a prepared payload to one room, its chunks in order.
+    Returns a Future of the room's summary.
+    """
+    room_started = time.perf_counter()
+    summary = {"room": room_uuid, "queued_ms": round((room_started - started) * 1000, 1)}
+
+    def settle(sending):
+        try:
+            sent, error, status_code = sending.result()
+            chunks_sent = (0 if error else 1) if isinstance(payload, str) else len(sent)
+        except Exception as e:
+            logging.error(f"Unexpected error broadcasting to room {room_uuid}: {e}")
+            error, status_code, chunks_sent = f"An unexpected server error occurred: {e}", 500, 0
+        summary.update(status_code=status_code, chunks_sent=chunks_sent,
+                       wall_ms=round((time.perf_counter() - room_started) * 1000, 1))
+        if error:
+            summary["error"] = error
+        return summary
+
+    try:
+        if isinstance(payload, str):
+            sending = send_single_later(room_uuid, payload, trace=trace)
+        else:
+            sending = send_chunks_later(room_uuid, payload.chunks, payload.kind, payload.label,
+                                        first_tag=payload.first_tag, trace=trace)
+    except Exception as e:
+        sending = Future()
+        sending.set_exception(e)
+    return retry.chain(sending, settle)
+
+def run_broadcast(data, rooms, trace=None):
+    """
+    Carry out a /broadcast: prepare the payload once, then send it to up to
+    BROADCAST_CONCURRENCY rooms at a time. Returns (response_body, status_code).
+
+    The rooms' chunks are retry.scheduler submits, so only this thread waits,
+    however many rooms are in flight or backing off.
+    """
+    started = time.perf_counter()
+    try:
+        payload, error = prepare_broadcast(data, trace)
+    except Exception as e:
+        logging.error(f"An unexpected error occurred preparing a broadcast: {e}")
+        return {"error": f"An unexpected server error occurred: {str(e)}"}, 500
+    if error:
+        return {"error": error}, 400
+    prepared = time.perf_counter()
+    # The rooms share the "chat" bucket: NOMI_RATE_LIMITS, not BROADCAST_CONCURRENCY, bounds the request rate.
+    waiting = iter(rooms)
+    sending = {broadcast_to_room(room, payload, prepared, trace): room
+               for room in itertools.islice(waiting, BROADCAST_CONCURRENCY)}
+    summaries = {}
+    while sending:
+        done, _ = wait(sending, return_when=FIRST_COMPLETED)
+        for finished in done:
+            summaries[sending.pop(finished)] = finished.result()
+            for room in itertools.islice(waiting, 1):
+                sending[broadcast_to_room(room, payload, prepared, trace)] = room
+    summaries = [summaries[room] for room in rooms]
+    succeeded = [summary for summary in summaries if "error" not in summary]
+    for summary in succeeded:
+        record_sent(summary["room"], data, payload if isinstance(payload, str) else payload.text)
+    if len(succeeded) == len(summaries):
+        status_code = 200
+    else:
+        status_code = 207 if succeeded else summaries[0]["status_code"]
+    return {
+        "status": f"Sent to {len(succeeded)} of {len(summaries)} rooms.",
+        "chunks": 1 if isinstance(payload, str) else len(payload.chunks),
+        "prepare_ms": round((prepared - started) * 1000, 1),
+        "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+        "rooms": summaries,
+    }, status_code
+
+def submit_job(kind, func, record=None):
+    """Queue func(job) on the send job pool and answer 202 with the job id (503 when the pool is full)."""
+    try:
+        job = send_jobs.submit(kind, func)
+    except jobs.JobQueueFull as e:
+        logging.warning(str(e))
+        if record:
+            send_keys.finish(record, {"error": str(e)}, 503)
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    if record:
+        record.job_id = job.id
+    return jsonify({"job_id": job.id, "status_url": f"/jobs/{job.id}"}), 202
+
+@app.route('/send', methods=['POST'])
+def send_message():
+    """
+    Queue a send and return 202 {job_id}; poll /jobs/<job_id> for progress and the result.
+    With "wait": true in the body the send runs inside the request as before.
+    With "timings": true the result also carries the per-stage breakdown of the
+    send (see spans.py); the last sends are kept at /debug/send_traces.
+
+    Retries carrying the same Idempotency-Key header get the cached response of a
+    completed send, or resume a failed one from its first undelivered chunk.
+    """
+    data = request.get_json()
+    try:
+        chunk_codecs.check_codec(data.get('codec', ENCODED_CODEC))
+        chunk_codecs.get_encoding(data.get('encoding', ENCODED_ENCODING))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    key = request.headers.get('Idempotency-Key')
+    record = None
+    if key:
+        record, state = send_keys.begin(key, idempotency.fingerprint(data))
+        if record is None:
+            return jsonify({"error": "Idempotency-Key was already used with a different request."}), 422
+        if state == idempotency.COMPLETED:
+            result, status_code = record.response
+            return jsonify(result), status_code, {"Idempotent-Replayed": "true"}
+        if state == idempotency.IN_PROGRESS:
+            if record.job_id and not data.get('wait'):
+                return jsonify({"job_id": record.job_id, "status_url": f"/jobs/{record.job_id}"}), 202
+            return jsonify({"error": "A request with this Idempotency-Key is still in progress."}), 409
+
+    def run(job=None):
+        trace = spans.Trace("send", mode=data.get('mode', 'plaintext'), room=data.get('room'),
+                            job_id=job.id if job else None, message_chars=len(data.get('message') or ''))
+        result, status_code = run_send(data, job, record, trace)
+        if record:
+            send_keys.finish(record, result, status_code)
+        finish_trace(trace, status_code)
+        if data.get('timings'):
+            result = dict(result, timings=trace.to_dict())
+        return result, status_code
+
+    if data.get('wait'):
+        result, status_code = run()
+        return jsonify(result), status_code
+    return submit_job("send", run, record)
+
+@app.route('/broadcast', methods=['POST'])
+def broadcast():
+    """
+    Send one message to several rooms: {"rooms": [room_uuid, ...], "message", "mode", ...}
+    as for /send. URL content is fetched, converted and encoded once; each room then gets
+    the chunks in order, up to BROADCAST_CONCURRENCY rooms at a time.
+
+    Every room's chunks draw on the same "chat" rate-limit bucket as /send, so the
+    upstream request rate is bounded by NOMI_RATE_LIMITS, not by the room count. With
+    no "chat" limit configured (the default) the bucket only holds back after a 429.
+
+    Queued as a job like /send unless "wait": true. The result lists each room's status,
+    chunks sent and timings; the status code is 207 when only some rooms succeeded.
+    """
+    data = request.get_json(silent=True) or {}
+    rooms = data.get('rooms')
+    if not isinstance(rooms, list) or not rooms or not all(isinstance(room, str) and is_valid_uuid(room) for room in rooms):
+        return jsonify({"error": "rooms must be a non-empty list of room UUIDs."}), 400
+    rooms = list(dict.fromkeys(rooms))
+    if len(rooms) > BROADCAST_MAX_ROOMS:
+        return jsonify({"error": f"A broadcast can target at most {BROADCAST_MAX_ROOMS} rooms."}), 400
+    if not data.get('message'):
+        return jsonify({"error": "Message is required."}), 400
+    try:
+        chunk_codecs.check_codec(data.get('codec', ENCODED_CODEC))
+        chunk_codecs.get_encoding(data.get('encoding', ENCODED_ENCODING))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def run(job=None):
+        trace = spans.Trace("broadcast", mode=data.get('mode', 'plaintext'), rooms=len(rooms),
+                            job_id=job.id if job else None, message_chars=len(data['message']))
+        result, status_code = run_broadcast(data, rooms, trace)
+        finish_trace(trace, status_code)
+        if data.get('timings'):
+            result = dict(result, timings=trace.to_dict())
+        return result, status_code
+
+    if data.get('wait'):
+        result, status_code = run()
+        return jsonify(result), status_code
+    return submit_job("broadcast", run)
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status, per-chunk results, bytes sent and ETA of a send job; includes the result once finished."""
+    job = send_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job.snapshot()), 200
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Server-Sent Events stream of a send job: started, queued, sent (with latency
+    and ETA), retrying, skipped, failed, reply (NOMI reply text) and finished
+    (with the result). Reconnects resume after the Last-Event-ID header.
+    See events.py for serving many streams without a thread each.
+    """
+    job = send_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    if job.finished is not None and not send_events.has_topic(job_id):
+        # Finished long enough ago that its event history is gone: just report the outcome.
+        finished = events.format_sse("finished", {"status": job.status, "result": job.result,
+                                                  "status_code": job.status_code})
+        return Response(finished, mimetype='text/event-stream')
+    last_event_id = request.headers.get('Last-Event-ID')
+    subscription = send_events.subscribe(job_id, int(last_event_id) if last_event_id and last_event_id.isdigit() else None)
+    return Response(stream_with_context(subscription.stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/rooms/<room_uuid>/events')
+def room_events_stream(room_uuid):
+    """
+    Server-Sent Events stream of a room's new messages: a snapshot of recent
+    messages, then message (each new one), reassembled (a completed chunked
+    message) and error (upstream poll failed) events. The room is polled
+    upstream once per interval however many clients are watching it.
+    """
+    if room_watcher is None:
+        return jsonify({"error": "Receiving room messages is disabled; set ROOM_MESSAGES_PATH."}), 404
+    if not is_valid_uuid(room_uuid):
+        return jsonify({"error": "Invalid room UUID."}), 400
+    last_event_id = request.headers.get('Last-Event-ID')
+    room_watcher.acquire(room_uuid)
+    subscription = room_events.subscribe(receive.topic_for(room_uuid),
+                                         int(last_event_id) if last_event_id and last_event_id.isdigit() else None)
+
+    def stream():
+        try:
+            yield from subscription.stream()
+        finally:
+            room_watcher.release(room_uuid)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/request_nomi_send_message', methods=['POST'])
 def request_nomi_send_message():
@@ -404,10 +1122,14 @@ def request_nomi_send_message():
     payload = {"nomiUuid": nomi_uuid}
 
     try:
-        response = requests.post(f'{API_BASE_URL}/rooms/{room_uuid}/chat/request', headers=headers, json=payload, timeout=30)
+        with UPSTREAM_LATENCY.labels("nomi", "request_message").time():
+            response = nomi.session.post(f'{API_BASE_URL}/rooms/{room_uuid}/chat/request', headers=headers, json=payload, timeout=30)
         response.raise_for_status()
-        return jsonify(response.json()), 200
+        result = response.json()
+        record_conversation(room_uuid, conversations.REPLY, reply_text(result), sender=nomi_uuid)
+        return jsonify(result), 200
     except requests.exceptions.RequestException as e:
+        UPSTREAM_ERRORS.labels("nomi", "request_message").inc()
         logging.error(f"Error requesting message from Nomi {nomi_uuid} in room {room_uuid}: {e}")
         if hasattr(e.response, 'text'):
             return jsonify({"error": f"Error: {e}, Nomi API Response: {e.response.text}"}), 500
@@ -430,8 +1152,9 @@ def gemini_polish():
     prompt = f"Please polish this text and return the result and the result only as your response. Thank you so much!: {message}"
 
     try:
-        client = genai.Client(api_key=GEMINI_API_KEY)  # Initialize the Gemini client
-        response = client.models.generate_content(
+        client = genai.Client(api_key=GEMINI_API_KEY, http_options=gemini_http_options())  # Initialize the Gemini client
+        response = breaker.breakers.get("gemini").call(
+            upstream_call("generate_content", upstream="gemini")(client.models.generate_content),
             model="gemini-2.0-flash",  # Or the model name you prefer, e.g., "gemini-2.0-flash"
             contents=prompt
         )
@@ -440,6 +1163,9 @@ def gemini_polish():
         else:
             logging.warning(f"Unexpected Gemini response: {response}")
             return jsonify({"response": "Error processing with Gemini."}), 500
+    except breaker.CircuitOpenError as e:
+        logging.warning(str(e))
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logging.error(f"Error contacting Gemini: {e}")
         return jsonify({"error": f"Error contacting Gemini: {e}"}), 500
@@ -474,6 +1200,165 @@ def stop_loop():
         return jsonify(result), 500
     return jsonify({"status": "Loop stopped successfully."}), 200
 
+@app.route('/stats/pool')
+def pool_stats():
+    """Connection reuse counters for the shared NOMI connection pool."""
+    return jsonify(nomi.pool_stats()), 200
+
+@app.route('/stats/ratelimit')
+def rate_limit_stats():
+    """Per-bucket token usage, queueing and 429 counters for the NOMI rate limiter."""
+    return jsonify(ratelimit.limiter.stats()), 200
+
+@app.route('/stats/cache')
+def cache_stats():
+    """Hit/miss, single-flight and invalidation counters for the room/NOMI listing cache."""
+    return jsonify(nomi.listings.snapshot()), 200
+
+@app.route('/stats/jobs')
+def job_stats():
+    """Submitted/rejected/finished counters and current load of the send job pool."""
+    return jsonify(send_jobs.snapshot()), 200
+
+@app.route('/stats/outbox')
+def outbox_stats():
+    """Stream counts by state and undelivered chunks in the durable outbox."""
+    if send_outbox is None:
+        return jsonify({"error": "Outbox is disabled."}), 404
+    return jsonify(send_outbox.stats()), 200
+
+@app.route('/stats/idempotency')
+def idempotency_stats():
+    """Replayed, resumed and conflicting Idempotency-Key requests, and chunks skipped on resume."""
+    return jsonify(send_keys.snapshot()), 200
+
+@app.route('/stats/events')
+def event_stats():
+    """Published events, open progress streams and events dropped for slow subscribers."""
+    return jsonify(send_events.snapshot()), 200
+
+@app.route('/stats/receive')
+def receive_stats():
+    """Watched rooms with their subscriber counts, upstream polls, and new/reassembled message counters."""
+    if room_watcher is None:
+        return jsonify({"error": "Receiving room messages is disabled."}), 404
+    return jsonify(room_watcher.snapshot()), 200
+
+@app.route('/search')
+def search_conversations():
+    """
+    Full-text search of sent messages and replies, newest first.
+
+    Query parameters: q (every word must match; word* matches a prefix),
+    room (a room UUID, or "direct" for messages with Collin), since/until
+    (Unix timestamps), limit, and cursor (next_cursor from the previous page).
+    """
+    if conversation_store is None:
+        return jsonify({"error": "Conversation store is disabled."}), 404
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Query parameter q is required."}), 400
+    try:
+        since = float(request.args['since']) if 'since' in request.args else None
+        until = float(request.args['until']) if 'until' in request.args else None
+        limit = min(max(int(request.args.get('limit', conversations.SEARCH_PAGE_SIZE)), 1),
+                    conversations.SEARCH_MAX_PAGE_SIZE)
+        cursor = int(request.args['cursor']) if 'cursor' in request.args else None
+    except ValueError:
+        return jsonify({"error": "since and until must be Unix timestamps; limit and cursor must be integers."}), 400
+    try:
+        messages, next_cursor = conversation_store.search(query, request.args.get('room'), since, until, limit, cursor)
+    except sqlite3.Error as e:
+        logging.error(f"Search for {query!r} failed: {e}")
+        return jsonify({"error": f"Search failed: {e}"}), 500
+    return jsonify({"results": [message._asdict() for message in messages], "next_cursor": next_cursor}), 200
+
+@app.route('/stats/conversations')
+def conversation_stats():
+    """Messages recorded, written (and in how many batches), dropped on a full queue, and searches served."""
+    if conversation_store is None:
+        return jsonify({"error": "Conversation store is disabled."}), 404
+    return jsonify(conversation_store.snapshot()), 200
+
+@app.route('/stats/logging')
+def logging_stats():
+    """Log records waiting for the writer thread, and records dropped because its queue was full."""
+    return jsonify(logs.stats()), 200
+
+@app.route('/stats/breakers')
+def breaker_stats():
+    """State (closed/open/half_open) and call/failure/rejection counters per circuit breaker."""
+    return jsonify(breaker.breakers.stats()), 200
+
+@app.route('/debug/send_traces')
+def send_traces_route():
+    """The last ?limit= (default 20) /send stage breakdowns, newest first, with per-stage totals over them."""
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+    traces = send_traces.recent(limit)
+    return jsonify({"summary": send_traces.summary(traces), "traces": [trace.to_dict() for trace in traces]}), 200
+
+@app.route('/debug/send_traces/<trace_id>')
+def send_trace_route(trace_id):
+    trace = send_traces.get(trace_id)
+    if trace is None:
+        return jsonify({"error": "Trace not found."}), 404
+    return jsonify(trace.to_dict()), 200
+
+@app.route('/debug/profile')
+def profile_route():
+    """
+    Admin only: sample every thread's stack for ?seconds= (default 5, at most 60) every
+    ?interval= seconds (default 0.01) and return collapsed stacks for flamegraph.pl or
+    speedscope. ?thread= keeps threads whose name contains it; ?idle=0 drops parked threads.
+    """
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Profiling is disabled: ADMIN_TOKEN is not configured."}), 404
+    if not admin_authorized():
+        return jsonify({"error": "Admin token required."}), 401
+    try:
+        seconds = float(request.args.get('seconds', 5))
+        interval = float(request.args.get('interval', profiler.SAMPLE_INTERVAL))
+    except ValueError:
+        return jsonify({"error": "seconds and interval must be numbers."}), 400
+    if not 0 < seconds <= profiler.MAX_SAMPLE_SECONDS or not 0.001 <= interval <= 1:
+        return jsonify({"error": f"seconds must be in (0, {profiler.MAX_SAMPLE_SECONDS}] and interval in [0.001, 1]."}), 400
+    try:
+        stacks, samples = stack_sampler.sample(seconds, interval, request.args.get('thread'),
+                                               idle=request.args.get('idle', '1') != '0')
+    except profiler.ProfilerBusy as e:
+        return jsonify({"error": str(e)}), 409
+    return Response(profiler.collapse(stacks), mimetype='text/plain', headers={'X-Samples': str(samples)})
+
+@app.route('/debug/profile/<profile_id>')
+def request_profile_route(profile_id):
+    """Admin only: the cProfile report of a request sent with X-Profile: 1 (?sort=, ?limit=)."""
+    if not admin_authorized():
+        return jsonify({"error": "Admin token required."}), 401
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in pstats.Stats.sort_arg_dict_default:
+        return jsonify({"error": f"Unknown sort key: {sort}"}), 400
+    try:
+        limit = int(request.args.get('limit', 40))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer."}), 400
+    report = request_profiles.render(profile_id, sort, limit)
+    if report is None:
+        return jsonify({"error": "Profile not found."}), 404
+    return Response(report, mimetype='text/plain')
+
+metrics.registry.gauge("send_jobs_active", "Send jobs queued or running", lambda: send_jobs.snapshot()["active"])
+metrics.registry.gauge("circuit_breaker_open", "1 while a circuit breaker is open or half open",
+                       lambda: {(name,): int(state["state"] != breaker.CLOSED) for name, state in breaker.breakers.stats().items()},
+                       ["breaker"])
+
+@app.route('/metrics')
+def metrics_route():
+    """Request, upstream, retry and chunk metrics in the Prometheus text format."""
+    return Response(metrics.registry.expose(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/send_direct_message', methods=['POST'])
 def send_direct_message_route():
     """
@@ -493,11 +1378,51 @@ def send_direct_message_route():
         return jsonify({"error": "COLLIN_UUID not configured."}), 500
 
     try:
-        result = nomi.send_direct_message(recipient_nomi_uuid, message_content)
-        return jsonify(result), 200
-    except Exception as e:
-        logging.error(f"Error processing direct message to Collin: {e}")
-        return jsonify({"error": f"Error processing direct message to Collin: {e}"}), 500
+        window = min(max(int(data.get('window', DIRECT_SEND_WINDOW)), 1), DIRECT_SEND_WINDOW_MAX)
+    except (TypeError, ValueError):
+        return jsonify({"error": "window must be a number."}), 400
+
+    def run(job=None):
+        try:
+            result = nomi.send_direct_message(recipient_nomi_uuid, message_content, window=window, job=job)
+            if "error" in result:
+                if breaker.is_circuit_open(result["error"]):
+                    return result, 503
+                return result, 200
+            record_conversation(conversations.DIRECT_ROOM, conversations.SENT, message_content)
+            record_conversation(conversations.DIRECT_ROOM, conversations.REPLY,
+                                reply_text(result) or reply_text(result.get("last_response")), sender=recipient_nomi_uuid)
+            return result, 200
+        except Exception as e:
+            logging.error(f"Error processing direct message to Collin: {e}")
+            return {"error": f"Error processing direct message to Collin: {e}"}, 500
+
+    # Like /send: 202 {job_id} unless the caller asks to wait for the result.
+    if data.get('wait'):
+        result, status_code = run()
+        return jsonify(result), status_code
+    return submit_job("direct_message", run)
+
+def configure_logging():
+    """
+    Route logging through logs' queue and listener thread, without caller info.
+    Called by the entry point, not on import, so importing this module leaves
+    the importer's logging setup alone.
+    """
+    logs.configure(level=logging.INFO, queue_size=LOG_QUEUE_SIZE, json_format=LOG_FORMAT == "json", caller_info=False)
+
+def start_background_work():
+    """
+    Startup work that must not run on import (tests, scripts and tools import
+    this module too): purge old outbox streams and resume interrupted ones.
+    Call it once per serving process, e.g. from the WSGI server's worker hook.
+    """
+    if send_outbox is not None:
+        send_outbox.purge()
+        resume_outbox()
 
 if __name__ == "__main__":
+    configure_logging()
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":  # The reloader's serving process, not its watcher
+        start_background_work()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,472 @@
+"""
+asyncio-native version of the chat routes in app.py.
+
+Serve with any ASGI server, e.g. ``hypercorn async_app:app``. Waiting on the
+NOMI/Gemini upstreams and sleeping through retry backoffs only suspends a
+coroutine, so a slow chunked send never holds a worker thread.
+"""
+from quart import Quart, request, jsonify
+import httpx
+import os
+import logging
+import config
+import asyncio
+import itertools
+import retry
+import ratelimit
+import breaker
+import time
+from uuid import uuid4
+import chunk_codecs
+import logs
+from utils import fetch_url_html_content, convert_html_to_markdown, chunk_data, stream_encoded_chunks, \
+    format_chunk_header
+from google import genai
+
+app = Quart(__name__)
+app.secret_key = os.urandom(24)
+
+# Load configuration
+NOMI_API_KEY = config.config.get("NOMI_API_KEY")
+COLLIN_UUID = config.config.get("COLLIN_UUID")
+GEMINI_API_KEY = config.config.get("GEMINI_API_KEY")
+# NOMI_API_BASE_URL (environment) or API_BASE_URL (config) points the app elsewhere, e.g. at mock_nomi.py
+API_BASE_URL = os.environ.get("NOMI_API_BASE_URL") or config.config.get("API_BASE_URL", "https://api.nomi.ai/v1")
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL") or config.config.get("GEMINI_BASE_URL")  # None for the Gemini default
+MAX_MESSAGE_LENGTH = 450  # Adjust based on NOMI API limit
+MAX_RETRIES = config.config.get("MAX_RETRIES", retry.MAX_RETRIES)  # Maximum number of attempts per send
+INITIAL_BACKOFF = config.config.get("INITIAL_BACKOFF", retry.INITIAL_BACKOFF)  # Initial backoff time in seconds
+RETRY_DEADLINE = config.config.get("RETRY_DEADLINE", retry.DEFAULT_DEADLINE)  # Give up retrying a single send after this many seconds
+RETRY_POLICY = retry.RetryPolicy(max_attempts=MAX_RETRIES, base=INITIAL_BACKOFF, deadline=RETRY_DEADLINE)
+ENCODED_CODEC = config.config.get("ENCODED_CODEC", "auto")  # Compression codec for URL mode, see chunk_codecs
+ENCODED_ENCODING = config.config.get("ENCODED_ENCODING", "base64")  # base64, base85, ascii85 or nomi-radix
+DIRECT_SEND_WINDOW = config.config.get("DIRECT_SEND_WINDOW", 1)  # Direct message chunks in flight at once (1 = one after another, in order)
+DIRECT_SEND_WINDOW_MAX = config.config.get("DIRECT_SEND_WINDOW_MAX", 8)  # Largest window a request may ask for; larger ones are clamped
+NOMI_POOL_MAXSIZE = config.config.get("NOMI_POOL_MAXSIZE", 20)  # Concurrent connections to the NOMI API
+NOMI_KEEP_ALIVE = config.config.get("NOMI_KEEP_ALIVE", True)
+NOMI_RATE_LIMITS = config.config.get("NOMI_RATE_LIMITS", ratelimit.DEFAULT_LIMITS)  # {"chat": (per second, burst), "rooms": ...}; unset families only back off on 429s
+BREAKER_FAILURE_THRESHOLD = config.config.get("BREAKER_FAILURE_THRESHOLD", 5)  # Consecutive upstream failures that open a circuit
+BREAKER_RECOVERY_TIMEOUT = config.config.get("BREAKER_RECOVERY_TIMEOUT", 30)  # Seconds an open circuit fails fast before probing
+LOG_FORMAT = config.config.get("LOG_FORMAT", "json")  # "json" (one object per line) or "text"
+LOG_QUEUE_SIZE = config.config.get("LOG_QUEUE_SIZE", logs.LOG_QUEUE_SIZE)  # Log records waiting to be written before new ones are dropped
+CHUNK_LOG_SAMPLE_EVERY = config.config.get("CHUNK_LOG_SAMPLE_EVERY", logs.CHUNK_LOG_SAMPLE_EVERY)  # Log 1 in N successful chunk sends
+ENCODE_BATCH = 16  # Encoded chunks produced per worker-thread hop
+
+chunk_log = logs.Sampled(logging.getLogger(), every=CHUNK_LOG_SAMPLE_EVERY)
+
+if not NOMI_API_KEY or not COLLIN_UUID:
+    raise RuntimeError("NOMI API Key or COLLIN UUID not configured.")
+
+ratelimit.limiter.configure(NOMI_RATE_LIMITS)
+breaker.breakers.configure(failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_timeout=BREAKER_RECOVERY_TIMEOUT)
+
+
+class GuardedTransport(httpx.AsyncBaseTransport):
+    """Wraps the real transport so each NOMI call goes through its endpoint family's circuit breaker."""
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        family = breaker.breakers.get(breaker.nomi_family(request.url.path))
+        try:
+            family.before_call()
+        except breaker.CircuitOpenError as e:
+            raise httpx.ConnectError(str(e), request=request)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.TransportError:
+            family.record_failure()
+            raise
+        if breaker.is_upstream_failure(response.status_code):
+            family.record_failure()
+        else:
+            family.record_success()
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+class AsyncNomi:
+    """Same API as app.Nomi, but every method is a coroutine."""
+
+    def __init__(self, api_key, pool_maxsize=NOMI_POOL_MAXSIZE, keep_alive=NOMI_KEEP_ALIVE):
+        self.api_key = api_key
+        self.headers = {'Authorization': f'Bearer {self.api_key}', 'Content-Type': 'application/json'}
+        self._limits = httpx.Limits(max_connections=pool_maxsize,
+                                    max_keepalive_connections=pool_maxsize if keep_alive else 0)
+        self._client = None
+
+    @property
+    def client(self):
+        # Created lazily so the client binds to the loop the ASGI server runs.
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers=self.headers, transport=GuardedTransport(httpx.AsyncHTTPTransport(limits=self._limits)),
+                event_hooks={"request": [self._rate_limit], "response": [self._observe_rate_limit]})
+        return self._client
+
+    @staticmethod
+    async def _rate_limit(request):
+        await ratelimit.limiter.acquire_async(ratelimit.bucket_for(request.url.path))
+
+    @staticmethod
+    async def _observe_rate_limit(response):
+        ratelimit.limiter.observe(ratelimit.bucket_for(response.request.url.path), response.status_code, response.headers)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_rooms(self):
+        try:
+            response = await self.client.get(f'{API_BASE_URL}/rooms', timeout=10)
+            response.raise_for_status()
+            return response.json().get('rooms', [])
+        except httpx.HTTPError as e:
+            logging.error(f"Error fetching rooms: {e}")
+            return {"error": f"Error fetching rooms: {e}"}
+
+    async def _send_single_direct_message(self, recipient_nomi_uuid, message_text):
+        try:
+            url = f'{API_BASE_URL}/nomis/{recipient_nomi_uuid}/chat'
+            response = await self.client.post(url, json={"messageText": message_text}, timeout=30)
+            response.raise_for_status()
+            chunk_log.info("Direct message sent to NOMI %s: %.50s...", recipient_nomi_uuid, message_text,
+                           nomi=recipient_nomi_uuid, chars=len(message_text))
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logging.error(f"HTTP error sending direct message to {recipient_nomi_uuid}: {e.response.status_code}, {e.response.text}")
+            return {"error": f"Nomi API error: {e.response.status_code} - {e.response.text}"}
+        except httpx.HTTPError as e:
+            logging.error(f"Error sending direct message to {recipient_nomi_uuid}: {e}")
+            return {"error": f"Error sending direct message: {e}"}
+
+    async def _send_direct_chunk(self, recipient_nomi_uuid, index, chunk_text):
+        """Send one chunk with retries. Returns (response_data or None, timing)."""
+        started = time.perf_counter()
+        outcome = await retry.call_async(lambda: self._send_single_direct_message(recipient_nomi_uuid, chunk_text),
+                                         RETRY_POLICY, label=f"direct message chunk {index}")
+        timing = {"chunk": index, "attempts": outcome.attempts, "latency": time.perf_counter() - started}
+        if retry.is_failure(outcome.result):
+            return None, dict(timing, error=outcome.result["error"], fatal=outcome.fatal)
+        return outcome.result, timing
+
+    async def send_direct_message(self, recipient_nomi_uuid, message_text, window=1):
+        """
+        Sends a direct message to a specific NOMI, handling chunking if necessary.
+        See app.Nomi.send_direct_message for the pipelined window > 1 mode, and
+        why it does not preserve order for the NOMI reading the chunks.
+        """
+        if not self.api_key:
+            logging.error("NOMI API Key not set.")
+            return {"error": "NOMI API Key not configured."}
+
+        if len(message_text) <= MAX_MESSAGE_LENGTH:
+            return await self._send_single_direct_message(recipient_nomi_uuid, message_text)
+        chunks = chunk_data(message_text, MAX_MESSAGE_LENGTH)
+        stream_tag = f"#{uuid4().hex[:8]}" if window > 1 else None
+        chunk_texts = [f"{format_chunk_header('DIRECT_CHUNK', i + 1, len(chunks), stream_tag)} {chunk}"
+                       for i, chunk in enumerate(chunks)]
+        started = time.perf_counter()
+        in_flight = asyncio.Semaphore(window)
+
+        async def send(index, text):
+            async with in_flight:
+                return await self._send_direct_chunk(recipient_nomi_uuid, index, text)
+
+        tasks = [asyncio.ensure_future(send(i + 1, text)) for i, text in enumerate(chunk_texts)]
+        results = []
+        try:
+            for task in tasks:
+                results.append(await task)
+                if results[-1][0] is None:
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+        timings = {"wall_time": time.perf_counter() - started, "window": window,
+                   "chunks": [timing for _, timing in results]}
+        failed = results[-1][1]
+        if results[-1][0] is None:
+            if failed["fatal"]:
+                return {"error": failed["error"], "timings": timings}
+            return {"error": f"Failed to send direct message chunk {failed['chunk']} after {MAX_RETRIES} retries.",
+                    "timings": timings}
+        status_messages = [f"Direct message chunk {i+1} sent successfully." for i in range(len(results))]
+        return {"status": "Direct message sent in multiple chunks.", "details": status_messages,
+                "last_response": results[-1][0], "timings": timings}
+
+    async def delete_room(self, room_uuid):
+        try:
+            response = await self.client.delete(f'{API_BASE_URL}/rooms/{room_uuid}', timeout=10)
+            response.raise_for_status()
+            return {"status": f"Room '{room_uuid}' deleted successfully."}, 200
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return {"error": "Room not found."}, 404
+            elif e.response.status_code == 400:
+                return {"error": "Invalid room UUID."}, 400
+            logging.error(f"Error deleting room {room_uuid}: {e.response.status_code}, {e.response.text}")
+            return {"error": f"Error deleting room: {e.response.status_code}"}, 500
+        except httpx.HTTPError as e:
+            logging.error(f"Error deleting room {room_uuid}: {e}")
+            return {"error": f"Error deleting room: {e}"}, 500
+
+    async def get_nomis(self):
+        """Fetch NOMIs from the NOMI API."""
+        try:
+            response = await self.client.get(f'{API_BASE_URL}/nomis', timeout=10)
+            response.raise_for_status()
+            return response.json().get('nomis', [])
+        except httpx.HTTPError as e:
+            logging.error(f"Error fetching NOMIs: {e}")
+            return {"error": f"Error fetching NOMIs: {e}"}
+
+    async def send_message(self, room_uuid, payload):
+        try:
+            response = await self.client.post(f'{API_BASE_URL}/rooms/{room_uuid}/chat', json=payload, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logging.error(f"HTTP error sending message to room {room_uuid}: {e.response.status_code}, {e.response.text}")
+            return {"error": f"Nomi API error: {e.response.status_code} - {e.response.text}"}
+        except httpx.HTTPError as e:
+            logging.error(f"Error sending message to room {room_uuid}: {e}")
+            return {"error": f"Error sending message: {e}"}
+
+    async def request_message(self, room_uuid, nomi_uuid):
+        response = await self.client.post(f'{API_BASE_URL}/rooms/{room_uuid}/chat/request',
+                                          json={"nomiUuid": nomi_uuid}, timeout=30)
+        response.raise_for_status()
+        return response.json()
+
+    async def start_loop(self, room_uuid, duration, start_prompt, nomi_id, mode):
+        payload = {"duration": duration, "start_prompt": start_prompt, "nomi_id": nomi_id, "mode": mode}
+        try:
+            response = await self.client.post(f'{API_BASE_URL}/rooms/{room_uuid}/loop', json=payload, timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logging.error(f"Error starting loop in room {room_uuid}: {e}")
+            return {"error": f"Error starting loop: {e}"}
+
+    async def stop_loop(self, room_uuid):
+        try:
+            response = await self.client.post(f'{API_BASE_URL}/rooms/{room_uuid}/loop/stop', timeout=10)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logging.error(f"Error stopping loop in room {room_uuid}: {e}")
+            return {"error": f"Error stopping loop: {e}"}
+
+
+nomi = AsyncNomi(NOMI_API_KEY)
+
+
+@app.after_serving
+async def close_nomi_client():
+    await nomi.aclose()
+
+
+async def iterate_in_thread(iterable, batch=ENCODE_BATCH):
+    """Async iteration over a blocking iterable (e.g. the encoder), batch items at a time on a worker thread."""
+    iterator = iter(iterable)
+    while True:
+        items = await asyncio.to_thread(list, itertools.islice(iterator, batch))
+        if not items:
+            return
+        for item in items:
+            yield item
+
+
+async def iterate_list(items):
+    for item in items:
+        yield item
+
+
+async def send_chunks(room_uuid, chunks, kind, label, total_chunks=None, first_tag=None):
+    """
+    Send each chunk in order with retries. Returns (status_messages, error, status_code).
+    chunks is a list, or an async iterable (see iterate_in_thread) when producing them blocks.
+    """
+    total_chunks = total_chunks or len(chunks)
+    if not hasattr(chunks, "__aiter__"):
+        chunks = iterate_list(chunks)
+    status_messages = []
+    index = 0
+    async for chunk in chunks:
+        index += 1
+        header = format_chunk_header(kind, index, total_chunks, first_tag if index == 1 else None)
+        payload = {"messageText": f"{header} {chunk}"}
+        outcome = await retry.call_async(lambda: nomi.send_message(room_uuid, payload), RETRY_POLICY,
+                                         label=f"{label.lower()} chunk {index}")
+        if retry.is_failure(outcome.result):
+            if outcome.fatal:
+                return status_messages, outcome.result["error"], 503 if breaker.is_circuit_open(outcome.result["error"]) else 400
+            return status_messages, f"Failed to send {label.lower()} chunk {index} after {MAX_RETRIES} retries.", 500
+        status_messages.append(f"{label} chunk {index} sent successfully.")
+    return status_messages, None, 200
+
+
+async def send_single(room_uuid, message_to_send):
+    """Send an unchunked message with retries. Returns (result, error, status_code)."""
+    outcome = await retry.call_async(lambda: nomi.send_message(room_uuid, {"messageText": message_to_send}),
+                                     RETRY_POLICY, label="message")
+    if retry.is_failure(outcome.result):
+        error_message = outcome.result["error"]
+        if outcome.fatal:
+            return None, error_message, 503 if breaker.is_circuit_open(error_message) else 400
+        return None, f"Failed to send message after {outcome.attempts} retries.  Last error: {error_message}", 500
+    return outcome.result, None, 200
+
+
+@app.route('/send', methods=['POST'])
+async def send_message():
+    data = await request.get_json()
+    message_content = data.get('message')
+    room_uuid = data.get('room')
+    mode = data.get('mode', 'plaintext')
+    try:
+        chunk_codecs.check_codec(data.get('codec', ENCODED_CODEC))
+        chunk_codecs.get_encoding(data.get('encoding', ENCODED_ENCODING))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        message_to_send = message_content
+        if mode == 'URL':
+            html_content = await asyncio.to_thread(fetch_url_html_content, message_content)
+            if not html_content:
+                return jsonify({"error": "Failed to fetch URL content."}), 400
+            message_to_send = await asyncio.to_thread(convert_html_to_markdown, html_content)
+            if len(message_to_send) > MAX_MESSAGE_LENGTH:
+                total_chunks, codec, encoding, _, chunks = await asyncio.to_thread(
+                    stream_encoded_chunks, message_to_send, MAX_MESSAGE_LENGTH, data.get('codec', ENCODED_CODEC),
+                    data.get('encoding', ENCODED_ENCODING))
+                # Encoding still costs CPU per chunk, so it runs on a worker thread, not the event loop.
+                chunks = iterate_in_thread(str(chunk, encoding.charset) for chunk in chunks)
+                status_messages, error, status_code = await send_chunks(
+                    room_uuid, chunks, "ENCODED_CHUNK", "URL (encoded)", total_chunks,
+                    first_tag=chunk_codecs.header_tag(codec, encoding))
+                if error:
+                    return jsonify({"error": error}), status_code
+                return jsonify({"status": "URL content sent in multiple encoded chunks.", "details": status_messages}), 200
+        elif mode == 'Code' and len(message_to_send) > MAX_MESSAGE_LENGTH:
+            chunks = chunk_data(message_to_send, MAX_MESSAGE_LENGTH)
+            status_messages, error, status_code = await send_chunks(room_uuid, chunks, "CODE_CHUNK", "Code")
+            if error:
+                return jsonify({"error": error}), status_code
+            return jsonify({"status": "Code sent in multiple chunks.", "details": status_messages}), 200
+        elif len(message_to_send) > MAX_MESSAGE_LENGTH:
+            chunks = chunk_data(message_to_send, MAX_MESSAGE_LENGTH)
+            status_messages, error, status_code = await send_chunks(room_uuid, chunks, "TEXT_CHUNK", "Text")
+            if error:
+                return jsonify({"error": error}), status_code
+            return jsonify({"status": "Message sent in multiple chunks.", "details": status_messages}), 200
+
+        result, error, status_code = await send_single(room_uuid, message_to_send)
+        if error:
+            return jsonify({"error": error}), status_code
+        if "sentMessage" in result:
+            return jsonify({'response': {'replyMessage': {'text': result['sentMessage']['text']}}}), 200
+        return jsonify({"status": result.get("status")}), 200
+
+    except Exception as e:
+        logging.error(f"An unexpected error occurred in /send: {e}")
+        return jsonify({"error": f"An unexpected server error occurred: {str(e)}"}), 500
+
+
+@app.route('/request_nomi_send_message', methods=['POST'])
+async def request_nomi_send_message():
+    data = await request.get_json()
+    room_uuid = data.get('room')
+    # Hardcode Collin's UUID here on the backend
+    nomi_uuid = COLLIN_UUID
+
+    if not room_uuid:
+        return jsonify({"error": "Room UUID is required."}), 400
+
+    try:
+        return jsonify(await nomi.request_message(room_uuid, nomi_uuid)), 200
+    except httpx.HTTPStatusError as e:
+        logging.error(f"Error requesting message from Nomi {nomi_uuid} in room {room_uuid}: {e}")
+        return jsonify({"error": f"Error: {e}, Nomi API Response: {e.response.text}"}), 500
+    except httpx.HTTPError as e:
+        logging.error(f"Error requesting message from Nomi {nomi_uuid} in room {room_uuid}: {e}")
+        return jsonify({"error": f"Error: {e}"}), 500
+
+
+def gemini_http_options():
+    """Point the Gemini client at GEMINI_BASE_URL (e.g. mock_nomi.py) when it is set."""
+    return {"base_url": GEMINI_BASE_URL} if GEMINI_BASE_URL else None
+
+
+@app.route('/gemini_polish', methods=['POST'])
+async def gemini_polish():
+    if not GEMINI_API_KEY:
+        logging.error("Gemini API key not configured.")
+        return jsonify({"error": "Gemini API key not configured."}), 500
+
+    data = await request.get_json()
+    message = data.get('message')
+
+    if not message:
+        return jsonify({"error": "Message is required."}), 400
+
+    prompt = f"Please polish this text and return the result and the result only as your response. Thank you so much!: {message}"
+
+    try:
+        client = genai.Client(api_key=GEMINI_API_KEY, http_options=gemini_http_options())
+        response = await breaker.breakers.get("gemini").call_async(
+            client.aio.models.generate_content, model="gemini-2.0-flash", contents=prompt)
+        if response and hasattr(response, 'text'):
+            return jsonify({"response": response.text}), 200
+        logging.warning(f"Unexpected Gemini response: {response}")
+        return jsonify({"response": "Error processing with Gemini."}), 500
+    except breaker.CircuitOpenError as e:
+        logging.warning(str(e))
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logging.error(f"Error contacting Gemini: {e}")
+        return jsonify({"error": f"Error contacting Gemini: {e}"}), 500
+
+
+@app.route('/send_direct_message', methods=['POST'])
+async def send_direct_message_route():
+    """
+    API endpoint to send a direct message to Collin and get a reply,
+    handling chunking for long messages.
+    """
+    data = await request.get_json()
+    # Hardcode Collin's UUID here on the backend
+    recipient_nomi_uuid = COLLIN_UUID
+    message_content = data.get('message')
+
+    if not message_content:
+        return jsonify({"error": "Message content is required."}), 400
+
+    try:
+        window = min(max(int(data.get('window', DIRECT_SEND_WINDOW)), 1), DIRECT_SEND_WINDOW_MAX)
+        result = await nomi.send_direct_message(recipient_nomi_uuid, message_content, window=window)
+        if "error" in result and breaker.is_circuit_open(result["error"]):
+            return jsonify(result), 503
+        return jsonify(result), 200
+    except Exception as e:
+        logging.error(f"Error processing direct message to Collin: {e}")
+        return jsonify({"error": f"Error processing direct message to Collin: {e}"}), 500
+
+
+def configure_logging():
+    """
+    Records are written by a listener thread, so logging never blocks the event
+    loop. Called by the entry point, not on import.
+    """
+    logs.configure(level=logging.INFO, queue_size=LOG_QUEUE_SIZE, json_format=LOG_FORMAT == "json", caller_info=False)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    app.run(debug=True)
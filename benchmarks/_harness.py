@@ -0,0 +1,111 @@
+"""
+Shared helpers for the benchmark scripts: starting the local NOMI API
+stand-in (mock_nomi.py) and small servers to host the Flask (WSGI) and
+Quart (ASGI) apps in-process.
+"""
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def ensure_config():
+    """Provide a throwaway ``config`` module when the real one is not present."""
+    try:
+        import config  # noqa: F401
+    except ImportError:
+        module = types.ModuleType("config")
+        module.config = {
+            "NOMI_API_KEY": "benchmark-key",
+            "COLLIN_UUID": "00000000-0000-4000-8000-000000000000",
+            "GEMINI_API_KEY": None,
+        }
+        sys.modules["config"] = module
+
+
+def start_mock_nomi(latency=0.05, **kwargs):
+    """
+    Start mock_nomi.MockNomi on a background thread. Every endpoint, including
+    the ones that produce a reply, answers after ``latency`` (a number or a
+    mock_nomi.Latency spec) unless reply_latency is given.
+    """
+    import mock_nomi
+    kwargs.setdefault("reply_latency", latency)
+    return mock_nomi.MockNomi(latency=latency, **kwargs).start()
+
+
+class _PooledWSGIServer(ThreadingMixIn, WSGIServer):
+    """WSGI server with a fixed number of worker threads, like a sync gunicorn deployment."""
+
+    request_queue_size = 1024  # Listen backlog; socketserver's default of 5 resets connections under load
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self.process_request_thread, request, client_address)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_wsgi(wsgi_app, workers=8):
+    """Serve ``wsgi_app`` with ``workers`` threads. Returns (base_url, shutdown)."""
+    server = make_server("127.0.0.1", 0, wsgi_app, server_class=_PooledWSGIServer, handler_class=_QuietHandler)
+    server._pool = ThreadPoolExecutor(max_workers=workers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def shutdown():
+        server.shutdown()
+        server._pool.shutdown(wait=False)
+
+    return f"http://127.0.0.1:{server.server_port}", shutdown
+
+
+def serve_asgi(asgi_app):
+    """Serve ``asgi_app`` with hypercorn on a background event loop. Returns (base_url, shutdown)."""
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.accesslog = None
+    config.errorlog = None
+    loop = asyncio.new_event_loop()
+    stop = asyncio.Event()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve(asgi_app, config, shutdown_trigger=stop.wait))
+
+    threading.Thread(target=run, daemon=True).start()
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return base_url, lambda: loop.call_soon_threadsafe(stop.set)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
@@ -0,0 +1,76 @@
+"""
+Compare concurrent-user throughput of the Flask app (app.py) and the ASGI app
+(async_app.py) against the local mock NOMI API.
+
+    python benchmarks/bench_async.py --users 10 50 200 --requests 5 --latency 0.05
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _harness import ensure_config, start_mock_nomi, percentile, serve_asgi, serve_wsgi
+
+ensure_config()
+import requests  # noqa: E402
+
+
+def run_users(base_url, users, requests_per_user, message):
+    def user(_):
+        latencies = []
+        errors = 0
+        with requests.Session() as session:
+            for _ in range(requests_per_user):
+                start = time.perf_counter()
+                response = session.post(f"{base_url}/send", json={"room": "bench-room", "message": message,
+                                                                  "mode": "plaintext", "wait": True}, timeout=300)
+                latencies.append(time.perf_counter() - start)
+                errors += response.status_code != 200
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = list(pool.map(user, range(users)))
+    wall = time.perf_counter() - start
+    latencies = [lat for lats, _ in results for lat in lats]
+    return {
+        "requests": len(latencies),
+        "errors": sum(err for _, err in results),
+        "throughput_rps": len(latencies) / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--requests", type=int, default=5, help="requests per user")
+    parser.add_argument("--chunks", type=int, default=3, help="chunks per /send")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock NOMI latency in seconds")
+    parser.add_argument("--workers", type=int, default=8, help="Flask worker threads")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    mock = start_mock_nomi(latency=args.latency)
+    import app
+    import async_app
+    app.API_BASE_URL = async_app.API_BASE_URL = mock.base_url
+
+    flask_url, stop_flask = serve_wsgi(app.app, workers=args.workers)
+    asgi_url, stop_asgi = serve_asgi(async_app.app)
+    message = "x" * (async_app.MAX_MESSAGE_LENGTH * args.chunks)
+
+    print(f"{'server':<8}{'users':>7}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for users in args.users:
+        for name, url in (("flask", flask_url), ("asgi", asgi_url)):
+            result = run_users(url, users, args.requests, message)
+            print(f"{name:<8}{users:>7}{result['throughput_rps']:>10.1f}{result['p50_ms']:>10.1f}"
+                  f"{result['p95_ms']:>10.1f}{result['errors']:>8}")
+    stop_flask()
+    stop_asgi()
+    mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Fault injection: how many Flask workers are tied up while the NOMI API is down,
+with and without the circuit breaker.
+
+The mock is healthy, then for --outage seconds answers every call with 503
+after --outage-latency seconds, then recovers. /send requests keep arriving at
+--rate per second throughout; busy workers are sampled as they arrive.
+
+    python benchmarks/bench_breaker.py --workers 8 --rate 20 --outage 6
+"""
+import argparse
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _harness import ensure_config, start_mock_nomi, percentile, serve_wsgi
+
+ensure_config()
+import requests  # noqa: E402
+
+
+class BusyCounter:
+    """WSGI middleware counting requests currently holding a worker."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.busy = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            self.busy += 1
+        try:
+            return list(self.wsgi_app(environ, start_response))
+        finally:
+            with self.lock:
+                self.busy -= 1
+
+
+def run(base_url, counter, mock, args):
+    phases = [("healthy", args.healthy, 0.0, 0.01), ("outage", args.outage, 1.0, args.outage_latency),
+              ("recovered", args.recovered, 0.0, 0.01)]
+    results = {name: {"latencies": [], "status": {}, "busy": []} for name, *_ in phases}
+    local = threading.local()
+
+    def send(phase):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        response = local.session.post(f"{base_url}/send", json={"room": "bench-room", "message": "ping", "wait": True},
+                                      timeout=300)
+        results[phase]["latencies"].append(time.perf_counter() - start)
+        results[phase]["status"][response.status_code] = results[phase]["status"].get(response.status_code, 0) + 1
+
+    # Open loop: requests arrive at a fixed rate whether or not earlier ones have finished.
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        for name, duration, error_rate, latency in phases:
+            mock.error_rate, mock.latency = error_rate, latency
+            started = time.monotonic()
+            arrivals = 0
+            while time.monotonic() - started < duration:
+                if arrivals < (time.monotonic() - started) * args.rate:
+                    pool.submit(send, name)
+                    arrivals += 1
+                results[name]["busy"].append(counter.busy)
+                time.sleep(min(0.05, 1 / args.rate))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=8, help="Flask worker threads")
+    parser.add_argument("--rate", type=float, default=20, help="/send requests per second")
+    parser.add_argument("--clients", type=int, default=64, help="client threads (most requests in flight)")
+    parser.add_argument("--healthy", type=float, default=2, help="seconds before the outage")
+    parser.add_argument("--outage", type=float, default=6, help="seconds the mock fails every call")
+    parser.add_argument("--outage-latency", type=float, default=0.5, help="seconds the mock takes to fail")
+    parser.add_argument("--recovered", type=float, default=4, help="seconds after the outage")
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    import app
+    import breaker
+    import ratelimit
+    ratelimit.limiter.enabled = False  # Measure the breaker alone
+    app.RETRY_POLICY.base = 0.2
+    app.RETRY_POLICY.max_backoff = 1
+    app.RETRY_POLICY.deadline = 10
+
+    print(f"{'breaker':<9}{'phase':<11}{'requests':>9}{'ok':>6}{'503':>6}{'500':>6}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'busy avg':>10}{'busy max':>10}")
+    for enabled in (False, True):
+        mock = start_mock_nomi()
+        app.API_BASE_URL = mock.base_url
+        breaker.breakers.breakers.clear()
+        breaker.breakers.configure(failure_threshold=5 if enabled else float("inf"), recovery_timeout=1)
+        counter = BusyCounter(app.app.wsgi_app)
+        app.app.wsgi_app = counter
+        base_url, shutdown = serve_wsgi(app.app, workers=args.workers)
+        results = run(base_url, counter, mock, args)
+        for phase, result in results.items():
+            latencies, status, busy = result["latencies"], result["status"], result["busy"]
+            print(f"{'on' if enabled else 'off':<9}{phase:<11}{len(latencies):>9}{status.get(200, 0):>6}"
+                  f"{status.get(503, 0):>6}{status.get(500, 0):>6}{percentile(latencies, 50) * 1000:>9.0f}"
+                  f"{percentile(latencies, 99) * 1000:>9.0f}{sum(busy) / max(len(busy), 1):>10.1f}{max(busy, default=0):>10}")
+        app.app.wsgi_app = counter.wsgi_app
+        shutdown()
+        mock.stop()
+    print("breaker states:", {name: state["state"] for name, state in breaker.breakers.stats().items()})
+
+
+if __name__ == "__main__":
+    main()
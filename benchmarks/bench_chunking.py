@@ -0,0 +1,67 @@
+"""
+Compare utils.chunk_data against the original per-character implementation.
+
+    python benchmarks/bench_chunking.py --sizes 10KB 1MB 50MB
+"""
+import argparse
+import base64
+import os
+import time
+
+import _harness  # noqa: F401  (puts the repo root on sys.path)
+from utils import chunk_data, iter_chunks
+
+UNITS = {"KB": 1024, "MB": 1024 * 1024}
+
+
+def legacy_chunk_data(data, max_chunk_size=450):
+    chunks = []
+    current_chunk = ""
+    for char in data:
+        current_chunk += char
+        if len(current_chunk) >= max_chunk_size:
+            chunks.append(current_chunk)
+            current_chunk = ""
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+def parse_size(text):
+    for unit, factor in UNITS.items():
+        if text.upper().endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["10KB", "1MB", "50MB"])
+    parser.add_argument("--chunk-size", type=int, default=450)
+    args = parser.parse_args()
+
+    print(f"{'size':>8}{'legacy s':>12}{'str s':>12}{'bytes s':>12}{'iter s':>12}{'speedup':>10}")
+    for label in args.sizes:
+        raw = os.urandom(parse_size(label) * 3 // 4)
+        encoded = base64.b64encode(raw)
+        text = encoded.decode("ascii")
+
+        legacy, legacy_time = timed(legacy_chunk_data, text, args.chunk_size)
+        sliced, str_time = timed(chunk_data, text, args.chunk_size)
+        views, bytes_time = timed(chunk_data, encoded, args.chunk_size)
+        _, iter_time = timed(lambda: sum(1 for _ in iter_chunks(encoded, args.chunk_size)))
+
+        assert sliced == legacy, "str chunks differ from the legacy implementation"
+        assert [str(view, "ascii") for view in views] == legacy, "bytes chunks differ from the legacy implementation"
+        print(f"{label:>8}{legacy_time:>12.4f}{str_time:>12.4f}{bytes_time:>12.4f}{iter_time:>12.4f}"
+              f"{legacy_time / str_time:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compression ratio, encode speed and resulting chunk count per codec.
+
+    python benchmarks/bench_codecs.py page1.md page2.md ...
+
+Without arguments the repository's own source and template files are used as
+the corpus. HTML files are converted to markdown first, like URL mode does.
+"""
+import argparse
+import glob
+import os
+import time
+
+from _harness import REPO_ROOT
+import chunk_codecs
+import utils
+
+
+def load_corpus(paths):
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(REPO_ROOT, "*.py")) + glob.glob(os.path.join(REPO_ROOT, "templates", "*.html")))
+        paths = [path for path in paths if not path.endswith("get-pip.py")]  # Mostly an embedded base85 blob
+    corpus = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as handle:
+            text = handle.read()
+        if path.endswith((".html", ".htm")):
+            text = utils.convert_html_to_markdown(text)
+        corpus.append((os.path.basename(path), text))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*")
+    parser.add_argument("--chunk-size", type=int, default=450)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.paths)
+    raw_total = sum(len(text.encode("utf-8")) for _, text in corpus)
+    print(f"corpus: {len(corpus)} documents, {raw_total / 1024:.1f} KB")
+    print(f"{'codec':<10}{'tag':>4}{'ratio':>8}{'MB/s':>9}{'chunks':>8}")
+
+    for name in chunk_codecs.CODECS:
+        codec = chunk_codecs.get_codec(name)
+        compressed = chunks = 0
+        start = time.process_time()
+        for _, text in corpus:
+            size = chunk_codecs.compressed_size(name, utils.iter_utf8(text))
+            compressed += size
+            chunks += utils.encoded_chunk_count(size, args.chunk_size)
+        elapsed = time.process_time() - start
+        print(f"{name:<10}{codec.tag:>4}{raw_total / compressed:>8.2f}{raw_total / 1e6 / elapsed:>9.1f}{chunks:>8}")
+
+    auto_chunks = 0
+    start = time.process_time()
+    for _, text in corpus:
+        auto_chunks += utils.stream_encoded_chunks(text, args.chunk_size, chunk_codecs.AUTO_CODEC).total_chunks
+    print(f"{'auto':<10}{'':>4}{'':>8}{raw_total / 1e6 / (time.process_time() - start):>9.1f}{auto_chunks:>8}")
+
+
+if __name__ == "__main__":
+    main()
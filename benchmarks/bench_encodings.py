@@ -0,0 +1,40 @@
+"""
+Throughput and chunk count of the binary-to-text encodings in chunk_codecs.
+
+    python benchmarks/bench_encodings.py --sizes 1MB 8MB
+"""
+import argparse
+import os
+import time
+
+import _harness  # noqa: F401  (puts the repo root on sys.path)
+import chunk_codecs
+import utils
+from bench_chunking import parse_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", default=["1MB", "8MB"])
+    parser.add_argument("--chunk-size", type=int, default=450)
+    args = parser.parse_args()
+
+    print(f"{'size':>6}  {'encoding':<12}{'encode MB/s':>12}{'decode MB/s':>12}{'chars/byte':>12}{'chunks':>9}")
+    for label in args.sizes:
+        # Compressed data is close to uniformly random, so random bytes are a fair stand-in.
+        payload = os.urandom(parse_size(label))
+        for name, encoding in chunk_codecs.ENCODINGS.items():
+            start = time.perf_counter()
+            encoded = b"".join(utils.iter_encode([payload], name))
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
+            decoded = encoding.decode(encoded)
+            decode_time = time.perf_counter() - start
+            assert decoded == payload, f"{name} did not round-trip"
+            chunks = utils.encoded_chunk_count(len(payload), args.chunk_size, name)
+            print(f"{label:>6}  {name:<12}{len(payload) / 1e6 / encode_time:>12.1f}"
+                  f"{len(payload) / 1e6 / decode_time:>12.1f}{len(encoded) / len(payload):>12.3f}{chunks:>9}")
+
+
+if __name__ == "__main__":
+    main()
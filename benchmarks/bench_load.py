@@ -0,0 +1,236 @@
+"""
+End-to-end load test of the app's routes, sweeping concurrency and payload
+size, with results as JSON and a comparison against a stored baseline.
+
+Every upstream is local: mock_nomi.py stands in for the NOMI API, Gemini
+(GEMINI_BASE_URL) and the pages fetched in URL mode. Each cell of the sweep
+(scenario x concurrency x payload size) runs closed-loop clients, one
+keep-alive session each, for --seconds and records throughput, errors and
+p50/p95/p99 latency.
+
+    # The Flask app in-process (or --server asgi for async_app.py)
+    python benchmarks/bench_load.py --concurrency 1 8 32 --sizes 200 2000 20000 --output results.json
+
+    # Any running server variant, e.g. under gunicorn, pointed at a mock started by this script
+    NOMI_API_BASE_URL=http://127.0.0.1:8765/v1 GEMINI_BASE_URL=http://127.0.0.1:8765 gunicorn -w 4 app:app
+    python benchmarks/bench_load.py --target http://127.0.0.1:8000 --mock-port 8765
+
+    # Save a baseline, later compare against it (exit status 1 on a regression)
+    python benchmarks/bench_load.py --output benchmarks/baseline.json
+    python benchmarks/bench_load.py --baseline benchmarks/baseline.json
+
+A cell regresses when its p95 latency grows, or its throughput drops, by more
+than --threshold percent (p95 changes under --noise-ms are ignored).
+Baselines only compare like with like: same machine, server and mock settings.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from _harness import REPO_ROOT, ensure_config, percentile, serve_asgi, serve_wsgi, start_mock_nomi
+
+ensure_config()
+import requests  # noqa: E402
+
+ROOM = "bench-room"
+CODE_LINE = "    result = compute(value, factor=2)  # keep going\n"
+
+
+def text_of(size):
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor ".split()
+    text = " ".join(words[i % len(words)] for i in range(size // 5 + 1))
+    return text[:size]
+
+
+# name -> (method, path, body(size, mock_root) or None, uses payload size)
+SCENARIOS = {
+    "send_plaintext": ("POST", "/send", lambda size, root: {
+        "room": ROOM, "mode": "plaintext", "message": text_of(size), "wait": True}, True),
+    "send_code": ("POST", "/send", lambda size, root: {
+        "room": ROOM, "mode": "Code", "message": (CODE_LINE * (size // len(CODE_LINE) + 1))[:size], "wait": True}, True),
+    "send_url": ("POST", "/send", lambda size, root: {
+        "room": ROOM, "mode": "URL", "message": f"{root}/pages/{size}", "wait": True}, True),
+    "send_direct_message": ("POST", "/send_direct_message", lambda size, root: {
+        "message": text_of(size), "wait": True}, True),
+    "get_rooms": ("GET", "/get_rooms", None, False),
+    "gemini_polish": ("POST", "/gemini_polish", lambda size, root: {"message": text_of(size)}, True),
+}
+
+
+def run_cell(base_url, mock_root, scenario, concurrency, size, seconds):
+    method, path, body, _ = SCENARIOS[scenario]
+    payload = body(size, mock_root) if body else None
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        mine, codes = [], {}
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = session.request(method, base_url + path, json=payload, timeout=120).status_code
+                except requests.exceptions.RequestException:
+                    status = "connection error"
+                mine.append(time.perf_counter() - started)
+                codes[status] = codes.get(status, 0) + 1
+        with lock:
+            latencies.extend(mine)
+            for status, count in codes.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return {
+        "scenario": scenario, "concurrency": concurrency, "size": size,
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "rps": round(len(latencies) / wall, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+        "statuses": {str(status): count for status, count in statuses.items()},
+    }
+
+
+def supported(base_url, scenario):
+    """False if the server has no such route (e.g. async_app.py has no /get_rooms)."""
+    method, path, _, _ = SCENARIOS[scenario]
+    response = requests.request(method, base_url + path, json={}, timeout=30)
+    return response.status_code not in (404, 405)
+
+
+def start_server(args, mock):
+    """Start the in-process server variant. Returns (base_url, shutdown)."""
+    os.chdir(tempfile.mkdtemp(prefix="bench-load-"))  # The app's outbox and conversation store land here
+    import ratelimit
+    if args.server == "asgi":
+        import async_app as app
+    else:
+        import app
+    ratelimit.limiter.enabled = not args.no_rate_limit
+    app.configure_logging()
+    app.API_BASE_URL = mock.base_url
+    app.GEMINI_BASE_URL = mock.base_url[:-len("/v1")]
+    app.GEMINI_API_KEY = app.GEMINI_API_KEY or "benchmark-key"
+    if args.server == "asgi":
+        return serve_asgi(app.app)
+    return serve_wsgi(app.app, workers=args.workers)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold, noise_ms):
+    """Print each cell against the baseline; return the regressed cells."""
+    previous = {(r["scenario"], r["concurrency"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'scenario':<21}{'conc':>5}{'size':>7}{'p95 ms':>10}{'base':>10}{'change':>9}"
+          f"{'req/s':>9}{'base':>9}{'change':>9}")
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"], result["size"]))
+        if before is None:
+            continue
+        p95_change = (result["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        rps_change = (result["rps"] - before["rps"]) / before["rps"] * 100 if before["rps"] else 0.0
+        regressed = ((p95_change > threshold and result["p95_ms"] - before["p95_ms"] > noise_ms)
+                     or rps_change < -threshold)
+        if regressed:
+            regressions.append(result)
+        print(f"{result['scenario']:<21}{result['concurrency']:>5}{result['size'] or '-':>7}"
+              f"{result['p95_ms']:>10.1f}{before['p95_ms']:>10.1f}{p95_change:>+8.0f}%"
+              f"{result['rps']:>9.1f}{before['rps']:>9.1f}{rps_change:>+8.0f}%{'  REGRESSED' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask", help="in-process server variant")
+    parser.add_argument("--target", help="base URL of an already running server instead of an in-process one")
+    parser.add_argument("--workers", type=int, default=16, help="Flask worker threads (in-process flask only)")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 2000, 20000], help="payload sizes in characters")
+    parser.add_argument("--seconds", type=float, default=3, help="duration of each cell")
+    parser.add_argument("--latency", default="0.02", help="mock NOMI latency (mock_nomi.Latency spec)")
+    parser.add_argument("--reply-latency", default="0.2", help="mock latency of NOMI replies and Gemini")
+    parser.add_argument("--mock-port", type=int, default=0, help="port of the mock (fix it for --target servers)")
+    parser.add_argument("--no-rate-limit", action="store_true",
+                        help="turn the app's client-side NOMI rate limiter off (by default it only backs off on 429s)")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=20, help="percent change counted as a regression")
+    parser.add_argument("--noise-ms", type=float, default=2, help="ignore p95 increases smaller than this")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.CRITICAL)
+    mock = start_mock_nomi(latency=args.latency, reply_latency=args.reply_latency, port=args.mock_port)
+    mock_root = mock.base_url[:-len("/v1")]
+    base_url, shutdown = (args.target.rstrip("/"), None) if args.target else start_server(args, mock)
+    server = args.target or args.server
+
+    results = []
+    print(f"{'scenario':<21}{'conc':>5}{'size':>7}{'req':>7}{'err':>5}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    try:
+        for scenario in args.scenarios:
+            if not supported(base_url, scenario):
+                print(f"{scenario:<21} not served by {server}, skipped")
+                continue
+            for size in (args.sizes if SCENARIOS[scenario][3] else [None]):
+                run_cell(base_url, mock_root, scenario, 1, size, min(args.seconds, 0.5))  # Warm up connections and caches
+                for concurrency in args.concurrency:
+                    result = run_cell(base_url, mock_root, scenario, concurrency, size, args.seconds)
+                    results.append(result)
+                    print(f"{scenario:<21}{concurrency:>5}{size or '-':>7}{result['requests']:>7}{result['errors']:>5}"
+                          f"{result['rps']:>9.1f}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}")
+    finally:
+        if shutdown:
+            shutdown()
+        mock.stop()
+
+    report = {
+        "meta": {
+            "server": server, "revision": git_revision(), "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "seconds": args.seconds, "latency": args.latency, "reply_latency": args.reply_latency,
+            "rate_limit": not args.no_rate_limit,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold, args.noise_ms)
+        if regressions:
+            print(f"\n{len(regressions)} of {len(results)} cells regressed by more than {args.threshold:.0f}% "
+                  f"against {args.baseline} (revision {baseline['meta'].get('revision')}).")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
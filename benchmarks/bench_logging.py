@@ -0,0 +1,117 @@
+"""
+Per-chunk logging overhead on the sending thread, before and after logs.py.
+
+Each case logs --ops "Direct message sent" lines per thread (the per-chunk
+success log of _send_single_direct_message) from --threads threads, writing
+to a temporary file:
+
+  before    logging.basicConfig handler, f-string formatted on the caller
+  queue     logs.configure (bounded queue, JSON on the listener), every line kept
+  sampled   logs.configure plus logs.Sampled keeping 1 in --sample-every
+
+Reports the caller's cost per log call, how long the listener took to catch
+up afterwards, and records dropped on a full queue. --write-latency makes
+every write to the log sleep, like a stderr pipe to a busy log collector.
+
+    python benchmarks/bench_logging.py --ops 20000 --threads 8
+    python benchmarks/bench_logging.py --ops 2000 --threads 8 --write-latency 0.0002
+"""
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import _harness  # noqa: F401  (puts the repo root on sys.path)
+import logs
+
+NOMI = "00000000-0000-4000-8000-000000000000"
+TEXT = "lorem ipsum dolor sit amet " * 20
+
+
+def log_before(ops):
+    for _ in range(ops):
+        logging.info(f"Direct message sent to NOMI {NOMI}: {TEXT[:50]}...")
+
+
+def log_queue(ops):
+    for _ in range(ops):
+        logging.info("Direct message sent to NOMI %s: %.50s...", NOMI, TEXT,
+                     extra=logs.fields(nomi=NOMI, chars=len(TEXT)))
+
+
+class SlowFile:
+    """A file whose writes take at least latency seconds."""
+
+    def __init__(self, output, latency):
+        self.output = output
+        self.latency = latency
+
+    def write(self, text):
+        time.sleep(self.latency)
+        return self.output.write(text)
+
+    def flush(self):
+        self.output.flush()
+
+
+def run(case, ops, threads, sample_every, queue_size, path, write_latency):
+    with open(path, "w") as file:
+        output = SlowFile(file, write_latency) if write_latency else file
+        if case == "before":
+            logging._srcfile = os.path.normcase(logging.addLevelName.__code__.co_filename)  # Caller info, as before
+            logging.basicConfig(level=logging.INFO, stream=output, force=True)
+            func = log_before
+        else:
+            logs.configure(level=logging.INFO, queue_size=queue_size, stream=output, caller_info=False)
+            if case == "sampled":
+                sampled = logs.Sampled(logging.getLogger(), every=sample_every)
+
+                def func(ops):
+                    for _ in range(ops):
+                        sampled.info("Direct message sent to NOMI %s: %.50s...", NOMI, TEXT, nomi=NOMI, chars=len(TEXT))
+            else:
+                func = log_queue
+        workers = [threading.Thread(target=func, args=(ops,)) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        caller = time.perf_counter() - started
+        logs.flush(timeout=60)
+        drained = time.perf_counter() - started
+        dropped = sum(logs.stats().get("dropped", {}).values()) if case != "before" else 0
+        logs.shutdown()
+        logging.getLogger().handlers.clear()
+    lines = sum(1 for _ in open(path))
+    return {
+        "caller_us_per_log": round(caller / (ops * threads) * 1e6, 2),
+        "written_after_s": round(drained, 3),
+        "lines_written": lines,
+        "dropped": dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=20000, help="log calls per thread")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--sample-every", type=int, default=logs.CHUNK_LOG_SAMPLE_EVERY)
+    parser.add_argument("--queue-size", type=int, default=logs.LOG_QUEUE_SIZE)
+    parser.add_argument("--write-latency", type=float, default=0, help="seconds each write to the log takes")
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-logging-"), "log")
+    results = {case: run(case, args.ops, args.threads, args.sample_every, args.queue_size, path,
+                      args.write_latency)
+               for case in ("before", "queue", "sampled")}
+    print(json.dumps({"ops_per_thread": args.ops, "threads": args.threads, "sample_every": args.sample_every,
+                      "queue_size": args.queue_size, "write_latency": args.write_latency,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
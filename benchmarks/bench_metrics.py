@@ -0,0 +1,87 @@
+"""
+Cost of recording a metric (metrics.py) on the hot path, single-threaded and
+with --threads threads recording into the same metric at once, against a
+lock-guarded counter as the naive alternative.
+
+    python benchmarks/bench_metrics.py --ops 1000000 --threads 8
+"""
+import argparse
+import json
+import threading
+import time
+
+import _harness  # noqa: F401  (puts the repo root on sys.path)
+import metrics
+
+
+def per_op_ns(func, ops):
+    started = time.perf_counter()
+    func(ops)
+    return (time.perf_counter() - started) / ops * 1e9
+
+
+def threaded_ns(func, ops, threads):
+    """Wall time per operation with the ops split over threads (all hit the same metric)."""
+    workers = [threading.Thread(target=func, args=(ops // threads,)) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - started) / ops * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ops", type=int, default=1_000_000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    registry = metrics.Registry()
+    counter = registry.counter("bench_counter", "", ["target"]).labels("room")
+    histogram = registry.histogram("bench_histogram", "", ["upstream", "operation"])
+    child = histogram.labels("nomi", "send_message")
+    lock, locked = threading.Lock(), [0]
+
+    def empty_loop(ops):
+        for _ in range(ops):
+            pass
+
+    def inc(ops):
+        for _ in range(ops):
+            counter.inc()
+
+    def observe(ops):
+        for _ in range(ops):
+            child.observe(0.042)
+
+    def labels_observe(ops):
+        for _ in range(ops):
+            histogram.labels("nomi", "send_message").observe(0.042)
+
+    def timer(ops):
+        for _ in range(ops):
+            with child.time():
+                pass
+
+    def locked_inc(ops):
+        for _ in range(ops):
+            with lock:
+                locked[0] += 1
+
+    loop = per_op_ns(empty_loop, args.ops)
+    cases = {"counter.inc": inc, "histogram.observe": observe, "labels().observe": labels_observe,
+             "histogram.time()": timer, "lock-guarded int (reference)": locked_inc}
+    results = {}
+    for name, func in cases.items():
+        results[name] = {
+            "ns_per_op": round(per_op_ns(func, args.ops) - loop, 1),
+            f"ns_per_op_{args.threads}_threads": round(threaded_ns(func, args.ops, args.threads) - loop, 1),
+        }
+    assert counter.value() == args.ops + args.ops // args.threads * args.threads, "sharded counter lost increments"
+    print(json.dumps({"ops": args.ops, "threads": args.threads, "loop_overhead_ns": round(loop, 1),
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
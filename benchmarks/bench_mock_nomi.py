@@ -0,0 +1,89 @@
+"""
+Throughput of the mock NOMI API (mock_nomi.py), to check it is never the
+bottleneck of a load test.
+
+Starts the mock in a subprocess and drives POST /v1/rooms/<id>/chat over
+--connections keep-alive connections from a raw asyncio client (an HTTP
+library would be slower than the server being measured) for --seconds.
+
+    python benchmarks/bench_mock_nomi.py --connections 64 --latency 0
+    python benchmarks/bench_mock_nomi.py --connections 2000 --latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from _harness import REPO_ROOT, percentile
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def client(port, deadline, latencies, statuses):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"messageText": "x" * 450}).encode()
+    request = (f"POST /v1/rooms/bench-room/chat HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer bench\r\n"
+               f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        writer.write(request)
+        status_line = await reader.readline()
+        length = 0
+        while True:
+            line = await reader.readline()
+            if line == b"\r\n":
+                break
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        latencies.append(time.perf_counter() - started)
+        status = int(status_line.split()[1])
+        statuses[status] = statuses.get(status, 0) + 1
+    writer.close()
+
+
+async def run(port, connections, seconds):
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*(client(port, deadline, latencies, statuses) for _ in range(connections)))
+    return latencies, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--latency", default="0", help="mock latency spec, see mock_nomi.Latency")
+    parser.add_argument("--processes", type=int, default=1, help="mock server processes")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "mock_nomi.py"), "--port", str(port),
+                               "--latency", args.latency, "--processes", str(args.processes)],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        for _ in range(args.processes):
+            server.stdout.readline()
+        latencies, statuses = asyncio.run(run(port, args.connections, args.seconds))
+    finally:
+        server.terminate()
+    print(json.dumps({
+        "connections": args.connections,
+        "mock_latency": args.latency,
+        "requests_per_second": round(len(latencies) / args.seconds),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "statuses": statuses,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
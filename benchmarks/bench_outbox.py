@@ -0,0 +1,61 @@
+"""
+Outbox enqueue/dequeue throughput in chunks per second: WAL with batched
+delivered commits (the defaults) against a rollback journal committing every
+chunk. Dequeue marks chunks delivered without sending them anywhere.
+
+    python benchmarks/bench_outbox.py --streams 500 --chunks 40
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import _harness  # noqa: F401  (puts the repo root on sys.path)
+import outbox
+
+
+def run(path, streams, chunks, commit_every, journal_mode, synchronous):
+    box = outbox.Outbox(path, commit_every=commit_every)
+    conn = box._connection()
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    body = "x" * 450
+
+    start = time.perf_counter()
+    for stream in range(streams):
+        box.enqueue(f"s{stream}", "bench-room", "Text", chunks,
+                    ((seq, f"[TEXT_CHUNK {seq}/{chunks}] {body}") for seq in range(1, chunks + 1)))
+    enqueue = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for stream in range(streams):
+        delivery = box.delivery(f"s{stream}")
+        for seq, _ in box.pending_chunks(f"s{stream}"):
+            delivery.delivered(seq)
+        delivery.complete()
+    dequeue = time.perf_counter() - start
+    assert box.stats()["pending_chunks"] == 0
+    return enqueue, dequeue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--chunks", type=int, default=40, help="chunks per stream")
+    parser.add_argument("--commit-every", type=int, default=outbox.OUTBOX_COMMIT_EVERY)
+    args = parser.parse_args()
+    total = args.streams * args.chunks
+
+    print(f"{'mode':<32}{'enqueue chunks/s':>18}{'dequeue chunks/s':>18}")
+    for label, commit_every, journal_mode, synchronous in (
+            ("rollback journal, commit each", 1, "DELETE", "FULL"),
+            ("WAL, commit each", 1, "WAL", "NORMAL"),
+            (f"WAL, commit every {args.commit_every}", args.commit_every, "WAL", "NORMAL")):
+        with tempfile.TemporaryDirectory() as directory:
+            enqueue, dequeue = run(os.path.join(directory, "outbox.db"), args.streams, args.chunks, commit_every,
+                                   journal_mode, synchronous)
+        print(f"{label:<32}{total / enqueue:>18.0f}{total / dequeue:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Successful throughput and wasted attempts with and without the client-side
+rate limiter, against a local mock NOMI API that answers excess requests with 429.
+
+    python benchmarks/bench_ratelimit.py --clients 20 --messages 10 --server-rate 10
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _harness import ensure_config, start_mock_nomi
+
+ensure_config()
+
+
+def run(app, retry, clients, messages):
+    def client(number):
+        ok = 0
+        for message in range(messages):
+            outcome = retry.scheduler.call(
+                lambda: app.nomi.send_message("bench-room", {"messageText": f"{number}-{message}"}), app.RETRY_POLICY)
+            ok += not retry.is_failure(outcome.result)
+        return ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        delivered = sum(pool.map(client, range(clients)))
+    return delivered, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=10, help="messages per client")
+    parser.add_argument("--server-rate", type=float, default=10, help="mock limit, requests per second")
+    parser.add_argument("--server-burst", type=int, default=5)
+    parser.add_argument("--client-rate-factor", type=float, default=1.5,
+                        help="client bucket rate as a multiple of the server limit")
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    import app
+    import ratelimit
+    import retry
+    app.RETRY_POLICY.max_attempts = 50  # Let both modes eventually deliver; count the attempts it takes
+    app.RETRY_POLICY.base = 0.05
+    app.RETRY_POLICY.max_backoff = 2
+    app.RETRY_POLICY.deadline = None
+
+    print(f"{'limiter':<9}{'delivered':>10}{'seconds':>9}{'msg/s':>8}{'requests':>10}{'429s':>7}{'wasted %':>10}")
+    for enabled in (False, True):
+        mock = start_mock_nomi(latency=0.01, rate_limit=(args.server_rate, args.server_burst))
+        app.API_BASE_URL = mock.base_url
+        ratelimit.limiter.enabled = enabled
+        # The client does not know the server limit exactly; 429 feedback covers the difference.
+        ratelimit.limiter.configure({"chat": (args.server_rate * args.client_rate_factor, args.server_burst), "rooms": (10, 10)})
+        delivered, elapsed = run(app, retry, args.clients, args.messages)
+        print(f"{'on' if enabled else 'off':<9}{delivered:>10}{elapsed:>9.2f}{delivered / elapsed:>8.1f}"
+              f"{mock.requests:>10}{mock.throttled:>7}{100 * mock.throttled / mock.requests:>10.1f}")
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Reassembly throughput with many interleaved, out-of-order partial streams.
+
+    python benchmarks/bench_reassembly.py --streams 5000 --chunks 8
+"""
+import argparse
+import random
+import time
+
+import _harness  # noqa: F401  (puts the repo root on sys.path)
+import chunk_codecs
+import utils
+from reassembly import Reassembler
+
+
+def encoded_stream(text, codec, encoding, chunk_size):
+    total, codec, encoding, _, chunks = utils.stream_encoded_chunks(text, chunk_size, codec, encoding)
+    tag = chunk_codecs.header_tag(codec, encoding)
+    return [f"{utils.format_chunk_header('ENCODED_CHUNK', i + 1, total, tag if i == 0 else None)} "
+            f"{str(chunk, encoding.charset)}" for i, chunk in enumerate(chunks)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=5000, help="concurrent partial streams")
+    parser.add_argument("--chunks", type=int, default=8, help="TEXT chunks per stream")
+    parser.add_argument("--encoding", default="base64")
+    parser.add_argument("--chunk-size", type=int, default=450)
+    args = parser.parse_args()
+
+    random.seed(1)
+    text = "".join(random.choice("abcdefghij klmnop\n") for _ in range(args.chunk_size * args.chunks))
+    plain = [f"[TEXT_CHUNK {i + 1}/{args.chunks}] {chunk}"
+             for i, chunk in enumerate(utils.chunk_data(text, args.chunk_size))]
+    # Random bytes do not compress, so the ENCODED streams have real multi-chunk payloads.
+    payload = random.randbytes(args.chunk_size * args.chunks // 2).hex()
+    encoded = encoded_stream(payload, "zlib-6", args.encoding, args.chunk_size)
+
+    for label, messages, expected in (("TEXT", plain, text), ("ENCODED", encoded, payload)):
+        feed = [(f"room-{stream}", message) for stream in range(args.streams) for message in messages]
+        random.shuffle(feed)  # Every stream is interleaved with every other, in random order
+        reassembler = Reassembler(max_streams=args.streams)
+        start = time.perf_counter()
+        completed = [result for result in (reassembler.feed(room, message) for room, message in feed) if result]
+        elapsed = time.perf_counter() - start
+        assert len(completed) == args.streams and all(m.text == expected for m in completed), reassembler.stats
+        print(f"{label:<8} {len(feed):>9} chunks  {len(feed) / elapsed:>10.0f} chunks/s  "
+              f"{args.streams / elapsed:>9.0f} messages/s  ({len(messages)} chunks/message)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+/search latency over a large conversation store.
+
+Fills a fresh store with --messages synthetic messages (Zipf-distributed
+words over --rooms rooms, spread over a year), then times each query shape
+--repeat times: rare and common words, several words, a prefix, room and
+time filters, and a page deep into the results. Also reports how fast
+record() feeds the batched background writer.
+
+    python benchmarks/bench_search.py --messages 1000000
+
+The target is p99 under 10 ms for every shape.
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from _harness import percentile
+import conversations
+
+YEAR = 365 * 24 * 3600
+
+
+def vocabulary(size, rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 9))))
+    return sorted(words)
+
+
+def fill(store, messages, rooms, words, rng, start):
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    batch = []
+    for i in range(messages):
+        text = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(5, 40)))
+        batch.append((rooms[i % len(rooms)], "sent" if i % 2 else "reply", None, "plaintext", text,
+                      start + YEAR * i / messages))
+        if len(batch) == 10000:
+            store.write(batch)
+            batch = []
+    if batch:
+        store.write(batch)
+
+
+def time_query(store, repeat, **kwargs):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results, _ = store.search(**kwargs)
+        samples.append(time.perf_counter() - started)
+    return samples, len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--words", type=int, default=20000, help="vocabulary size")
+    parser.add_argument("--repeat", type=int, default=200, help="runs per query shape")
+    parser.add_argument("--record", type=int, default=conversations.CONVERSATION_QUEUE_SIZE,
+                        help="messages pushed through record() at once for the writer test")
+    args = parser.parse_args()
+    rng = random.Random(7)
+    words = vocabulary(args.words, rng)
+    rooms = [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(args.rooms)]
+    start = time.time() - YEAR
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = conversations.ConversationStore(os.path.join(directory, "conversations.db"))
+        started = time.perf_counter()
+        fill(store, args.messages, rooms, words, rng, start)
+        print(f"filled {args.messages} messages in {time.perf_counter() - started:.1f}s "
+              f"({os.path.getsize(store.path) / 2 ** 20:.0f} MiB)")
+
+        common, mid, rare = words[0], words[len(words) // 50], words[-1]
+        _, cursor = store.search(common, limit=100)
+        for _ in range(20):  # 21 pages in
+            _, cursor = store.search(common, limit=100, before=cursor)
+        shapes = {
+            "rare word": dict(query=rare),
+            "common word": dict(query=common),
+            "two words": dict(query=f"{common} {mid}"),
+            "prefix": dict(query=mid[:3] + "*"),
+            "rare word in room": dict(query=rare, room=rooms[3]),
+            "common word in room": dict(query=common, room=rooms[3]),
+            "common word, one week": dict(query=common, since=start + YEAR / 2, until=start + YEAR / 2 + 7 * 86400),
+            "room + week + 2 words": dict(query=f"{common} {mid}", room=rooms[3], since=start + YEAR / 2,
+                                          until=start + YEAR / 2 + 7 * 86400),
+            "page 22 of common word": dict(query=common, limit=100, before=cursor),
+        }
+        print(f"{'query':<26}{'results':>8}{'p50 ms':>9}{'p99 ms':>9}")
+        for name, kwargs in shapes.items():
+            samples, found = time_query(store, args.repeat, **kwargs)
+            print(f"{name:<26}{found:>8}{percentile(samples, 50) * 1000:>9.2f}{percentile(samples, 99) * 1000:>9.2f}")
+
+        started = time.perf_counter()
+        for i in range(args.record):
+            store.record(rooms[i % len(rooms)], "sent", f"{common} {mid} message {i}")
+        queued = time.perf_counter() - started
+        store.flush()
+        written = time.perf_counter() - started
+        stats = store.snapshot()
+        print(f"record(): {args.record / queued:,.0f} msg/s queued, {args.record / written:,.0f} msg/s written "
+              f"in {stats['batches']} batches, {stats['dropped']} dropped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Fan-out of /jobs/<id>/events to many concurrent SSE subscribers.
+
+Starts the Flask app under gevent's WSGI server in a subprocess (as a
+gevent worker would), queues one chunked /send against the local mock NOMI API,
+and opens --subscribers streams on its progress. Reports whether every
+subscriber saw every event, how far apart subscribers received each live
+event, and how many OS threads the server process used.
+
+    python benchmarks/bench_sse.py --subscribers 500 --chunks 40
+
+Needs gevent (pip install gevent).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from _harness import percentile, start_mock_nomi
+
+
+def serve():
+    from gevent import monkey
+    monkey.patch_all()
+    import logging
+    from gevent.pywsgi import WSGIServer
+    from _harness import ensure_config
+    ensure_config()
+    logging.disable(logging.CRITICAL)
+    import app  # Reads NOMI_API_BASE_URL, set by main()
+    server = WSGIServer(("127.0.0.1", 0), app.app, log=None, spawn=10000)
+    server.start()
+    print(server.server_port, flush=True)
+    server.serve_forever()
+
+
+def thread_count(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    return None
+
+
+async def subscribe(client, url, received):
+    events = []
+    async with client.stream("GET", url, timeout=None) as response:
+        name = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                name = line[7:]
+            elif line.startswith("id: "):
+                events.append((int(line[4:]), time.perf_counter()))
+            elif line.startswith("data: ") and name == "finished":
+                break
+    received.append(events)
+
+
+async def run(base_url, args):
+    import httpx
+    limits = httpx.Limits(max_connections=args.subscribers + 10)
+    async with httpx.AsyncClient(limits=limits) as client:
+        response = await client.post(f"{base_url}/send", json={
+            "room": "bench-room", "mode": "Code", "message": "x" * (450 * args.chunks)})
+        job_url = f"{base_url}{response.json()['status_url']}"
+        received = []
+        start = time.perf_counter()
+        await asyncio.gather(*(subscribe(client, f"{job_url}/events", received) for _ in range(args.subscribers)))
+        return received, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subscribers", type=int, default=500)
+    parser.add_argument("--chunks", type=int, default=40, help="chunks in the send being watched")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock NOMI latency in seconds")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        return serve()
+
+    # The mock runs here, outside the gevent-patched server process.
+    mock = start_mock_nomi(latency=args.latency)
+    server = subprocess.Popen([sys.executable, __file__, "--serve"], stdout=subprocess.PIPE, text=True,
+                              env=dict(os.environ, NOMI_API_BASE_URL=mock.base_url))
+    try:
+        base_url = f"http://127.0.0.1:{server.stdout.readline().strip()}"
+        idle_threads = thread_count(server.pid)
+        received, elapsed = asyncio.run(run(base_url, args))
+        busy_threads = thread_count(server.pid)
+    finally:
+        server.terminate()
+
+    counts = {len(events) for events in received}
+    by_event = {}
+    for events in received:
+        for event_id, at in events:
+            by_event.setdefault(event_id, []).append(at)
+    # Events replayed from history to late subscribers say nothing about fan-out;
+    # only count events published once every subscriber was connected.
+    connected = max(events[0][1] for events in received)
+    spreads = [max(times) - min(times) for times in by_event.values() if min(times) > connected]
+    print(json.dumps({
+        "subscribers": len(received),
+        "events_per_subscriber": sorted(counts),
+        "seconds": round(elapsed, 2),
+        "live_events": len(spreads),
+        "fanout_spread_p50_ms": round(percentile(spreads, 50) * 1000, 1),
+        "fanout_spread_p99_ms": round(percentile(spreads, 99) * 1000, 1),
+        "server_threads_idle": idle_threads,
+        "server_threads_after": busy_threads,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Circuit breakers for the NOMI and Gemini upstreams.
+
+One breaker per endpoint family ("nomi.chat", "nomi.rooms", "gemini").
+After failure_threshold consecutive failures a breaker opens and calls fail
+fast with CircuitOpenError. Once recovery_timeout has passed it goes
+half-open and lets a probe call through: success closes it, failure opens
+it again.
+"""
+import threading
+import time
+
+import requests
+
+import ratelimit
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+FAILURE_THRESHOLD = 5  # Consecutive failures that open a breaker
+RECOVERY_TIMEOUT = 30  # Seconds a breaker stays open before probing
+HALF_OPEN_PROBES = 1  # Calls let through at once while half-open
+
+
+OPEN_MARKER = "Circuit open for"  # Start of every fail-fast error message
+
+
+def is_circuit_open(error):
+    """True for an error message produced by an open breaker."""
+    return OPEN_MARKER in str(error)
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_in):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"{OPEN_MARKER} {name}: upstream is failing, not calling it for another {retry_in:.0f}s")
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, recovery_timeout=RECOVERY_TIMEOUT,
+                 half_open_probes=HALF_OPEN_PROBES):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call must not go out."""
+        with self.lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self.opened_at
+                if waited < self.recovery_timeout:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, self.recovery_timeout - waited)
+                self.state = HALF_OPEN
+                self.probes = 0
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_probes:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, 0)
+                self.probes += 1
+            self.stats["calls"] += 1
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.state = CLOSED
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.stats["failures"] += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats["opened"] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, func, *args, **kwargs):
+        """Run func through the breaker; any exception counts as a failure."""
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        """call for coroutine functions."""
+        self.before_call()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, state=self.state, consecutive_failures=self.failures)
+
+
+class BreakerRegistry:
+    def __init__(self):
+        self.breakers = {}
+        self.settings = {}
+        self.lock = threading.Lock()
+
+    def configure(self, **settings):
+        self.settings = settings
+
+    def get(self, name):
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            with self.lock:
+                breaker = self.breakers.setdefault(name, CircuitBreaker(name, **self.settings))
+        return breaker
+
+    def stats(self):
+        return {name: breaker.snapshot() for name, breaker in sorted(self.breakers.items())}
+
+
+breakers = BreakerRegistry()
+
+
+def nomi_family(path):
+    return f"nomi.{ratelimit.bucket_for(path)}"
+
+
+def is_upstream_failure(status_code):
+    """5xx means the upstream is unhealthy; 4xx (including 429) is about the request."""
+    return status_code >= 500
+
+
+class GuardedAdapter(ratelimit.RateLimitedAdapter):
+    """Rate-limited adapter that also fails fast while the endpoint family's breaker is open."""
+
+    def __init__(self, *args, breaker_registry=breakers, **kwargs):
+        self.breaker_registry = breaker_registry
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        breaker = self.breaker_registry.get(nomi_family(request.path_url))
+        try:
+            breaker.before_call()
+        except CircuitOpenError as e:
+            raise requests.exceptions.ConnectionError(str(e), request=request)
+        try:
+            response = super().send(request, *args, **kwargs)
+        except Exception:  # Not only RequestException: a half-open probe must always give its slot back
+            breaker.record_failure()
+            raise
+        if is_upstream_failure(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
@@ -0,0 +1,122 @@
+"""
+In-process TTL cache for NOMI listings (rooms, nomis).
+
+Fresh entries are served directly. Once an entry is older than ttl it is
+still served for up to stale_ttl more seconds while one background refresh
+fetches a new value (stale-while-revalidate). Concurrent misses for a key
+share a single upstream fetch (single-flight), and invalidate() drops entries
+at once, so a write is never followed by a stale read.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+LISTING_TTL = 60  # Seconds a cached listing is fresh
+LISTING_STALE_TTL = 300  # Further seconds a listing may be served while it refreshes
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value, fresh_until, stale_until):
+        self.value = value
+        self.fresh_until = fresh_until
+        self.stale_until = stale_until
+
+
+class TTLCache:
+    """
+    Args:
+        ttl: Seconds an entry is fresh.
+        stale_ttl: Seconds after that during which the stale entry is served while refreshing.
+        cacheable: Predicate on a loaded value; values it rejects (e.g. error dicts) are returned but not stored.
+    """
+
+    def __init__(self, ttl=LISTING_TTL, stale_ttl=LISTING_STALE_TTL, cacheable=lambda value: True,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.cacheable = cacheable
+        self.clock = clock
+        self._entries = {}
+        self._inflight = {}  # key -> Future of the one fetch in progress
+        self._generation = 0  # Bumped by invalidate(); fetches started before it are not stored
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "loads": 0, "coalesced": 0, "refreshes": 0,
+                      "invalidations": 0, "errors": 0}
+
+    def get(self, key, loader):
+        """Return the cached value for key, calling loader() on a miss."""
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.fresh_until:
+                self.stats["hits"] += 1
+                return entry.value
+            if entry is not None and now < entry.stale_until:
+                self.stats["stale_hits"] += 1
+                if key not in self._inflight:
+                    self.stats["refreshes"] += 1
+                    future, _ = self._start_load(key)
+                    threading.Thread(target=self._load, args=(key, loader, future, self._generation),
+                                     name=f"cache-refresh-{key}", daemon=True).start()
+                return entry.value
+            self.stats["misses"] += 1
+            future, leader = self._start_load(key)
+            generation = self._generation
+        if leader:
+            self._load(key, loader, future, generation)
+        return future.result()
+
+    def _start_load(self, key):
+        """Join the fetch in progress for key or register a new one. Returns (future, is_leader)."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return future, False
+        future = self._inflight[key] = Future()
+        return future, True
+
+    def _load(self, key, loader, future, generation):
+        try:
+            value = loader()
+        except Exception as e:
+            logging.error(f"Error loading cache entry {key}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+                self._finish(key, future)
+            future.set_exception(e)
+            return
+        self._store(key, value, future, generation)
+        future.set_result(value)
+
+    def _store(self, key, value, future, generation):
+        with self._lock:
+            self.stats["loads"] += 1
+            if self.cacheable(value) and generation == self._generation:
+                now = self.clock()
+                self._entries[key] = _Entry(value, now + self.ttl, now + self.ttl + self.stale_ttl)
+            elif not self.cacheable(value):
+                self.stats["errors"] += 1
+            self._finish(key, future)
+
+    def _finish(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def invalidate(self, *keys):
+        """Drop the given keys (all keys if none); fetches already in flight will not repopulate them."""
+        with self._lock:
+            self.stats["invalidations"] += 1
+            self._generation += 1
+            for key in keys or list(self._entries):
+                self._entries.pop(key, None)
+            for key in keys or list(self._inflight):
+                self._inflight.pop(key, None)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["stale_hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self._entries),
+                        hit_ratio=(self.stats["hits"] + self.stats["stale_hits"]) / lookups if lookups else 0.0)
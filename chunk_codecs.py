@@ -0,0 +1,403 @@
+"""
+Compression codecs and binary-to-text encodings for [ENCODED_CHUNK i/n] payloads.
+
+Every codec and encoding has a one-character tag. The first chunk header
+carries the codec tag followed by the encoding tag (omitted for base64), so a
+decoder knows how to reverse it. zstd and brotli are registered only when
+their packages are installed.
+"""
+import base64
+import bz2
+import lzma
+import math
+import time
+import unicodedata
+import zlib
+
+DEFAULT_CODEC = "zlib-6"  # Same output as zlib.compress at the default level
+AUTO_CODEC = "auto"
+AUTO_CPU_BUDGET = 0.25  # Seconds of CPU time auto mode may spend trying codecs
+AUTO_SAMPLE_SIZE = 128 * 1024  # Bytes from the start of the payload each auto candidate compresses
+
+
+class Codec:
+    def __init__(self, name, tag, compressobj, decompressobj):
+        self.name = name
+        self.tag = tag
+        self.compressobj = compressobj  # () -> object with compress(bytes) and flush()
+        self.decompressobj = decompressobj  # () -> object with decompress(bytes)
+
+    def compress(self, data):
+        compressor = self.compressobj()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        return self.decompressobj().decompress(data)
+
+    def __repr__(self):
+        return f"Codec({self.name!r}, tag={self.tag!r})"
+
+
+CODECS = {}  # name -> Codec
+CODECS_BY_TAG = {}  # tag -> Codec
+
+
+def register_codec(codec):
+    if codec.tag in CODECS_BY_TAG and CODECS_BY_TAG[codec.tag].name != codec.name:
+        raise ValueError(f"Codec tag {codec.tag!r} is already used by {CODECS_BY_TAG[codec.tag].name}")
+    CODECS[codec.name] = codec
+    CODECS_BY_TAG[codec.tag] = codec
+    return codec
+
+
+def check_codec(name):
+    """Raise ValueError unless name is a known codec (see get_codec) or "auto"."""
+    if name != AUTO_CODEC:
+        get_codec(name)
+    return name
+
+
+def get_codec(name):
+    """Look a codec up by name ("zlib-9", "lzma", ...) or by its one-character tag."""
+    if name is None:
+        name = DEFAULT_CODEC
+    codec = CODECS.get(name) or CODECS_BY_TAG.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown compression codec: {name}")
+    return codec
+
+
+for _level in range(1, 10):
+    register_codec(Codec(f"zlib-{_level}", str(_level),
+                         lambda level=_level: zlib.compressobj(level), zlib.decompressobj))
+register_codec(Codec("lzma", "x", lzma.LZMACompressor, lzma.LZMADecompressor))
+register_codec(Codec("bz2", "j", lambda: bz2.BZ2Compressor(9), bz2.BZ2Decompressor))
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if zstandard is not None:
+    register_codec(Codec("zstd", "z", lambda: zstandard.ZstdCompressor(level=19).compressobj(),
+                         lambda: zstandard.ZstdDecompressor().decompressobj()))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=11)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class _BrotliDecompressor:
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+
+    def decompress(self, data):
+        return self._decompressor.process(data)
+
+
+if brotli is not None:
+    register_codec(Codec("brotli", "r", _BrotliCompressor, _BrotliDecompressor))
+
+# Tried in this order by auto mode: cheapest first, so a tight CPU budget
+# still gets a reasonable codec and ties go to the faster one.
+AUTO_CANDIDATES = [name for name in ("zlib-6", "zlib-9", "bz2", "lzma", "zstd", "brotli") if name in CODECS]
+
+# CPU seconds per input byte of each auto candidate on text, refined with what
+# select_codec measures as it runs. Starts from rough figures for a 100 KB chat log.
+AUTO_COSTS = {"zlib-6": 40e-9, "zlib-9": 90e-9, "bz2": 80e-9, "lzma": 500e-9, "zstd": 1200e-9, "brotli": 1700e-9}
+
+
+def compressed_size(codec, blocks):
+    """Compress an iterable of bytes blocks with codec, keeping only the output length."""
+    compressor = get_codec(codec).compressobj()
+    return sum(len(compressor.compress(block)) for block in blocks) + len(compressor.flush())
+
+
+def compress_blocks(codec, blocks):
+    """Compress an iterable of bytes blocks with codec into one bytes object."""
+    compressor = get_codec(codec).compressobj()
+    out = [compressor.compress(block) for block in blocks]
+    out.append(compressor.flush())
+    return b"".join(out)
+
+
+def _sample(blocks, size):
+    """The first blocks of an iterable adding up to at least size bytes, and whether that was all of it."""
+    iterator = iter(blocks)
+    sample, total = [], 0
+    for block in iterator:
+        sample.append(block)
+        total += len(block)
+        if total >= size:
+            return sample, next(iterator, None) is None
+    return sample, True
+
+
+def select_codec(make_blocks, chunk_count, candidates=None, cpu_budget=AUTO_CPU_BUDGET, sample_size=AUTO_SAMPLE_SIZE,
+                 input_size=None):
+    """
+    Pick the codec that yields the fewest chunks within a CPU-time budget.
+
+    Candidates are compared on the first sample_size bytes of the input, then the
+    winner compresses the whole input once (its sample output is reused when the
+    sample was the whole input). The budget covers both: a candidate whose sample
+    time, scaled up to input_size, would not fit in what is left of it cannot win.
+    Candidates run cheapest first by AUTO_COSTS, and before each sample block the
+    time the rest of the sample would take is projected from the codec's cost per
+    byte (zstd and brotli buffer and do most of the work in flush, so the cost is
+    never taken below AUTO_COSTS), and a block that would overrun the budget is
+    never started. Time for the current best to compress the whole input stays
+    reserved while later candidates run.
+
+    Args:
+        make_blocks: Callable returning a fresh iterable of input bytes blocks.
+        chunk_count: Callable mapping a compressed size to the resulting chunk count.
+        candidates: Codec names to try, in order (default: AUTO_CANDIDATES, by AUTO_COSTS).
+        cpu_budget: Seconds of CPU time (of the calling thread) for trying codecs
+            and compressing the whole input with the winner. The first candidate
+            is always measured and always eligible.
+        sample_size: Input bytes each candidate compresses.
+        input_size: Approximate input length in bytes, for scaling sample times.
+
+    Returns:
+        (codec, compressed) for the winner, compressed being its output for the whole input.
+    """
+    started = time.thread_time()
+    sample, whole = _sample(make_blocks(), sample_size)
+    sampled = sum(map(len, sample)) or 1
+    scale = 1 if whole else max((input_size or sampled) / sampled, 1)
+    best = None
+    for name in candidates or sorted(AUTO_CANDIDATES, key=lambda name: AUTO_COSTS.get(name, 0)):
+        compressor = get_codec(name).compressobj()
+        cost = AUTO_COSTS.get(name, 0)
+        out, done = [], 0
+        begun = time.thread_time()
+        for block in sample:
+            now = time.thread_time()
+            if done:
+                cost = max(cost, (now - begun) / done)
+            if best is not None and now - started + cost * (sampled - done) + best[3] > cpu_budget:
+                out = None
+                break
+            out.append(compressor.compress(block))
+            done += len(block)
+        if out is None:
+            continue  # The rest of its sample would overrun the budget; a later codec may still fit
+        out.append(compressor.flush())
+        now = time.thread_time()
+        if name in AUTO_COSTS:
+            AUTO_COSTS[name] = (AUTO_COSTS[name] + (now - begun) / sampled) / 2
+        finish = 0 if whole else (now - begun) * scale  # Compressing the whole input after sampling
+        if best is not None and now - started + finish > cpu_budget:
+            continue  # Compressing the whole input with it would not fit in what is left of the budget
+        size = sum(map(len, out))
+        # Sizes of a partial sample only rank the codecs; chunk counts are for the real payload.
+        if best is None or (chunk_count(size) < chunk_count(best[1]) if whole else size < best[1]):
+            best = (name, size, out, finish)
+    codec = get_codec(best[0])
+    if whole:
+        return codec, b"".join(best[2])
+    return codec, compress_blocks(codec.name, make_blocks())
+
+
+DEFAULT_ENCODING = "base64"
+
+
+class Encoding:
+    """
+    A binary-to-text encoding that works on fixed-size blocks.
+
+    Encoding block_size bytes always yields group_size characters, so a stream
+    can be encoded block-aligned piece by piece and decoded group by group.
+    Text is handled as bytes in ``charset``, where one byte is one character.
+    ``escaped`` lists the characters of the alphabet that JSON escapes (each
+    costs two characters in the message body), so chunking can budget for them.
+    """
+
+    def __init__(self, name, tag, block_size, group_size, encode, decode, charset="ascii", escaped=b""):
+        self.name = name
+        self.tag = tag
+        self.block_size = block_size
+        self.group_size = group_size
+        self.encode = encode  # bytes -> bytes in charset
+        self.decode = decode  # bytes in charset -> bytes
+        self.charset = charset
+        self.escaped = escaped
+
+    def encoded_length(self, size):
+        """Characters produced for size input bytes."""
+        return len(self.encode(b"\0" * size)) if size < self.block_size else \
+            size // self.block_size * self.group_size + self.encoded_length(size % self.block_size)
+
+    def __repr__(self):
+        return f"Encoding({self.name!r}, tag={self.tag!r})"
+
+
+ENCODINGS = {}  # name -> Encoding
+ENCODINGS_BY_TAG = {}  # tag -> Encoding
+
+
+def register_encoding(encoding):
+    if encoding.tag in ENCODINGS_BY_TAG and ENCODINGS_BY_TAG[encoding.tag].name != encoding.name:
+        raise ValueError(f"Encoding tag {encoding.tag!r} is already used by {ENCODINGS_BY_TAG[encoding.tag].name}")
+    ENCODINGS[encoding.name] = encoding
+    ENCODINGS_BY_TAG[encoding.tag] = encoding
+    return encoding
+
+
+def get_encoding(name):
+    """Look an encoding up by name ("base85", ...) or by its one-character tag."""
+    if name is None:
+        name = DEFAULT_ENCODING
+    encoding = ENCODINGS.get(name) or ENCODINGS_BY_TAG.get(name)
+    if encoding is None:
+        raise ValueError(f"Unknown text encoding: {name}")
+    return encoding
+
+
+def _a85encode(data):
+    # Spell zero groups out as "!!!!!" instead of "z" so every 4 bytes are 5 characters.
+    return base64.a85encode(data).replace(b"z", b"!!!!!")
+
+
+register_encoding(Encoding("base64", "b", 3, 4, base64.b64encode, base64.b64decode))
+register_encoding(Encoding("base85", "f", 4, 5, base64.b85encode, base64.b85decode))
+register_encoding(Encoding("ascii85", "a", 4, 5, _a85encode, base64.a85decode, escaped=b'"\\'))
+
+# Characters that must not appear in a custom alphabet: chunk framing, and
+# characters JSON has to escape (they would cost extra bytes on the wire).
+RESERVED_CHARACTERS = set('[]"\\')
+
+
+def validate_alphabet(alphabet):
+    """
+    Check that every character of a custom alphabet survives a NOMI message.
+
+    Rejects duplicates, whitespace (trimmed or collapsed), control/format/
+    unassigned characters, combining marks (they merge with the previous
+    character), characters outside the BMP and RESERVED_CHARACTERS.
+    Raises ValueError naming the offending characters.
+    """
+    if len(set(alphabet)) != len(alphabet):
+        raise ValueError("Alphabet contains duplicate characters.")
+    if len(alphabet) < 2:
+        raise ValueError("Alphabet needs at least two characters.")
+    bad = [char for char in alphabet
+           if char in RESERVED_CHARACTERS or char.isspace() or ord(char) > 0xFFFF
+           or unicodedata.category(char)[0] in "CMZ"]
+    if bad:
+        raise ValueError(f"Alphabet contains characters the NOMI API may alter or reject: {bad!r}")
+    return alphabet
+
+
+def _radix_layout(radix, max_block=16):
+    """Pick the input block size (bytes) and group size (digits) with the best digits-per-byte ratio."""
+    best = None
+    for block in range(1, max_block + 1):
+        digits = math.ceil(block * 8 / math.log2(radix))
+        while radix ** digits < 256 ** block:
+            digits += 1
+        if best is None or digits * best[0] < best[1] * block:
+            best = (block, digits)
+    return best
+
+
+def make_radix_encoding(name, tag, alphabet):
+    """
+    Build a high-radix Encoding over a custom alphabet (at most 256 Latin-1 characters).
+
+    Each block of bytes is read as a big-endian integer and written out in base
+    len(alphabet), two digits per table lookup. A trailing partial block of k
+    bytes uses the fewest digits that can hold it, which is unique per k.
+    """
+    validate_alphabet(alphabet)
+    radix = len(alphabet)
+    if radix > 256 or max(map(ord, alphabet)) > 0xFF:
+        raise ValueError("Radix alphabets must be Latin-1 characters so each character is one byte.")
+    block_size, group_size = _radix_layout(radix)
+    symbols = alphabet.encode("latin-1")
+    pairs = [bytes((symbols[high], symbols[low])) for high in range(radix) for low in range(radix)]
+    pair_values = {pair: value for value, pair in enumerate(pairs)}
+    digit_values = {symbol: value for value, symbol in enumerate(symbols)}
+    digits_for = {k: next(d for d in range(1, 4 * k + 2) if radix ** d >= 256 ** k) for k in range(1, block_size + 1)}
+    bytes_for = {d: k for k, d in digits_for.items()}
+    square = radix * radix
+
+    def encode_group(block, digits):
+        value = int.from_bytes(block, "big")
+        out = []
+        for _ in range(digits // 2):
+            value, rest = divmod(value, square)
+            out.append(pairs[rest])
+        if digits % 2:
+            out.append(symbols[value % radix:value % radix + 1])
+        out.reverse()
+        return b"".join(out)
+
+    def encode(data):
+        data = memoryview(data)
+        full = len(data) - len(data) % block_size
+        out = [encode_group(data[start:start + block_size], group_size) for start in range(0, full, block_size)]
+        if full < len(data):
+            out.append(encode_group(data[full:], digits_for[len(data) - full]))
+        return b"".join(out)
+
+    def decode_group(group):
+        value = 0
+        start = 0
+        if len(group) % 2:
+            value = digit_values[group[0]]
+            start = 1
+        for offset in range(start, len(group), 2):
+            value = value * square + pair_values[group[offset:offset + 2]]
+        return value
+
+    def decode(text):
+        text = bytes(text)
+        out = []
+        full = len(text) - len(text) % group_size
+        for start in range(0, full, group_size):
+            out.append(decode_group(text[start:start + group_size]).to_bytes(block_size, "big"))
+        if full < len(text):
+            size = bytes_for.get(len(text) - full)
+            if size is None:
+                raise ValueError("Truncated radix-encoded data.")
+            out.append(decode_group(text[full:]).to_bytes(size, "big"))
+        return b"".join(out)
+
+    return Encoding(name, tag, block_size, group_size, encode, decode, charset="latin-1")
+
+
+# Printable ASCII and Latin-1 minus RESERVED_CHARACTERS and the soft hyphen:
+# 184 symbols, so 15 bytes become 16 characters (vs. 20 for base64).
+NOMI_SAFE_ALPHABET = "".join(
+    chr(code) for code in list(range(0x21, 0x7F)) + list(range(0xA1, 0x100))
+    if chr(code) not in RESERVED_CHARACTERS and code != 0xAD)
+
+register_encoding(make_radix_encoding("nomi-radix", "n", NOMI_SAFE_ALPHABET))
+
+
+def header_tag(codec, encoding):
+    """Tag for the first chunk header: codec tag, then the encoding tag unless it is base64."""
+    codec, encoding = get_codec(codec.name if isinstance(codec, Codec) else codec), \
+        get_encoding(encoding.name if isinstance(encoding, Encoding) else encoding)
+    return codec.tag + ("" if encoding.name == DEFAULT_ENCODING else encoding.tag)
+
+
+def parse_header_tag(tag):
+    """Inverse of header_tag. A missing tag means the original zlib + base64 format."""
+    if not tag:
+        return get_codec(DEFAULT_CODEC), get_encoding(DEFAULT_ENCODING)
+    return get_codec(tag[0]), get_encoding(tag[1] if len(tag) > 1 else DEFAULT_ENCODING)
@@ -0,0 +1,227 @@
+"""
+Local conversation store: every message sent through the app and every reply
+it gets back, kept in SQLite and searchable with FTS5.
+
+record() only appends to an in-memory queue, so a send never waits on the
+disk. A single writer thread drains the queue and inserts in batches (up to
+batch_size rows per transaction, or whatever arrived within flush_interval
+seconds). If the queue is full the message is dropped and counted rather
+than blocking the request.
+
+Search runs entirely on the full-text index. The room is an indexed FTS5
+column, so a room filter is part of the MATCH, not a post-filter. Message ids
+follow the order messages were recorded, so a time range becomes an id range,
+which FTS5 applies while walking its index. Prefix indexes on 3 and 4
+characters keep short word* searches from expanding to every matching term.
+Results come newest first and pages are keyset-paginated on the id (pass
+next_cursor back as before), so the cost does not grow with the page number.
+"""
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+CONVERSATION_BATCH_SIZE = 256  # Messages inserted per transaction at most
+CONVERSATION_FLUSH_INTERVAL = 0.5  # Seconds a partial batch waits before it is written anyway
+CONVERSATION_QUEUE_SIZE = 10000  # Messages waiting for the writer before new ones are dropped
+SEARCH_PAGE_SIZE = 20  # Results per /search page by default
+SEARCH_MAX_PAGE_SIZE = 100
+
+DIRECT_ROOM = "direct"  # Room recorded for direct messages with Collin
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    room TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    sender TEXT,
+    mode TEXT,
+    text TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_created ON messages (created);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, room, content='messages', content_rowid='id', tokenize='unicode61', prefix='3 4'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, text, room) VALUES (new.id, new.text, replace(new.room, '-', ''));
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, text, room) VALUES ('delete', old.id, old.text, replace(old.room, '-', ''));
+END;
+"""
+
+SENT = "sent"
+REPLY = "reply"
+
+Message = namedtuple("Message", ["id", "room", "direction", "sender", "mode", "text", "created"])
+
+
+def room_token(room):
+    """
+    How a room is indexed: a UUID without its hyphens, so it is a single token
+    and a room filter is one posting list rather than a five-word phrase.
+    """
+    return room.replace("-", "")
+
+
+def match_expression(query, room=None):
+    """
+    Turn a user's search text into an FTS5 MATCH expression: every word must
+    appear (a trailing * matches a prefix), and FTS5 operators in the text are
+    taken literally instead of raising a syntax error.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    if not terms:
+        return None
+    expression = f"text : ({' AND '.join(terms)})"
+    if room:
+        expression += ' AND room : "' + room_token(room).replace('"', '""') + '"'
+    return expression
+
+
+class ConversationStore:
+    def __init__(self, path, batch_size=CONVERSATION_BATCH_SIZE, flush_interval=CONVERSATION_FLUSH_INTERVAL,
+                 queue_size=CONVERSATION_QUEUE_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(queue_size)
+        self._order_lock = threading.Lock()
+        self._stats_lock = threading.Lock()  # Request threads, the writer and /stats all touch stats
+        self._local = threading.local()
+        self.stats = {"recorded": 0, "written": 0, "dropped": 0, "batches": 0, "searches": 0}
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush, 5)  # The writer is a daemon thread; give it a moment to write what is queued
+
+    def _connection(self):
+        """One connection per thread; sqlite3 connections must not be shared across threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")  # Searches never wait for the writer
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def record(self, room, direction, text, sender=None, mode=None, created=None):
+        """Queue a message for writing. Never blocks; returns False if it was dropped."""
+        if not text:
+            return False
+        # Timestamp and enqueue together so ids (assigned in queue order) follow time order.
+        with self._order_lock:
+            try:
+                self._queue.put_nowait((room, direction, sender, mode, text, created or time.time()))
+            except queue.Full:
+                dropped = self._count("dropped")
+                if dropped % 1000 == 1:
+                    logging.warning(f"Conversation store queue is full; {dropped} messages not recorded so far.")
+                return False
+            self._count("recorded")
+        return True
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+            return self.stats[key]
+
+    def flush(self, timeout=None):
+        """Wait until everything recorded so far is written (for shutdown and benchmarks)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to write {len(batch)} conversation messages: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def write(self, rows):
+        """Insert (room, direction, sender, mode, text, created) rows in one transaction."""
+        conn = self._connection()
+        with conn:
+            conn.executemany("INSERT INTO messages (room, direction, sender, mode, text, created) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._count("written", len(rows))
+        self._count("batches")
+
+    def _id_bound(self, created, first):
+        """First id recorded at or after created (first=True), or last id recorded before it."""
+        if first:
+            row = self._connection().execute(
+                "SELECT id FROM messages WHERE created >= ? ORDER BY created LIMIT 1", (created,)).fetchone()
+        else:
+            row = self._connection().execute(
+                "SELECT id FROM messages WHERE created < ? ORDER BY created DESC LIMIT 1", (created,)).fetchone()
+        return row[0] if row else None
+
+    def search(self, query, room=None, since=None, until=None, limit=SEARCH_PAGE_SIZE, before=None):
+        """
+        Messages matching query, newest first. since/until are Unix timestamps
+        (until exclusive); before is the next_cursor of the previous page.
+        Returns (messages, next_cursor); next_cursor is None on the last page.
+        """
+        expression = match_expression(query, room)
+        if expression is None:
+            return [], None
+        self._count("searches")
+        low, high = None, before
+        if since is not None:
+            low = self._id_bound(since, first=True)
+            if low is None:
+                return [], None
+        if until is not None:
+            last = self._id_bound(until, first=False)
+            if last is None:
+                return [], None
+            high = last + 1 if high is None else min(high, last + 1)
+        conditions, params = ["messages_fts MATCH ?"], [expression]
+        if low is not None:
+            conditions.append("messages_fts.rowid >= ?")
+            params.append(low)
+        if high is not None:
+            conditions.append("messages_fts.rowid < ?")
+            params.append(high)
+        # CROSS JOIN keeps the full-text index as the outer loop, walked newest first.
+        rows = self._connection().execute(
+            "SELECT m.id, m.room, m.direction, m.sender, m.mode, m.text, m.created "
+            "FROM messages_fts CROSS JOIN messages m ON m.id = messages_fts.rowid "
+            f"WHERE {' AND '.join(conditions)} ORDER BY messages_fts.rowid DESC LIMIT ?",
+            params + [limit + 1]).fetchall()
+        messages = [Message(*row) for row in rows[:limit]]
+        next_cursor = messages[-1].id if len(rows) > limit else None
+        return messages, next_cursor
+
+    def snapshot(self):
+        count = self._connection().execute("SELECT max(id) FROM messages").fetchone()[0] or 0
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, queued=self._queue.qsize(), stored=count)
@@ -0,0 +1,168 @@
+"""
+Publish/subscribe broker for send progress, streamed to browsers as
+Server-Sent Events.
+
+Each topic (a job id) keeps a short history so a subscriber that connects
+late, or reconnects with Last-Event-ID, still sees every event. Each
+subscriber has its own bounded deque: a slow client loses its oldest events
+(and is told how many) instead of holding memory or slowing publishers.
+
+A subscriber costs a deque and a condition wait, not a thread of its own,
+as long as the server multiplexes waiting requests. Run the app under a
+gevent worker for that, e.g.
+
+    gunicorn -k gevent --worker-connections 1000 app:app
+
+where each open stream is a greenlet. With the threaded development server
+every stream occupies one request thread.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+SUBSCRIBER_BUFFER = 256  # Events queued per subscriber before the oldest are dropped
+TOPIC_HISTORY = 1024  # Events kept per topic for late subscribers
+TOPIC_TTL = 600  # Seconds a closed topic's history is kept
+HEARTBEAT_INTERVAL = 15  # Seconds of silence before a keep-alive comment is sent
+
+
+class Subscription:
+    def __init__(self, broker, topic, buffer_size):
+        self.broker = broker
+        self.topic = topic
+        self.events = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.closed = False
+
+    def _push(self, event):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+
+    def stream(self, heartbeat=HEARTBEAT_INTERVAL):
+        """
+        Yield SSE-formatted strings until the topic closes or the client goes away.
+        Comments (': ...') keep idle connections open through proxies.
+        """
+        try:
+            while True:
+                with self.broker._condition:
+                    if not self.events and not self.closed:
+                        self.broker._condition.wait(heartbeat)
+                    pending = list(self.events)
+                    self.events.clear()
+                    dropped, self.dropped = self.dropped, 0
+                    closed = self.closed and not self.events
+                if dropped:
+                    yield format_sse("lagged", {"dropped": dropped})
+                for event_id, name, data in pending:
+                    yield format_sse(name, data, event_id)
+                if closed:
+                    return
+                if not pending and not dropped:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.broker.unsubscribe(self)
+
+
+class _Topic:
+    __slots__ = ("history", "subscribers", "closed_at")
+
+    def __init__(self):
+        self.history = deque(maxlen=TOPIC_HISTORY)
+        self.subscribers = set()
+        self.closed_at = None
+
+
+class Broker:
+    def __init__(self, buffer_size=SUBSCRIBER_BUFFER, ttl=TOPIC_TTL):
+        self.buffer_size = buffer_size
+        self.ttl = ttl
+        self._topics = {}
+        self._ids = itertools.count(1)
+        # One condition for all subscribers: publishing wakes every waiting stream, which
+        # checks its own deque. Cheap at hundreds of streams and avoids a lock per subscriber.
+        self._condition = threading.Condition()
+        self.stats = {"published": 0, "subscribers": 0, "dropped": 0}
+
+    def publish(self, topic, name, data):
+        with self._condition:
+            state = self._topics.get(topic)
+            if state is None:
+                state = self._topics[topic] = _Topic()
+            event = (next(self._ids), name, data)
+            state.history.append(event)
+            for subscription in state.subscribers:
+                if len(subscription.events) == subscription.events.maxlen:
+                    self.stats["dropped"] += 1
+                subscription._push(event)
+            self.stats["published"] += 1
+            if state.subscribers:
+                self._condition.notify_all()
+
+    def open(self, topic):
+        """(Re)open topic for publishing, e.g. a room that is watched again after its last subscriber left."""
+        with self._condition:
+            state = self._topics.get(topic)
+            if state is None:
+                self._topics[topic] = _Topic()
+            elif state.closed_at is not None:
+                state.closed_at = None
+                state.history.clear()  # Events from the earlier session would be stale
+
+    def close(self, topic):
+        """No more events for topic: its streams end once drained; history is kept for ttl seconds."""
+        with self._condition:
+            state = self._topics.get(topic)
+            if state is None:
+                return
+            state.closed_at = time.monotonic()
+            for subscription in state.subscribers:
+                subscription.closed = True
+            self._condition.notify_all()
+            self._expire()
+
+    def subscribe(self, topic, last_event_id=None):
+        """Subscribe to topic, replaying its history after last_event_id (all of it if None)."""
+        subscription = Subscription(self, topic, self.buffer_size)
+        with self._condition:
+            state = self._topics.get(topic)
+            if state is None:
+                state = self._topics[topic] = _Topic()
+            for event in state.history:
+                if last_event_id is None or event[0] > last_event_id:
+                    subscription._push(event)
+            subscription.closed = state.closed_at is not None
+            state.subscribers.add(subscription)
+            self.stats["subscribers"] += 1
+        return subscription
+
+    def has_topic(self, topic):
+        with self._condition:
+            return topic in self._topics
+
+    def unsubscribe(self, subscription):
+        with self._condition:
+            state = self._topics.get(subscription.topic)
+            if state is not None and subscription in state.subscribers:
+                state.subscribers.discard(subscription)
+                self.stats["subscribers"] -= 1
+
+    def _expire(self):
+        now = time.monotonic()
+        for topic, state in list(self._topics.items()):
+            if state.closed_at is not None and now - state.closed_at > self.ttl and not state.subscribers:
+                del self._topics[topic]
+
+    def snapshot(self):
+        with self._condition:
+            return dict(self.stats, topics=len(self._topics))
+
+
+def format_sse(name, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {name}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,141 @@
+"""
+Idempotency keys for /send.
+
+A client sends the same Idempotency-Key header when it retries a request.
+The store remembers, per key, which chunk indices were already delivered and
+the final response once the send succeeded. A retry of a finished send gets
+the cached response; a retry of a failed one skips the chunks that went
+through and resumes from the first undelivered chunk.
+
+Keys live in memory, bounded by max_keys (least recently used evicted first)
+and forgotten ttl seconds after their last use.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+IDEMPOTENCY_MAX_KEYS = 10000  # Keys remembered at most
+IDEMPOTENCY_TTL = 24 * 3600  # Seconds a key is remembered after its last use
+
+NEW = "new"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+def fingerprint(body):
+    """Digest of a request body, ignoring keys that do not change what is sent."""
+    relevant = {key: value for key, value in (body or {}).items() if key != "wait"}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+class Record:
+    """
+    What is known about one key: its state, the delivered chunks of the last
+    attempt (index -> digest of the chunk text) and, once completed, the response.
+    """
+
+    def __init__(self, key, body_fingerprint):
+        self.key = key
+        self.fingerprint = body_fingerprint
+        self.state = NEW
+        self.job_id = None
+        self.layout = None  # (kind, total) of the chunked send the delivered indices belong to
+        self.delivered = {}
+        self.response = None
+        self.touched = time.monotonic()
+
+    def resume(self, kind, total, messages, on_skip=None):
+        """
+        Filter (index, text) messages down to the ones still to send.
+
+        A chunk is skipped only if the same index with the same text was already
+        delivered; from the first chunk that differs (or was never delivered)
+        everything is sent. A different chunk layout starts over from chunk 1.
+        """
+        if self.layout != (kind, total):
+            self.layout = (kind, total)
+            self.delivered = {}
+        resuming = bool(self.delivered)
+        for index, text in messages:
+            if resuming and self.delivered.get(index) == hashlib.sha256(text.encode()).digest():
+                if on_skip:
+                    on_skip(index, len(text))
+                continue
+            resuming = False
+            yield index, text
+
+    def chunk_delivered(self, index, text):
+        self.delivered[index] = hashlib.sha256(text.encode()).digest()
+
+
+class IdempotencyStore:
+    def __init__(self, max_keys=IDEMPOTENCY_MAX_KEYS, ttl=IDEMPOTENCY_TTL, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.ttl = ttl
+        self.clock = clock
+        self._records = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+        self.stats = {"new": 0, "replayed": 0, "resumed": 0, "conflicts": 0, "mismatched": 0, "evicted": 0,
+                      "chunks_skipped": 0}
+
+    def begin(self, key, body_fingerprint):
+        """
+        Start (or look up) a request under key. Returns (record, state) where state is
+        the record's state before this call: NEW or FAILED mean the caller should
+        send (the record is now IN_PROGRESS); COMPLETED means record.response
+        holds the cached answer; IN_PROGRESS means another request is sending.
+        Returns (None, None) if key was used before with a different body.
+        """
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            record = self._records.get(key)
+            if record is None:
+                record = self._records[key] = Record(key, body_fingerprint)
+                self._enforce_limit()
+            elif record.fingerprint != body_fingerprint:
+                self.stats["mismatched"] += 1
+                return None, None
+            self._records.move_to_end(key)
+            record.touched = now
+            state = record.state
+            if state in (NEW, FAILED):
+                record.state = IN_PROGRESS
+                self.stats["resumed" if state == FAILED else "new"] += 1
+            else:
+                self.stats["replayed" if state == COMPLETED else "conflicts"] += 1
+            return record, state
+
+    def finish(self, record, response, status_code):
+        """Cache a successful response; a failed send keeps its delivered chunks for the next retry."""
+        with self._lock:
+            failed = status_code >= 400 or (isinstance(response, dict) and "error" in response)
+            record.state = FAILED if failed else COMPLETED
+            record.response = None if failed else (response, status_code)
+            if not failed:
+                record.delivered = {}
+            record.touched = self.clock()
+
+    def skipped(self, count=1):
+        with self._lock:
+            self.stats["chunks_skipped"] += count
+
+    def _expire(self, now):
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if now - record.touched < self.ttl:
+                break
+            del self._records[key]
+            self.stats["evicted"] += 1
+
+    def _enforce_limit(self):
+        while len(self._records) > self.max_keys:
+            self._records.popitem(last=False)
+            self.stats["evicted"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, keys=len(self._records))
@@ -0,0 +1,189 @@
+"""
+Background send jobs.
+
+A route submits a job and answers 202 with its id right away; a bounded pool
+of workers runs the chunk sends and the client polls /jobs/<id> for progress.
+When every worker is busy and the pending queue is full, submit() raises
+JobQueueFull so the route can answer 503 instead of piling up work.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+JOB_WORKERS = 8  # Jobs running at once
+JOB_QUEUE_SIZE = 64  # Jobs waiting for a worker before submit() refuses more
+JOB_HISTORY = 1000  # Finished jobs kept for polling; the oldest are forgotten first
+JOB_TTL = 3600  # Seconds a finished job stays pollable
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    """
+    Progress of one send. Workers report chunk results through chunk_sent and
+    chunk_failed (from several threads when a send is pipelined). Each report
+    is also published as an event (see events.py) when publish is given.
+    """
+
+    def __init__(self, kind, publish=None):
+        self.id = uuid4().hex
+        self.publish = publish
+        self.kind = kind
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.total_chunks = None
+        self.chunks = {}  # index -> {"status": sent/already_sent/failed, "bytes", "attempts"}
+        self.bytes_sent = 0
+        self.result = None
+        self.status_code = None
+        self.lock = threading.Lock()
+
+    def emit(self, name, data):
+        if self.publish:
+            self.publish(self.id, name, data)
+
+    def set_total(self, total_chunks):
+        self.total_chunks = total_chunks
+        self.emit("queued", {"total_chunks": total_chunks})
+
+    def chunk_sent(self, index, size, attempts=1, latency=None, reply=None):
+        """reply is the NOMI's reply text, when the API returned one for this chunk."""
+        with self.lock:
+            self.chunks[index] = {"status": "sent", "bytes": size, "attempts": attempts}
+            self.bytes_sent += size
+            bytes_sent = self.bytes_sent
+            eta = self.eta()
+        self.emit("sent", {"chunk": index, "bytes": size, "attempts": attempts, "latency": latency,
+                           "bytes_sent": bytes_sent, "total_chunks": self.total_chunks, "eta": eta})
+        if reply:
+            self.emit("reply", {"chunk": index, "text": reply})
+
+    def chunk_skipped(self, index, size):
+        """A chunk an earlier attempt already delivered (see idempotency)."""
+        with self.lock:
+            self.chunks[index] = {"status": "already_sent", "bytes": size, "attempts": 0}
+        self.emit("skipped", {"chunk": index, "bytes": size})
+
+    def chunk_retrying(self, index, attempts, delay, error):
+        self.emit("retrying", {"chunk": index, "attempts": attempts, "delay": delay, "error": error})
+
+    def chunk_failed(self, index, error, attempts=1):
+        with self.lock:
+            self.chunks[index] = {"status": "failed", "error": error, "attempts": attempts}
+        self.emit("failed", {"chunk": index, "error": error, "attempts": attempts})
+
+    def eta(self):
+        """Seconds left, extrapolated from the average time per chunk so far. Call with self.lock held."""
+        sent = sum(1 for chunk in self.chunks.values() if chunk["status"] == "sent")
+        skipped = sum(1 for chunk in self.chunks.values() if chunk["status"] == "already_sent")
+        if self.status != RUNNING or not sent or not self.total_chunks:
+            return None
+        return (time.time() - self.started) / sent * (self.total_chunks - sent - skipped)
+
+    def snapshot(self):
+        with self.lock:
+            state = {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished,
+                "total_chunks": self.total_chunks,
+                "chunks_sent": sum(1 for chunk in self.chunks.values() if chunk["status"] != "failed"),
+                "bytes_sent": self.bytes_sent,
+                "eta": self.eta(),
+                "chunks": [dict(chunk, chunk=index) for index, chunk in sorted(self.chunks.items())],
+            }
+        if self.finished is not None:
+            state["result"] = self.result
+            state["status_code"] = self.status_code
+        return state
+
+
+class JobQueue:
+    """
+    Runs jobs on a fixed pool. At most workers + queue_size jobs are accepted
+    and unfinished at once; beyond that submit() raises JobQueueFull.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE, history=JOB_HISTORY, ttl=JOB_TTL, broker=None):
+        self.workers = workers
+        self.broker = broker
+        self.queue_size = queue_size
+        self.history = history
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="send-job")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._jobs = OrderedDict()  # Oldest first
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+
+    def submit(self, kind, func):
+        """
+        Queue func(job) -> (result, status_code). Returns the Job.
+
+        Raises JobQueueFull when the pool and its queue are both full.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise JobQueueFull(f"Too many send jobs in progress ({self.workers + self.queue_size}); try again shortly.")
+        job = Job(kind, self.broker.publish if self.broker else None)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+            self.stats["submitted"] += 1
+        self._executor.submit(self._run, job, func)
+        return job
+
+    def _run(self, job, func):
+        job.status = RUNNING
+        job.started = time.time()
+        job.emit("started", {"job_id": job.id, "kind": job.kind})
+        try:
+            job.result, job.status_code = func(job)
+        except Exception as e:
+            logging.error(f"Send job {job.id} failed: {e}")
+            job.result, job.status_code = {"error": f"An unexpected server error occurred: {e}"}, 500
+        finally:
+            failed = (job.status_code or 500) >= 400 or (isinstance(job.result, dict) and "error" in job.result)
+            job.status = FAILED if failed else DONE
+            job.finished = time.time()
+            with self._lock:
+                self.stats[job.status] += 1
+            self._slots.release()
+            job.emit("finished", {"status": job.status, "result": job.result, "status_code": job.status_code})
+            if self.broker:
+                self.broker.close(job.id)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        """Forget finished jobs past the TTL or beyond the history limit."""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) <= self.history and (job.finished is None or now - job.finished < self.ttl):
+                break
+            if job.finished is not None:
+                del self._jobs[job_id]
+
+    def snapshot(self):
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job.finished is None)
+            stats = dict(self.stats)
+        return dict(stats, active=active, capacity=self.workers + self.queue_size)
@@ -0,0 +1,189 @@
+"""
+Non-blocking structured logging.
+
+configure() puts a queue handler on the root logger: a request thread only
+appends the LogRecord to a bounded queue, and one listener thread formats
+records (as JSON lines by default) and writes them out. The request thread
+still merges the message's %-args (and renders a traceback) before queueing,
+as the stdlib QueueHandler does, so a record never holds on to arguments
+that may change or be unpicklable; building the JSON and writing it happen
+on the listener. When the queue is full, records are dropped and counted per level instead of
+blocking the caller.
+
+Hot paths that log once per chunk use Sampled, which keeps 1 in `every`
+successes and skips building the record for the rest; errors and warnings
+go through the logger as usual and are never sampled.
+
+    logs.configure(level=logging.INFO, caller_info=False)
+    chunk_log = logs.Sampled(logging.getLogger(), every=100)
+    chunk_log.info("Chunk %d sent to %s", index, room, room=room, chars=len(text))
+    logging.info("Sending %s", room, extra=logs.fields(room=room))
+"""
+import atexit
+import copy
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections import Counter
+
+LOG_QUEUE_SIZE = 10000  # Records waiting for the listener before new ones are dropped
+CHUNK_LOG_SAMPLE_EVERY = 100  # Keep 1 in this many per-chunk success logs
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def fields(**values):
+    """extra= for a logging call, adding values as top-level keys of its JSON record."""
+    return {"fields": values}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, msg, the record's fields, and exc for exceptions."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        for key, value in vars(record).items():
+            if key not in _RESERVED and key != "fields":
+                entry.setdefault(key, value)
+        if record.exc_info or record.exc_text:
+            entry["exc"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that never blocks: a full queue drops the record and counts it."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = Counter()
+        self._drop_lock = threading.Lock()
+
+    def prepare(self, record):
+        # Like QueueHandler.prepare, merge the message and render the traceback now, while the
+        # arguments and the frames are as they were; unlike it, leave the JSON to the listener.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)  # Other handlers (e.g. pytest's capture) may still see the original
+        if record.stack_info:
+            record.exc_text = "\n".join(filter(None, (record.exc_text, record.stack_info)))
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped[record.levelname] += 1
+
+
+class Sampled:
+    """Logs 1 in every `every` calls to info/debug on logger; the others cost one counter increment."""
+
+    def __init__(self, logger, every=CHUNK_LOG_SAMPLE_EVERY):
+        self.logger = logger
+        self.every = max(int(every), 1)
+        self._calls = itertools.count()
+
+    def _log(self, level, msg, args, values):
+        if next(self._calls) % self.every:
+            return
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, *args, extra={"fields": dict(values, sample_every=self.every)})
+
+    def info(self, msg, *args, **values):
+        self._log(logging.INFO, msg, args, values)
+
+    def debug(self, msg, *args, **values):
+        self._log(logging.DEBUG, msg, args, values)
+
+
+class _Logging:
+    """The handler and listener installed by configure()."""
+
+    def __init__(self):
+        self.handler = None
+        self.listener = None
+        self.lock = threading.Lock()
+
+    def stats(self):
+        handler = self.handler
+        if handler is None:
+            return {"configured": False}
+        return {"configured": True, "queued": handler.queue.qsize(), "capacity": handler.queue.maxsize,
+                "dropped": dict(handler.dropped)}
+
+
+_state = _Logging()
+
+
+def configure(level=logging.INFO, queue_size=LOG_QUEUE_SIZE, json_format=True, stream=None, caller_info=None):
+    """
+    Route the root logger through a bounded queue to one listener thread writing
+    to stream (stderr). Replaces the root logger's handlers; safe to call again.
+
+    With caller_info=False, records carry no file/line/function for the rest of
+    the process: finding the caller walks the stack on every call and is the
+    largest part of building a record. The default leaves that to logging.
+    Process and multiprocessing names are not collected either.
+    """
+    if caller_info is False:
+        logging._srcfile = None  # See "Optimization" in the logging HOWTO
+    logging.logProcesses = logging.logMultiprocessing = False
+    with _state.lock:
+        if _state.listener is not None:
+            _state.listener.stop()
+        output = logging.StreamHandler(stream or sys.stderr)
+        if json_format:
+            output.setFormatter(JSONFormatter())
+        else:
+            output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s:%(name)s:%(message)s"))
+        handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+        listener = logging.handlers.QueueListener(handler.queue, output)
+        listener.start()
+        _state.handler, _state.listener = handler, listener
+    return handler
+
+
+def flush(timeout=5):
+    """Wait (up to timeout seconds) until the listener has written everything queued."""
+    handler = _state.handler
+    deadline = time.monotonic() + timeout
+    while handler is not None and handler.queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def shutdown():
+    """Write out what is queued and stop the listener."""
+    with _state.lock:
+        if _state.listener is not None:
+            _state.listener.stop()
+            _state.listener = None
+
+
+def stats():
+    """Records waiting in the queue, its capacity, and records dropped per level on a full queue."""
+    return _state.stats()
+
+
+atexit.register(shutdown)
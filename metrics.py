@@ -0,0 +1,293 @@
+"""
+In-process metrics, exposed at /metrics in the Prometheus text format.
+
+Recording has to be cheap enough for the per-chunk send path, so every
+metric is sharded by thread: a thread only ever writes to its own shard
+(plain list increments, no lock), and a scrape adds the shards up. A lock is
+taken only when a thread records into a metric for the first time. Under
+gevent every greenlet counts as a thread, so past MAX_SHARDS new ones share
+an overflow shard that is written under a lock.
+
+Labelled metrics hand out one child per label combination; on hot paths,
+look the child up once (histogram.labels("nomi", "send_message")) and keep it.
+
+    REQUESTS = metrics.registry.histogram("http_request_duration_seconds", "Request latency", ["route"])
+    REQUESTS.labels("/send").observe(0.12)
+    with REQUESTS.labels("/send").time():
+        ...
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MAX_SHARDS = 256  # Per-thread shards per metric before new threads share one (see module docstring)
+
+_get_ident = threading.get_ident
+
+
+class _Shards:
+    """Per-thread value lists of one metric child. new_shard() builds the list for a thread."""
+
+    __slots__ = ("_shards", "_lock", "_new_shard", "_overflow")
+
+    def __init__(self, new_shard):
+        self._shards = {}
+        self._lock = threading.Lock()
+        self._new_shard = new_shard
+        self._overflow = None
+
+    def create(self, ident):
+        with self._lock:
+            if len(self._shards) < MAX_SHARDS:
+                shard = self._shards[ident] = self._new_shard()
+                return shard
+            if self._overflow is None:
+                self._overflow = self._new_shard()
+                self._shards[None] = self._overflow
+            return None
+
+    def values(self):
+        with self._lock:
+            return list(self._shards.values())
+
+
+class _CounterChild:
+    __slots__ = ("_shards", "_get")
+
+    def __init__(self):
+        self._shards = _Shards(lambda: [0])
+        self._get = self._shards._shards.get
+
+    def inc(self, amount=1):
+        shard = self._get(_get_ident())
+        if shard is None:
+            shard = self._shards.create(_get_ident())
+            if shard is None:
+                with self._shards._lock:
+                    self._shards._overflow[0] += amount
+                return
+        shard[0] += amount
+
+    def value(self):
+        return sum(shard[0] for shard in self._shards.values())
+
+
+class _HistogramChild:
+    __slots__ = ("_shards", "_get", "_bounds", "_sum_index")
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._sum_index = len(bounds) + 1  # Shard layout: one count per bucket, +Inf, then the sum
+        self._shards = _Shards(lambda: [0] * (len(bounds) + 1) + [0.0])
+        self._get = self._shards._shards.get
+
+    def observe(self, value):
+        shard = self._get(_get_ident())
+        if shard is None:
+            shard = self._shards.create(_get_ident())
+            if shard is None:
+                with self._shards._lock:
+                    self._shards._overflow[bisect_left(self._bounds, value)] += 1
+                    self._shards._overflow[self._sum_index] += value
+                return
+        shard[bisect_left(self._bounds, value)] += 1
+        shard[self._sum_index] += value
+
+    def time(self):
+        """Context manager (or decorator) observing the wall time of its body."""
+        return _Timer(self)
+
+    def counts(self):
+        """(cumulative bucket counts including +Inf, sum)."""
+        totals = [0] * (len(self._bounds) + 2)
+        for shard in self._shards.values():
+            for i, value in enumerate(shard):
+                totals[i] += value
+        cumulative, running = [], 0
+        for count in totals[:-1]:
+            running += count
+            cumulative.append(running)
+        return cumulative, totals[-1]
+
+
+class _Timer:
+    __slots__ = ("_child", "_started")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._started)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(self._child):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        """The child for these label values (positional, in labelnames order)."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(tuple(str(value) for value in values), self._new_child())
+                self._children[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        with self._lock:
+            children = {}
+            for values, child in self._children.items():
+                children.setdefault(tuple(str(value) for value in values), child)
+        return sorted(children.items())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def expose(self):
+        for values, child in self._samples():
+            yield f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value())}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def expose(self):
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for values, child in self._samples():
+            cumulative, total = child.counts()
+            for bound, count in zip(bounds, cumulative):
+                labels = _format_labels(self.labelnames + ("le",), values + (bound,))
+                yield f"{self.name}_bucket{labels} {count}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative[-1]}"
+
+
+class Gauge(_Metric):
+    """A value read at scrape time from callback() -> number, or {label values tuple: number}."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labelnames=()):
+        self.callback = callback
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None
+
+    def expose(self):
+        value = self.callback()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for values, number in sorted(items):
+            yield f"{self.name}{_format_labels(self.labelnames, tuple(values))} {_format_value(number)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered differently.")
+                return existing  # Re-imports (e.g. the dev server's reloader) get the same metric
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback, labelnames=()):
+        return self._register(Gauge(name, documentation, callback, labelnames))
+
+    def expose(self):
+        """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return f"{value:.1f}"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = Registry()
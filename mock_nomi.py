@@ -0,0 +1,488 @@
+"""
+Local stand-in for the NOMI API, for load tests and benchmarks that must not
+touch api.nomi.ai.
+
+Implements the endpoints the app calls under /v1: rooms (list, create, get,
+delete), room chat, chat/request, the loop endpoints, the room message
+listing used by the receive channel, nomis (list, get) and direct chat.
+Responses follow the shapes of the real API; rooms and messages live in
+memory.
+
+It also stands in for the app's other upstreams, so one process covers a
+whole load test: Gemini's generateContent (point GEMINI_BASE_URL at the
+server root) and HTML pages of a given size for URL mode (GET /pages/<chars>).
+
+Behaviour is configurable, at start-up or while running:
+
+- latency / reply_latency: a distribution (see Latency) applied to every
+  request, and instead of it to requests that produce a NOMI reply
+  (direct chat and chat/request) or a Gemini completion, which are much
+  slower upstream.
+- error_rate: fraction of requests answered 503.
+- rate_limit: (per second, burst) token bucket; excess requests get 429 with
+  Retry-After, like the real API.
+- max_message_length: longer messageText is rejected with 400.
+
+It is a small HTTP/1.1 server on asyncio (keep-alive, no dependencies), so a
+slow response is a timer, not a thread, and thousands of requests per second
+fit in one process; --processes shares the port between several.
+
+    python mock_nomi.py --port 8765 --latency lognormal:0.08:0.5 --error-rate 0.01
+    NOMI_API_BASE_URL=http://127.0.0.1:8765/v1 GEMINI_BASE_URL=http://127.0.0.1:8765 python app.py
+
+Or in-process: MockNomi(latency=0.01).start().base_url. GET /__mock/stats
+returns request counters; POST /__mock/config changes the settings above.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from http import HTTPStatus
+from uuid import uuid4
+
+MOCK_LATENCY = "constant:0.02"  # Default latency of every request
+MOCK_REPLY_LATENCY = "lognormal:0.5:0.4"  # Default latency of requests that produce a NOMI reply
+MAX_MESSAGE_LENGTH = 600  # Longest messageText accepted (the app sends at most 450 characters plus a chunk header)
+ROOM_HISTORY = 1000  # Messages kept per room for the message listing
+
+# Route kinds: what latency, authentication and counting a route gets
+NOMI = "nomi"
+REPLY = "reply"  # NOMI endpoints that generate a reply
+GEMINI = "gemini"
+PAGE = "page"
+CONTROL = "control"  # /__mock endpoints: no latency, limits or counting
+
+
+class Latency:
+    """
+    A latency distribution in seconds, parsed from a spec:
+
+        0.05 / constant:0.05       always 50 ms
+        uniform:0.01:0.1           between 10 and 100 ms
+        normal:0.05:0.01           mean 50 ms, standard deviation 10 ms (never negative)
+        lognormal:0.05:0.5         median 50 ms, sigma 0.5 (a long tail, like real APIs)
+        exponential:0.05           mean 50 ms
+    """
+
+    def __init__(self, spec):
+        self.spec = str(spec)
+        kind, _, rest = self.spec.partition(":")
+        if not rest:
+            kind, rest = "constant", kind
+        args = [float(value) for value in rest.split(":")]
+        samplers = {
+            "constant": lambda: args[0],
+            "uniform": lambda: random.uniform(args[0], args[1]),
+            "normal": lambda: max(random.gauss(args[0], args[1]), 0.0),
+            "lognormal": lambda: random.lognormvariate(math.log(args[0]), args[1]),
+            "exponential": lambda: random.expovariate(1 / args[0]),
+        }
+        if kind not in samplers:
+            raise ValueError(f"Unknown latency distribution {kind!r}; use one of {', '.join(samplers)}.")
+        self.sample = samplers[kind]
+
+    def __repr__(self):
+        return self.spec
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _error(status, error_type, **details):
+    return status, {"error": dict(details, type=error_type)}
+
+
+class MockNomi:
+    def __init__(self, latency=MOCK_LATENCY, reply_latency=MOCK_REPLY_LATENCY, error_rate=0.0, rate_limit=None,
+                 max_message_length=MAX_MESSAGE_LENGTH, host="127.0.0.1", port=0):
+        self.latency = latency
+        self.reply_latency = reply_latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.max_message_length = max_message_length
+        self.host = host
+        self.port = port
+        self.base_url = None
+        self.requests = 0
+        self.throttled = 0
+        self.stats = {"errors": 0, "too_long": 0, "routes": {}}
+        self._tokens = rate_limit[1] if rate_limit else 0
+        self._updated = time.monotonic()
+        self._loop = None
+        self._thread = None
+        self._server = None
+        self._connections = set()
+        self.nomis = [{"uuid": str(uuid4()), "gender": gender, "name": name, "created": _now(),
+                       "relationshipType": "Friend"} for name, gender in (("Collin", "Male"), ("Homer", "Male"))]
+        self.rooms = {}
+        self._routes = [
+            ("GET", r"/v1/rooms", self._list_rooms, NOMI),
+            ("POST", r"/v1/rooms", self._create_room, NOMI),
+            ("GET", r"/v1/rooms/([^/]+)", self._get_room, NOMI),
+            ("DELETE", r"/v1/rooms/([^/]+)", self._delete_room, NOMI),
+            ("POST", r"/v1/rooms/([^/]+)/chat", self._room_chat, NOMI),
+            ("POST", r"/v1/rooms/([^/]+)/chat/request", self._chat_request, REPLY),
+            ("GET", r"/v1/rooms/([^/]+)/messages", self._room_messages, NOMI),
+            ("POST", r"/v1/rooms/([^/]+)/loop", self._start_loop, NOMI),
+            ("POST", r"/v1/rooms/([^/]+)/loop/stop", self._stop_loop, NOMI),
+            ("GET", r"/v1/nomis", self._list_nomis, NOMI),
+            ("GET", r"/v1/nomis/([^/]+)", self._get_nomi, NOMI),
+            ("POST", r"/v1/nomis/([^/]+)/chat", self._nomi_chat, REPLY),
+            ("POST", r"/v1beta/models/([^/:]+):generateContent", self._generate_content, GEMINI),
+            ("GET", r"/pages/(\d+)", self._page, PAGE),
+            ("GET", r"/__mock/stats", self._mock_stats, CONTROL),
+            ("POST", r"/__mock/config", self._mock_config, CONTROL),
+        ]
+        self._routes = [(method, re.compile(pattern + r"/?"), handler, kind)
+                        for method, pattern, handler, kind in self._routes]
+
+    @property
+    def latency(self):
+        return self._latency
+
+    @latency.setter
+    def latency(self, spec):
+        self._latency = spec if isinstance(spec, Latency) else Latency(spec)
+
+    @property
+    def reply_latency(self):
+        return self._reply_latency
+
+    @reply_latency.setter
+    def reply_latency(self, spec):
+        self._reply_latency = spec if isinstance(spec, Latency) else Latency(spec)
+
+    # --- request handling -------------------------------------------------
+
+    async def handle(self, method, path, headers, body):
+        """
+        Answer one request. Returns (status, body, extra_headers); body is a
+        dict sent as JSON or a str sent as HTML.
+        """
+        path, _, query = path.partition("?")
+        for route_method, pattern, handler, kind in self._routes:
+            match = pattern.fullmatch(path)
+            if match and route_method == method:
+                break
+        else:
+            return (*_error(404, "RouteNotFound"), ())
+        if kind == CONTROL:
+            return (*handler(body), ())
+
+        self.requests += 1
+        route = re.sub(r"\(.*?\)", "<id>", f"{method} {pattern.pattern[:-2]}")
+        self.stats["routes"][route] = self.stats["routes"].get(route, 0) + 1
+        if kind in (NOMI, REPLY) and not headers.get("authorization", "").startswith("Bearer "):
+            return (*_error(401, "InvalidAPIKey"), ())
+        if kind == GEMINI and not (headers.get("x-goog-api-key") or "key=" in query):
+            return 403, {"error": {"code": 403, "message": "API key missing.", "status": "PERMISSION_DENIED"}}, ()
+        retry_after = self._take_token()
+        if retry_after:
+            # Rounded up: a client waiting exactly Retry-After must find the token refilled.
+            return (*_error(429, "RateLimitExceeded"), (("Retry-After", f"{math.ceil(retry_after * 100) / 100:.2f}"),))
+        await asyncio.sleep((self.reply_latency if kind in (REPLY, GEMINI) else self.latency).sample())
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return (*_error(503, "ServiceUnavailable"), ())
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            return (*_error(400, "InvalidBody"), ())
+        return (*handler(payload, *match.groups()), ())
+
+    def _take_token(self):
+        """Seconds until the next token if the rate limit is exceeded, else 0."""
+        if not self.rate_limit:
+            return 0
+        rate, burst = self.rate_limit
+        now = time.monotonic()
+        self._tokens = min(burst, self._tokens + (now - self._updated) * rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        self.throttled += 1
+        return (1 - self._tokens) / rate
+
+    def _message(self, text):
+        return {"uuid": str(uuid4()), "text": text, "sent": _now()}
+
+    def _check_text(self, payload):
+        text = payload.get("messageText")
+        if not isinstance(text, str) or not text:
+            return _error(400, "InvalidBody", issues=["messageText is required"])
+        if self.max_message_length and len(text) > self.max_message_length:
+            self.stats["too_long"] += 1
+            return _error(400, "MessageLengthLimitExceeded", messageLengthLimit=self.max_message_length)
+        return None
+
+    def _room(self, room_uuid):
+        room = self.rooms.get(room_uuid)
+        if room is None:
+            # Benchmarks send to made-up rooms; create them on first use instead of answering 404.
+            room = self.rooms[room_uuid] = {
+                "uuid": room_uuid, "name": f"Room {room_uuid[:8]}", "created": _now(), "updated": _now(),
+                "status": "Default", "backchannelingEnabled": True, "note": "", "nomis": self.nomis[:1],
+                "messages": deque(maxlen=ROOM_HISTORY)}
+        return room
+
+    @staticmethod
+    def _public(room):
+        return {key: value for key, value in room.items() if key != "messages"}
+
+    def _list_rooms(self, payload):
+        return 200, {"rooms": [self._public(room) for room in self.rooms.values()]}
+
+    def _create_room(self, payload):
+        if not payload.get("name") or not payload.get("nomiUuids"):
+            return _error(400, "InvalidBody", issues=["name and nomiUuids are required"])
+        room = self._room(str(uuid4()))
+        room.update(name=payload["name"], note=payload.get("note", ""),
+                    backchannelingEnabled=payload.get("backchannelingEnabled", True),
+                    nomis=[nomi for nomi in self.nomis if nomi["uuid"] in payload["nomiUuids"]])
+        return 200, self._public(room)
+
+    def _get_room(self, payload, room_uuid):
+        if room_uuid not in self.rooms:
+            return _error(404, "RoomNotFound")
+        return 200, self._public(self.rooms[room_uuid])
+
+    def _delete_room(self, payload, room_uuid):
+        if self.rooms.pop(room_uuid, None) is None:
+            return _error(404, "RoomNotFound")
+        return 200, {}
+
+    def _room_chat(self, payload, room_uuid):
+        error = self._check_text(payload)
+        if error:
+            return error
+        message = self._message(payload["messageText"])
+        self._room(room_uuid)["messages"].append(message)
+        return 200, {"sentMessage": message}
+
+    def _chat_request(self, payload, room_uuid):
+        room = self._room(room_uuid)
+        nomi = next((n for n in self.nomis if n["uuid"] == payload.get("nomiUuid")), self.nomis[0])
+        reply = dict(self._message(f"{nomi['name']} has read {len(room['messages'])} messages in this room."),
+                     name=nomi["name"])
+        room["messages"].append(reply)
+        return 200, {"replyMessage": reply}
+
+    def _room_messages(self, payload, room_uuid):
+        return 200, {"messages": list(self._room(room_uuid)["messages"])}
+
+    def _start_loop(self, payload, room_uuid):
+        self._room(room_uuid)["loop"] = payload
+        return 200, {"status": "Loop started.", "room": room_uuid}
+
+    def _stop_loop(self, payload, room_uuid):
+        self._room(room_uuid).pop("loop", None)
+        return 200, {"status": "Loop stopped.", "room": room_uuid}
+
+    def _list_nomis(self, payload):
+        return 200, {"nomis": self.nomis}
+
+    def _get_nomi(self, payload, nomi_uuid):
+        nomi = next((n for n in self.nomis if n["uuid"] == nomi_uuid), None)
+        return (200, nomi) if nomi else _error(404, "NomiNotFound")
+
+    def _nomi_chat(self, payload, nomi_uuid):
+        error = self._check_text(payload)
+        if error:
+            return error
+        return 200, {"sentMessage": self._message(payload["messageText"]),
+                     "replyMessage": self._message(f"Got your {len(payload['messageText'])} characters.")}
+
+    def _generate_content(self, payload, model):
+        """A Gemini generateContent response "polishing" the text after the prompt's last colon."""
+        contents = payload.get("contents") or []
+        prompt = " ".join(part.get("text", "") for content in contents for part in content.get("parts", []))
+        text = prompt.rsplit(": ", 1)[-1].strip()
+        text = text[:1].upper() + text[1:]
+        words = len(prompt.split())
+        return 200, {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                                     "finishReason": "STOP", "index": 0}],
+                     "usageMetadata": {"promptTokenCount": words, "candidatesTokenCount": len(text.split()),
+                                       "totalTokenCount": words + len(text.split())},
+                     "modelVersion": model}
+
+    def _page(self, payload, size):
+        """An HTML article of about size characters of text, for URL mode."""
+        paragraph = ("The quick brown fox jumps over the lazy dog while the NOMI keeps the room "
+                     "entertained with long stories about nothing in particular. ")
+        count = max(int(size) // len(paragraph), 1)
+        body = "\n".join(f"<h2>Section {i + 1}</h2><p>{paragraph}</p>" if i % 5 == 0 else f"<p>{paragraph}</p>"
+                         for i in range(count))
+        return 200, f"<!DOCTYPE html><html><head><title>Page of {size} characters</title></head><body>{body}</body></html>"
+
+    def _mock_stats(self, body):
+        return 200, dict(self.stats, requests=self.requests, throttled=self.throttled, rooms=len(self.rooms),
+                         pid=os.getpid())
+
+    def _mock_config(self, body):
+        try:
+            settings = json.loads(body or b"{}")
+            for key in ("latency", "reply_latency", "error_rate", "max_message_length"):
+                if key in settings:
+                    setattr(self, key, settings[key])
+            if "rate_limit" in settings:
+                self.rate_limit = tuple(settings["rate_limit"]) if settings["rate_limit"] else None
+                self._tokens = self.rate_limit[1] if self.rate_limit else 0
+        except (ValueError, TypeError) as e:
+            return _error(400, "InvalidBody", issues=[str(e)])
+        return 200, {"latency": repr(self.latency), "reply_latency": repr(self.reply_latency),
+                     "error_rate": self.error_rate, "rate_limit": self.rate_limit,
+                     "max_message_length": self.max_message_length}
+
+    # --- server -----------------------------------------------------------
+
+    async def serve(self, reuse_port=False):
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: _HTTPProtocol(self), self.host, self.port,
+                                                reuse_port=reuse_port or None, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{self.host}:{self.port}/v1"
+        return self._server
+
+    def start(self):
+        """Serve on a background thread with its own event loop. Returns self."""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            ready.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="mock-nomi", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        """Close the listening socket and every open connection, then end the background loop."""
+        if self._loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            for protocol in list(self._connections):
+                protocol.transport.close()
+            pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            self._loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop)
+        self._thread.join(10)
+
+
+class _HTTPProtocol(asyncio.Protocol):
+    """Minimal HTTP/1.1 with keep-alive; requests on a connection are answered in order."""
+
+    def __init__(self, mock):
+        self.mock = mock
+        self.buffer = bytearray()
+        self.requests = asyncio.Queue()
+        self.worker = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.worker = asyncio.get_running_loop().create_task(self._answer())
+        self.mock._connections.add(self)
+
+    def connection_lost(self, exc):
+        self.worker.cancel()
+        self.mock._connections.discard(self)
+
+    def data_received(self, data):
+        self.buffer += data
+        while True:
+            end = self.buffer.find(b"\r\n\r\n")
+            if end < 0:
+                return
+            lines = bytes(self.buffer[:end]).decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                self.transport.close()
+                return
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            if len(self.buffer) < end + 4 + length:
+                return
+            body = bytes(self.buffer[end + 4:end + 4 + length])
+            del self.buffer[:end + 4 + length]
+            keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+            self.requests.put_nowait((method, target, headers, body, keep_alive))
+
+    async def _answer(self):
+        while True:
+            method, target, headers, body, keep_alive = await self.requests.get()
+            status, payload, extra = await self.mock.handle(method, target, headers, body)
+            if isinstance(payload, str):
+                data, content_type = payload.encode(), "text/html; charset=utf-8"
+            else:
+                data, content_type = json.dumps(payload).encode(), "application/json"
+            head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}",
+                    f"Content-Length: {len(data)}", "Connection: " + ("keep-alive" if keep_alive else "close")]
+            head.extend(f"{name}: {value}" for name, value in extra)
+            if self.transport.is_closing():
+                return
+            self.transport.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+            if not keep_alive:
+                self.transport.close()
+                return
+
+
+def parse_rate_limit(spec):
+    """'10:20' -> (10.0 per second, burst 20)."""
+    rate, _, burst = spec.partition(":")
+    return float(rate), float(burst or rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default=MOCK_LATENCY, help="latency distribution of every request")
+    parser.add_argument("--reply-latency", default=MOCK_REPLY_LATENCY, help="latency of requests producing a reply")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered 503")
+    parser.add_argument("--rate-limit", type=parse_rate_limit, help="PER_SECOND[:BURST], excess answered 429")
+    parser.add_argument("--max-message-length", type=int, default=MAX_MESSAGE_LENGTH, help="0 for no limit")
+    parser.add_argument("--processes", type=int, default=1, help="processes sharing the port (state is per process)")
+    args = parser.parse_args()
+
+    for _ in range(args.processes - 1):
+        if os.fork() == 0:
+            break
+    mock = MockNomi(args.latency, args.reply_latency, args.error_rate, args.rate_limit, args.max_message_length,
+                    args.host, args.port)
+
+    async def run():
+        await mock.serve(reuse_port=args.processes > 1)
+        print(f"Mock NOMI API (pid {os.getpid()}) at {mock.base_url}", flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+Durable outbox for chunked room sends, stored in SQLite.
+
+A send is written to the outbox (one row per chunk) in transactions of
+enqueue_batch chunks, so none holds the write lock for the whole send.
+enqueue() writes every chunk before the first one goes out; a streamed send
+(URL mode, encoded while it is sent) uses enqueue_streaming(), which hands
+each batch to the sender once it is committed so persisting overlaps with
+encoding and sending. Each chunk's delivered state is recorded too, and
+the stream records how many chunks were queued once they all are.
+
+If the process dies part way through, the streams it was sending are still
+marked 'sending' and resume_orphans() hands them to a new owner, which
+continues from the first undelivered chunk. Owners are told apart by a
+token made when this module is imported, not by pid alone: a restarted
+container usually gets the same pid (often 1) as the process it replaces.
+A streamed send interrupted before all its chunks were written cannot be
+finished from the outbox and is marked failed instead.
+
+Delivered marks are committed in batches (every commit_every chunks or
+commit_interval seconds), so a crash can resend the last few chunks of a
+stream: delivery is at-least-once. Receivers drop repeated i/n indices (see
+reassembly). The database runs in WAL mode so readers polling progress never
+block the writers.
+"""
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from uuid import uuid4
+
+OUTBOX_COMMIT_EVERY = 8  # Delivered chunks per commit
+OUTBOX_COMMIT_INTERVAL = 1.0  # Seconds before a partial batch of delivered marks is committed anyway
+OUTBOX_PAGE_SIZE = 256  # Pending chunks read from the database at a time
+OUTBOX_ENQUEUE_BATCH = 16  # Chunks written per transaction while a send is being enqueued
+OUTBOX_RETENTION = 24 * 3600  # Seconds finished streams are kept before purge()
+
+SENDING = "sending"
+DELIVERED = "delivered"
+FAILED = "failed"
+
+INSTANCE = uuid4().hex  # Owner token of the streams this process sends
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    stream TEXT PRIMARY KEY,
+    room TEXT NOT NULL,
+    label TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'sending',
+    owner_pid INTEGER,
+    owner_token TEXT,
+    queued INTEGER,
+    error TEXT,
+    created REAL NOT NULL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS streams_state ON streams (state, created);
+CREATE TABLE IF NOT EXISTS chunks (
+    stream TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    delivered REAL,
+    PRIMARY KEY (stream, seq)
+) WITHOUT ROWID;
+"""
+
+# Columns added since the first schema, for outbox files created before them.
+# Streams written before queued existed were written in full before sending.
+MIGRATIONS = {
+    "owner_token": ["ALTER TABLE streams ADD COLUMN owner_token TEXT"],
+    "queued": ["ALTER TABLE streams ADD COLUMN queued INTEGER",
+               "UPDATE streams SET queued = (SELECT COUNT(*) FROM chunks WHERE chunks.stream = streams.stream)"],
+}
+
+Stream = namedtuple("Stream", ["stream", "room", "label", "total", "state", "error"])
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Outbox:
+    def __init__(self, path, commit_every=OUTBOX_COMMIT_EVERY, commit_interval=OUTBOX_COMMIT_INTERVAL,
+                 enqueue_batch=OUTBOX_ENQUEUE_BATCH):
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.enqueue_batch = max(int(enqueue_batch), 1)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(streams)")}
+            for column, statements in MIGRATIONS.items():
+                if column not in columns:
+                    for statement in statements:
+                        conn.execute(statement)
+
+    def _connection(self):
+        """One connection per thread; sqlite3 connections must not be shared across threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # WAL keeps this crash-safe; only an OS crash can lose the last commits
+        return conn
+
+    def enqueue(self, stream, room, label, total, messages):
+        """
+        Record a send whose chunks are all known up front: every (seq, body)
+        in messages is written before this returns, so an interrupted send can
+        always be resumed. Deliver it with pending_chunks().
+        """
+        self._start(stream, room, label, total)
+        for _ in self._persist(stream, messages):
+            pass
+
+    def enqueue_streaming(self, stream, room, label, total, messages):
+        """
+        Record a send whose chunks are produced while it goes out. The returned
+        iterator yields messages back once they are committed, enqueue_batch at
+        a time, so the caller sends each chunk as soon as it is durable and a
+        streamed send is never held in memory.
+        """
+        self._start(stream, room, label, total)
+        return self._persist(stream, messages)
+
+    def _start(self, stream, room, label, total):
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT INTO streams (stream, room, label, total, owner_pid, owner_token, created) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", (stream, room, label, total, os.getpid(), INSTANCE, time.time()))
+
+    def _persist(self, stream, messages):
+        messages = iter(messages)
+        queued = 0
+        while True:
+            batch = list(itertools.islice(messages, self.enqueue_batch))
+            conn = self._connection()
+            with conn:
+                conn.executemany("INSERT INTO chunks (stream, seq, body) VALUES (?, ?, ?)",
+                                 ((stream, seq, body) for seq, body in batch))
+                queued += len(batch)
+                if not batch:
+                    # Fewer than total when an idempotent retry skips chunks delivered before.
+                    conn.execute("UPDATE streams SET queued = ? WHERE stream = ?", (queued, stream))
+                    return
+            yield from batch
+
+    def stream(self, stream):
+        row = self._connection().execute(
+            "SELECT stream, room, label, total, state, error FROM streams WHERE stream = ?", (stream,)).fetchone()
+        return Stream(*row) if row else None
+
+    def pending_chunks(self, stream, page_size=OUTBOX_PAGE_SIZE):
+        """Yield (seq, body) for undelivered chunks in order, a page at a time."""
+        conn = self._connection()
+        after = 0
+        while True:
+            rows = conn.execute("SELECT seq, body FROM chunks WHERE stream = ? AND seq > ? AND delivered IS NULL "
+                                "ORDER BY seq LIMIT ?", (stream, after, page_size)).fetchall()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0]
+
+    def delivery(self, stream):
+        return Delivery(self, stream)
+
+    def resume_orphans(self):
+        """
+        Claim streams left 'sending' by a process that no longer exists.
+        Returns the claimed stream ids, oldest first. Claimed streams that
+        were interrupted before all their chunks were written are marked
+        failed rather than returned.
+        """
+        conn = self._connection()
+        claimed = []
+        incomplete = 0
+        for stream, owner_pid, owner_token, queued in conn.execute(
+                "SELECT stream, owner_pid, owner_token, queued FROM streams WHERE state = ? ORDER BY created",
+                (SENDING,)).fetchall():
+            if owner_token == INSTANCE:
+                continue
+            # Another token on our own pid is an earlier process (e.g. before a container restart).
+            if owner_pid is not None and owner_pid != os.getpid() and pid_alive(owner_pid):
+                continue
+            with conn:
+                # Conditional on the old owner so two processes starting together cannot both claim it.
+                cursor = conn.execute("UPDATE streams SET owner_pid = ?, owner_token = ? "
+                                      "WHERE stream = ? AND state = ? AND owner_pid IS ? AND owner_token IS ?",
+                                      (os.getpid(), INSTANCE, stream, SENDING, owner_pid, owner_token))
+            if not cursor.rowcount:
+                continue
+            if queued is None:
+                written = conn.execute("SELECT COUNT(*) FROM chunks WHERE stream = ?", (stream,)).fetchone()[0]
+                Delivery(self, stream).fail(f"Interrupted after {written} chunks were written to the outbox.")
+                incomplete += 1
+                continue
+            claimed.append(stream)
+        if incomplete:
+            logging.warning(f"{incomplete} interrupted outbox stream(s) were not fully written and were marked failed")
+        if claimed:
+            logging.info(f"Resuming {len(claimed)} interrupted outbox stream(s)")
+        return claimed
+
+    def purge(self, older_than=OUTBOX_RETENTION):
+        """Delete finished streams (and their chunks) that finished more than older_than seconds ago."""
+        conn = self._connection()
+        cutoff = time.time() - older_than
+        with conn:
+            conn.execute("DELETE FROM chunks WHERE stream IN (SELECT stream FROM streams WHERE state != ? AND finished < ?)",
+                         (SENDING, cutoff))
+            removed = conn.execute("DELETE FROM streams WHERE state != ? AND finished < ?", (SENDING, cutoff)).rowcount
+        return removed
+
+    def stats(self):
+        conn = self._connection()
+        streams = dict(conn.execute("SELECT state, COUNT(*) FROM streams GROUP BY state").fetchall())
+        pending = conn.execute("SELECT COUNT(*) FROM chunks WHERE delivered IS NULL").fetchone()[0]
+        return {"streams": streams, "pending_chunks": pending}
+
+
+class Delivery:
+    """
+    Records delivery progress of one stream, committing delivered marks in batches.
+    Call complete() or fail() when done; flush() commits outstanding marks.
+    """
+
+    def __init__(self, outbox, stream):
+        self.outbox = outbox
+        self.stream = stream
+        self._marks = []
+        self._last_commit = time.monotonic()
+
+    def delivered(self, seq):
+        self._marks.append((time.time(), self.stream, seq))
+        if len(self._marks) >= self.outbox.commit_every or \
+                time.monotonic() - self._last_commit >= self.outbox.commit_interval:
+            self.flush()
+
+    def flush(self):
+        if self._marks:
+            conn = self.outbox._connection()
+            with conn:
+                conn.executemany("UPDATE chunks SET delivered = ? WHERE stream = ? AND seq = ?", self._marks)
+            self._marks = []
+        self._last_commit = time.monotonic()
+
+    def _finish(self, state, error=None):
+        conn = self.outbox._connection()
+        with conn:
+            if self._marks:
+                conn.executemany("UPDATE chunks SET delivered = ? WHERE stream = ? AND seq = ?", self._marks)
+                self._marks = []
+            conn.execute("UPDATE streams SET state = ?, error = ?, finished = ? WHERE stream = ?",
+                         (state, error, time.time(), self.stream))
+
+    def complete(self):
+        self._finish(DELIVERED)
+
+    def fail(self, error):
+        self._finish(FAILED, error)
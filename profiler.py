@@ -0,0 +1,133 @@
+"""
+On-demand profiling of the running process, for the admin /debug/profile
+endpoints.
+
+StackSampler is a statistical wall-clock sampler: for N seconds it reads
+every thread's current stack (sys._current_frames) at a fixed interval and
+counts identical stacks. The result renders as collapsed stacks, one
+"thread;outer;...;inner count" line per stack, the input format of
+flamegraph.pl and speedscope. It runs on the calling thread only while a
+profile is being taken, so nothing runs or is hooked when idle.
+
+RequestProfiles keeps deterministic cProfile runs of single requests. A
+cProfile profiler only sees the thread it was enabled on, so work handed to
+other threads (the prefetch encoder, broadcast room senders) shows up as
+waiting.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from uuid import uuid4
+
+SAMPLE_INTERVAL = 0.01  # Seconds between stack samples
+MAX_SAMPLE_SECONDS = 60  # Longest profile one request may take
+KEPT_PROFILES = 20  # Per-request cProfile results kept for retrieval
+
+# Leaf frames of threads parked with nothing to do (idle pool workers, timers, the accept loop)
+IDLE_FRAMES = {("threading.py", "Condition.wait"), ("threading.py", "Event.wait"), ("queue.py", "Queue.get"),
+               ("selectors.py", "PollSelector.select"), ("selectors.py", "EpollSelector.select"),
+               ("selectors.py", "SelectSelector.select"), ("socket.py", "socket.accept"),
+               ("threading.py", "Thread._wait_for_tstate_lock"), ("thread.py", "_worker")}
+
+_THREAD_NUMBER = re.compile(r"[-_]\d+")
+
+
+class ProfilerBusy(Exception):
+    """Only one stack sample runs at a time."""
+
+
+class StackSampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._labels = {}
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+        return label
+
+    def sample(self, seconds, interval=SAMPLE_INTERVAL, thread_filter=None, idle=True):
+        """
+        Sample every other thread for seconds. Returns (Counter of stack tuples, samples taken).
+        thread_filter keeps threads whose name contains it; idle=False drops parked threads.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already being taken.")
+        try:
+            stacks = Counter()
+            me = threading.get_ident()
+            deadline = time.monotonic() + min(seconds, MAX_SAMPLE_SECONDS)
+            samples = 0
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    name = names.get(ident, "unknown")
+                    if thread_filter and thread_filter not in name:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(self._label(frame.f_code))
+                        frame = frame.f_back
+                    if not idle and stack and tuple(stack[0].split(":", 1)) in IDLE_FRAMES:
+                        continue
+                    stack.append(_THREAD_NUMBER.sub("", name))
+                    stacks[tuple(reversed(stack))] += 1
+                samples += 1
+                time.sleep(interval)
+            return stacks, samples
+        finally:
+            self._lock.release()
+
+
+def collapse(stacks):
+    """Collapsed-stack text (flamegraph.pl / speedscope input), most frequent first."""
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestProfiles:
+    """cProfile runs of single requests, the last `kept` retrievable by id."""
+
+    def __init__(self, kept=KEPT_PROFILES):
+        self.kept = kept
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """A running profiler for the current thread, or None if another tool holds the profiling hook."""
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            return None
+        return profile
+
+    def finish(self, profile, description):
+        """Stop profile and keep it. Returns its id."""
+        profile.disable()
+        profile_id = uuid4().hex
+        with self._lock:
+            self._profiles[profile_id] = (description, profile)
+            while len(self._profiles) > self.kept:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def render(self, profile_id, sort="cumulative", limit=40):
+        """pstats text of a kept profile, or None."""
+        with self._lock:
+            entry = self._profiles.get(profile_id)
+        if entry is None:
+            return None
+        description, profile = entry
+        output = io.StringIO()
+        output.write(f"{description}\n\n")
+        pstats.Stats(profile, stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
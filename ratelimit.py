@@ -0,0 +1,211 @@
+"""
+Process-wide client-side rate limiting for NOMI API calls.
+
+Each endpoint family has a bucket. By default the buckets are adaptive only:
+the NOMI API publishes no rate limits, so nothing is held back until it
+answers 429 or sends Retry-After / RateLimit-* headers, which pause the
+bucket. With a configured (requests per second, burst) a bucket is also a
+token bucket: callers reserve tokens in arrival order and wait for their
+slot, so bursts queue fairly instead of turning into 429s, and every 429
+cuts its rate by 10% until successful calls restore it.
+
+RateLimitedAdapter waits on the thread making the request. Work that must
+not hold a thread while it waits reserves its token up front and waits on a
+timer instead (see RetryScheduler.submit and RateLimiter.prepaid).
+"""
+import asyncio
+import email.utils
+import threading
+import time
+from contextlib import contextmanager
+
+from requests.adapters import HTTPAdapter
+
+DEFAULT_LIMITS = {}  # Family -> (requests per second, burst), e.g. {"chat": (2.0, 5)}; none known, so adaptive only
+ADAPTIVE_PAUSE = 1.0  # Seconds a bucket without a rate pauses on a 429 that carries no Retry-After
+RATE_DECREASE = 0.9  # Multiply a bucket's rate by this on each 429
+MIN_RATE_FRACTION = 0.05  # A 429 never slows a bucket below this fraction of its configured rate
+RECOVERY_STEP = 0.02  # Fraction of the configured rate restored per successful call
+
+
+def bucket_for(path):
+    """Map a NOMI API URL path to its endpoint family."""
+    return "chat" if "/chat" in path else "rooms"
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(when - (now if now is not None else time.time()), 0.0)
+
+
+class TokenBucket:
+    """A token bucket, or with rate None a bucket that only honours pauses."""
+
+    def __init__(self, rate=None, burst=None):
+        self.configured_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst or 0)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"acquired": 0, "waited": 0, "wait_time": 0.0, "throttled": 0}
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Take a token now (possibly going into debt) and return how long to wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.rate is not None:
+                self._refill(now)
+                self.tokens -= 1
+                wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            wait = max(wait, self.blocked_until - now)
+            self.stats["acquired"] += 1
+            if wait > 0:
+                self.stats["waited"] += 1
+                self.stats["wait_time"] += wait
+            return wait
+
+    def paused_for(self):
+        return max(self.blocked_until - time.monotonic(), 0.0)
+
+    def pause(self, seconds):
+        """Hold every caller of this bucket back for seconds (e.g. from Retry-After)."""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def throttled(self):
+        with self.lock:
+            self.stats["throttled"] += 1
+            if self.rate is not None:
+                self.rate = max(self.rate * RATE_DECREASE, self.configured_rate * MIN_RATE_FRACTION)
+
+    def succeeded(self):
+        if self.rate is not None and self.rate < self.configured_rate:
+            with self.lock:
+                self.rate = min(self.configured_rate, self.rate + self.configured_rate * RECOVERY_STEP)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats, rate=self.rate, configured_rate=self.configured_rate, paused_for=self.paused_for())
+
+
+class RateLimiter:
+    def __init__(self, limits=None):
+        self.enabled = True
+        self.buckets = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.configure(DEFAULT_LIMITS if limits is None else limits)
+
+    def configure(self, limits):
+        for name, (rate, burst) in limits.items():
+            self.buckets[name] = TokenBucket(rate, burst)
+
+    def bucket(self, name):
+        """The bucket of an endpoint family; families without a configured limit get an adaptive one."""
+        target = self.buckets.get(name)
+        if target is None:
+            with self._lock:
+                target = self.buckets.setdefault(name, TokenBucket())
+        return target
+
+    def reserve(self, bucket):
+        """Take a token from bucket now. Returns seconds to wait before using it (0 when disabled)."""
+        return self.bucket(bucket).reserve() if self.enabled else 0.0
+
+    def paused_for(self, bucket):
+        """Seconds bucket is still paused (by a 429 or Retry-After) after a reserved token's wait."""
+        return self.bucket(bucket).paused_for() if self.enabled else 0.0
+
+    @contextmanager
+    def prepaid(self, bucket):
+        """Within the block, this thread's next request to bucket uses a token already taken with reserve()."""
+        self._local.prepaid = bucket
+        try:
+            yield
+        finally:
+            self._local.prepaid = None
+
+    def acquire(self, bucket):
+        """Block until the caller's turn in bucket (at once if its token was reserved up front, see prepaid)."""
+        if not self.enabled:
+            return
+        if getattr(self._local, "prepaid", None) == bucket:
+            self._local.prepaid = None
+            return
+        target = self.bucket(bucket)
+        wait = target.reserve()
+        while wait > 0:
+            time.sleep(wait)
+            wait = target.paused_for()  # A 429 may have paused the bucket while we waited
+
+    async def acquire_async(self, bucket):
+        if self.enabled:
+            target = self.bucket(bucket)
+            wait = target.reserve()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = target.paused_for()
+
+    def observe(self, bucket, status_code, headers):
+        """Adapt bucket to a response's status and rate-limit headers."""
+        if not self.enabled:
+            return
+        target = self.bucket(bucket)
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        remaining = headers.get("RateLimit-Remaining") or headers.get("X-RateLimit-Remaining")
+        reset = headers.get("RateLimit-Reset") or headers.get("X-RateLimit-Reset")
+        if status_code == 429:
+            target.throttled()
+            if retry_after is None and reset:
+                retry_after = parse_retry_after(reset)
+            if retry_after is None:
+                retry_after = 1 / target.rate if target.rate else ADAPTIVE_PAUSE
+            target.pause(retry_after)
+            return
+        target.succeeded()
+        if remaining is not None and reset:
+            try:
+                if int(remaining) <= 0:
+                    reset_seconds = float(reset)
+                    # Some APIs send an epoch timestamp instead of seconds-until-reset.
+                    target.pause(reset_seconds - time.time() if reset_seconds > 1e9 else reset_seconds)
+            except ValueError:
+                pass
+
+    def stats(self):
+        return {name: bucket.snapshot() for name, bucket in list(self.buckets.items())}
+
+
+limiter = RateLimiter()
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """requests transport adapter that passes every request through the limiter, waiting on the calling thread."""
+
+    def __init__(self, *args, rate_limiter=limiter, **kwargs):
+        self.rate_limiter = rate_limiter
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        bucket = bucket_for(request.path_url)
+        self.rate_limiter.acquire(bucket)
+        response = super().send(request, *args, **kwargs)
+        self.rate_limiter.observe(bucket, response.status_code, response.headers)
+        return response
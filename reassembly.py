@@ -0,0 +1,239 @@
+"""
+Reassembly of [ENCODED|CODE|TEXT|DIRECT_CHUNK i/n] messages.
+
+Chunks may arrive in any order and interleaved with other streams. Partial
+messages are tracked per (room, stream); contiguous chunks are decoded (and
+for ENCODED chunks, decompressed) as soon as they arrive, so a completed
+message is ready without a final pass over the whole payload.
+
+A repeated index with the same text is a redelivery and is ignored. A
+repeated index with different text means two streams share a key (two
+sends without a '#id' of the same kind and length at once): the partial
+stream is dropped and its key quarantined, rather than splicing the two
+together, until a new stream starts at chunk 1 (or ttl passes without chunks
+for that key).
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import chunk_codecs
+
+CHUNK_HEADER = re.compile(r"\[(ENCODED|CODE|TEXT|DIRECT)_CHUNK (\d+)/(\d+)((?: [^\]\s]+)*)\] ?")
+
+Chunk = namedtuple("Chunk", ["kind", "index", "total", "tag", "stream_id", "body"])
+Message = namedtuple("Message", ["room", "kind", "stream_id", "text", "total"])
+
+
+def parse_chunk(text):
+    """
+    Parse one chunk message. Returns a Chunk, or None for text without a chunk header.
+
+    Header tokens after i/n are optional: '#<id>' names the stream, anything
+    else is the codec/encoding tag of an ENCODED stream (see chunk_codecs.header_tag).
+    """
+    match = CHUNK_HEADER.match(text)
+    if not match:
+        return None
+    kind, index, total, tokens = match.groups()
+    tag = stream_id = None
+    for token in tokens.split():
+        if token.startswith("#"):
+            stream_id = token[1:]
+        else:
+            tag = token
+    return Chunk(kind, int(index), int(total), tag, stream_id, text[match.end():])
+
+
+class _EncodedDecoder:
+    """Text-decodes and decompresses an ENCODED stream group-aligned, as chunks become contiguous."""
+
+    def __init__(self, tag):
+        codec, self.encoding = chunk_codecs.parse_header_tag(tag)
+        self.decompressor = codec.decompressobj()
+        self.carry = ""
+        self.output = []
+        self.held = 0  # Bytes of decoded output and carried text
+
+    def feed(self, body):
+        text = self.carry + body if self.carry else body
+        aligned = len(text) - len(text) % self.encoding.group_size
+        if aligned:
+            self.output.append(self.decompressor.decompress(
+                self.encoding.decode(text[:aligned].encode(self.encoding.charset))))
+            self.held += len(self.output[-1])
+        self.held += len(text) - aligned - len(self.carry)
+        self.carry = text[aligned:]
+
+    def finish(self):
+        if self.carry:
+            self.output.append(self.decompressor.decompress(self.encoding.decode(self.carry.encode(self.encoding.charset))))
+        flush = getattr(self.decompressor, "flush", None)
+        if flush:
+            self.output.append(flush())
+        return b"".join(self.output).decode("utf-8")
+
+
+class _PlainDecoder:
+    def __init__(self, tag=None):
+        self.output = []
+        self.held = 0
+
+    def feed(self, body):
+        self.output.append(body)
+        self.held += len(body)
+
+    def finish(self):
+        return "".join(self.output)
+
+
+class _Partial:
+    __slots__ = ("kind", "total", "pending", "next_index", "decoder", "decoded", "size", "last_seen")
+
+    def __init__(self, kind, total, now):
+        self.kind = kind
+        self.total = total
+        self.pending = {}  # Out-of-order chunks: index -> Chunk
+        self.next_index = 1
+        self.decoder = None
+        self.decoded = {}  # Hash of each decoded chunk's text, to tell redeliveries from collisions
+        self.size = 0  # Bytes held: pending chunk text plus the decoder's output
+        self.last_seen = now
+
+    def is_redelivery(self, chunk):
+        """Whether chunk repeats an index already held with the same text (else it is a collision)."""
+        if chunk.index in self.pending:
+            return self.pending[chunk.index].body == chunk.body
+        return self.decoded.get(chunk.index) == hash(chunk.body)
+
+
+class Reassembler:
+    """
+    Tracks partial chunked messages per (room, stream) with bounded memory.
+
+    Args:
+        max_streams: Most partial streams kept; the least recently active is evicted first.
+        max_bytes: Cap on what partial streams hold (out-of-order chunk text and
+            decoded output) across all of them.
+        ttl: Seconds without a new chunk after which a partial stream is dropped,
+            and after which a quarantined key accepts chunks again.
+    """
+
+    def __init__(self, max_streams=10000, max_bytes=64 * 1024 * 1024, ttl=600, clock=time.monotonic):
+        self.max_streams = max_streams
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self._partials = OrderedDict()  # Least recently active first
+        self._quarantined = {}  # Key -> when a collision was last seen on it
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"chunks": 0, "duplicates": 0, "collisions": 0, "quarantined": 0, "completed": 0,
+                      "evicted": 0, "failed": 0}
+
+    def feed(self, room, text, stream_id=None):
+        """
+        Add one message. Returns a Message when it completes a stream, otherwise None.
+
+        stream_id overrides the '#id' header token; without either, a stream is
+        identified by its room, chunk kind and total.
+        """
+        chunk = parse_chunk(text)
+        if chunk is None:
+            return None
+        now = self.clock()
+        stream_id = stream_id or chunk.stream_id
+        key = (room, chunk.kind, stream_id, chunk.total)
+        with self._lock:
+            self.stats["chunks"] += 1
+            self._evict_stale(now)
+            if key in self._quarantined:
+                if chunk.index != 1 and now - self._quarantined[key] < self.ttl:
+                    self._quarantined[key] = now
+                    self.stats["quarantined"] += 1
+                    return None
+                del self._quarantined[key]
+            partial = self._partials.get(key)
+            if partial is None:
+                partial = self._partials[key] = _Partial(chunk.kind, chunk.total, now)
+            else:
+                self._partials.move_to_end(key)
+                partial.last_seen = now
+            if chunk.index > chunk.total or chunk.index < 1:
+                self.stats["duplicates"] += 1
+                return None
+            if chunk.index < partial.next_index or chunk.index in partial.pending:
+                if partial.is_redelivery(chunk):
+                    self.stats["duplicates"] += 1
+                else:
+                    self._drop(key)
+                    self._quarantined[key] = now
+                    self.stats["collisions"] += 1
+                return None
+            partial.pending[chunk.index] = chunk
+            partial.size += len(chunk.body)
+            self._bytes += len(chunk.body)
+            try:
+                self._advance(partial)
+            except Exception:
+                # Corrupt or undecodable stream: drop it rather than keep buffering.
+                self._drop(key)
+                self.stats["failed"] += 1
+                raise
+            if partial.next_index > partial.total:
+                self._drop(key)
+                self.stats["completed"] += 1
+                return Message(room, partial.kind, stream_id, partial.decoder.finish(), partial.total)
+            self._enforce_limits()
+        return None
+
+    def feed_transcript(self, room, messages):
+        """Feed an iterable of message texts (e.g. a room transcript) and return the completed Messages."""
+        completed = []
+        for text in messages:
+            message = self.feed(room, text)
+            if message is not None:
+                completed.append(message)
+        return completed
+
+    def evict_stale(self):
+        with self._lock:
+            self._evict_stale(self.clock())
+
+    def partial_count(self):
+        return len(self._partials)
+
+    def _advance(self, partial):
+        while partial.next_index in partial.pending:
+            chunk = partial.pending.pop(partial.next_index)
+            if partial.decoder is None:
+                partial.decoder = _EncodedDecoder(chunk.tag) if partial.kind == "ENCODED" else _PlainDecoder()
+            held = partial.decoder.held
+            partial.decoder.feed(chunk.body)
+            # The chunk's text now lives on as decoded output (larger or smaller than it).
+            grown = partial.decoder.held - held - len(chunk.body)
+            partial.size += grown
+            self._bytes += grown
+            partial.decoded[chunk.index] = hash(chunk.body)
+            partial.next_index += 1
+
+    def _drop(self, key):
+        partial = self._partials.pop(key)
+        self._bytes -= partial.size
+
+    def _evict_stale(self, now):
+        while self._partials:
+            key, partial = next(iter(self._partials.items()))
+            if now - partial.last_seen < self.ttl:
+                break
+            self._drop(key)
+            self.stats["evicted"] += 1
+        if len(self._quarantined) > self.max_streams:
+            for key in [key for key, seen in self._quarantined.items() if now - seen >= self.ttl]:
+                del self._quarantined[key]
+
+    def _enforce_limits(self):
+        while self._partials and (len(self._partials) > self.max_streams or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._partials)))
+            self.stats["evicted"] += 1
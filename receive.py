@@ -0,0 +1,160 @@
+"""
+Push-based receive channel for room messages.
+
+However many browser tabs watch a room, the server polls its message list
+upstream once per interval, diffs it against what it has already seen, and
+publishes only the new messages to the room's topic on an events.Broker,
+which streams them to every subscriber over SSE. Chunked messages
+([TEXT_CHUNK i/n] etc.) are also fed to a Reassembler, and a completed
+stream is published once as a single "reassembled" event.
+
+Polls are timer entries on the watcher's own retry.RetryScheduler, not a
+thread per room, so a slow or rate-limited upstream poll (the NOMI session
+waits for its "rooms" bucket) holds one of ROOM_POLL_WORKERS poll threads
+and never a worker that sends chunks. A room is polled only while it has
+subscribers (reference counted).
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import retry
+from reassembly import Reassembler
+
+ROOM_POLL_INTERVAL = 5  # Seconds between upstream polls of a watched room
+ROOM_POLL_MAX_BACKOFF = 60  # Longest wait between polls while the upstream keeps failing
+ROOM_POLL_WORKERS = 4  # Threads running due polls, across all watched rooms
+ROOM_SNAPSHOT_SIZE = 20  # Most recent messages sent to a subscriber when polling starts
+SEEN_MESSAGES = 2000  # Message ids remembered per room for diffing
+
+
+def message_id(message):
+    """Stable id of an upstream message: its uuid/id, else a digest of its content."""
+    for key in ("uuid", "id", "messageId"):
+        if message.get(key):
+            return str(message[key])
+    content = f"{message.get('sent') or message.get('createdAt')}|{message.get('text')}"
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def topic_for(room_uuid):
+    return f"room:{room_uuid}"
+
+
+class _RoomPoller:
+    def __init__(self, room_uuid):
+        self.room_uuid = room_uuid
+        self.subscribers = 0
+        self.active = True
+        self.seen = OrderedDict()
+        self.primed = False
+        self.failures = 0
+
+
+class RoomWatcher:
+    """
+    Args:
+        fetch_messages: fetch_messages(room_uuid) -> list of message dicts (oldest
+            first) or a Nomi-style {"error": ...} dict.
+        broker: events.Broker the updates are published to.
+        scheduler: retry.RetryScheduler whose timer runs the polls; by default
+            one of the watcher's own with `workers` threads.
+    """
+
+    def __init__(self, fetch_messages, broker, interval=ROOM_POLL_INTERVAL, scheduler=None, workers=ROOM_POLL_WORKERS):
+        self.fetch_messages = fetch_messages
+        self.broker = broker
+        self.interval = interval
+        self.scheduler = scheduler or retry.RetryScheduler(workers=workers, name="room-poll")
+        self.reassembler = Reassembler()
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()  # Polls of different rooms update the counters from different threads
+        self.stats = {"polls": 0, "errors": 0, "new_messages": 0, "reassembled": 0}
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def acquire(self, room_uuid):
+        """Register a subscriber for room_uuid; the first one starts polling."""
+        with self._lock:
+            poller = self._rooms.get(room_uuid)
+            if poller is None:
+                poller = self._rooms[room_uuid] = _RoomPoller(room_uuid)
+                self.broker.open(topic_for(room_uuid))
+                self.scheduler.call_later(0, lambda: self._poll(poller))
+            poller.subscribers += 1
+
+    def release(self, room_uuid):
+        """Drop a subscriber; the last one stops polling and closes the room's topic."""
+        with self._lock:
+            poller = self._rooms.get(room_uuid)
+            if poller is None:
+                return
+            poller.subscribers -= 1
+            if poller.subscribers > 0:
+                return
+            poller.active = False
+            del self._rooms[room_uuid]
+            self.broker.close(topic_for(room_uuid))
+
+    def _poll(self, poller):
+        if not poller.active:
+            return
+        topic = topic_for(poller.room_uuid)
+        self._count("polls")
+        try:
+            messages = self.fetch_messages(poller.room_uuid)
+        except Exception as e:
+            messages = {"error": f"Error fetching room messages: {e}"}
+        if retry.is_failure(messages):
+            poller.failures += 1
+            self._count("errors")
+            delay = min(self.interval * 2 ** poller.failures, ROOM_POLL_MAX_BACKOFF)
+            logging.warning(f"Polling room {poller.room_uuid} failed, next poll in {delay}s: {messages['error']}")
+            self.broker.publish(topic, "error", {"error": messages["error"], "retry_in": delay})
+        else:
+            poller.failures = 0
+            delay = self.interval
+            self._diff(poller, topic, messages)
+        if poller.active:
+            self.scheduler.call_later(delay, lambda: self._poll(poller))
+
+    def _diff(self, poller, topic, messages):
+        new = []
+        for message in messages:
+            key = message_id(message)
+            if key not in poller.seen:
+                poller.seen[key] = True
+                new.append(message)
+        while len(poller.seen) > SEEN_MESSAGES:
+            poller.seen.popitem(last=False)
+        if not poller.primed:
+            # First poll: everything is "new" to us but not to the room; send recent context once.
+            poller.primed = True
+            self.broker.publish(topic, "snapshot", {"messages": new[-ROOM_SNAPSHOT_SIZE:]})
+            return
+        for message in new:
+            self._count("new_messages")
+            self.broker.publish(topic, "message", message)
+            text = message.get("text")
+            if not text:
+                continue
+            try:
+                completed = self.reassembler.feed(poller.room_uuid, text)
+            except Exception as e:
+                logging.warning(f"Dropping undecodable chunk stream in room {poller.room_uuid}: {e}")
+                continue
+            if completed is not None:
+                self._count("reassembled")
+                self.broker.publish(topic, "reassembled", {"kind": completed.kind, "text": completed.text,
+                                                           "chunks": completed.total})
+
+    def snapshot(self):
+        with self._lock:
+            rooms = {room: poller.subscribers for room, poller in self._rooms.items()}
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return dict(stats, rooms=rooms, partial_streams=self.reassembler.partial_count())
@@ -0,0 +1,286 @@
+"""
+Retry engine shared by every NOMI call.
+
+RetryScheduler.submit is what the app sends with: delayed retries (and
+rate-limit waits) wait in one heap owned by a single timer thread instead of
+each sitting in time.sleep on its own thread, and attempts run on a small
+bounded pool, so thousands of pending retries cost memory, not threads. A
+sender that needs the outcome waits on the Future (a /send job on its one
+chunk at a time), and fan-outs (a broadcast's rooms, a windowed direct send)
+keep many submits in flight from one waiting thread; chain() strings the
+next step onto a Future. RetryScheduler.call is the inline form, for scripts
+and benchmarks, and call_async the asyncio one. Errors are classified once,
+here, so fatal ones (an invalid room, an over-long message) fail fast on
+every path.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from functools import partial
+
+import metrics
+import ratelimit
+
+MAX_RETRIES = 5  # Maximum number of attempts
+INITIAL_BACKOFF = 1  # Initial backoff time in seconds
+MAX_BACKOFF = 32  # Longest single wait between attempts
+DEFAULT_DEADLINE = 120  # Seconds after the first attempt past which no retry starts (429s are not attempts)
+ATTEMPT_WORKERS = 32  # Threads running submit()ted attempts; waiting retries use none
+
+# Substrings of error messages that retrying cannot fix. An open circuit breaker
+# (breaker.py) is fatal too: retrying would only queue more calls against a failing upstream.
+FATAL_ERRORS = ("Invalid room UUID", "Message length limit exceeded", "Room not found", "NOMI API Key not configured",
+                "Circuit open for")
+# Client errors that are still worth retrying: timeout, conflict, too early, rate limited.
+RETRYABLE_STATUS = {408, 409, 425, 429}
+_STATUS = re.compile(r"Nomi API error: (\d{3})")
+
+RetryOutcome = namedtuple("RetryOutcome", ["result", "attempts", "fatal"])
+
+RETRIES = metrics.registry.counter("nomi_retries", "Retries scheduled, by cause (rate_limited or error)", ["reason"])
+RETRY_WAIT = metrics.registry.counter("nomi_retry_wait_seconds", "Backoff scheduled before retries")
+_RATE_LIMITED_RETRIES, _ERROR_RETRIES = RETRIES.labels("rate_limited"), RETRIES.labels("error")
+
+
+def is_retryable(error):
+    """Classify an error message from a Nomi method as retryable (True) or fatal (False)."""
+    if any(marker in error for marker in FATAL_ERRORS):
+        return False
+    status = _STATUS.search(error)
+    if status:
+        code = int(status.group(1))
+        return code >= 500 or code in RETRYABLE_STATUS
+    return True
+
+
+def is_rate_limited(error):
+    """
+    A 429 while the rate limiter (ratelimit.py) is on. The limiter already holds
+    the next attempt back, so it needs no backoff and is not a failed try.
+    """
+    status = _STATUS.search(error)
+    return bool(status) and status.group(1) == "429" and ratelimit.limiter.enabled
+
+
+def is_failure(result):
+    """Nomi methods report failures as a dict with an "error" key."""
+    return isinstance(result, dict) and "error" in result
+
+
+def count_retry(error, delay):
+    (_RATE_LIMITED_RETRIES if is_rate_limited(error) else _ERROR_RETRIES).inc()
+    RETRY_WAIT.inc(delay)
+
+
+class RetryPolicy:
+    """
+    How often and how long to retry.
+
+    Delays use decorrelated jitter: each wait is drawn from [base, 3 * previous
+    wait], capped at max_backoff. deadline bounds the total time (seconds) from
+    the first attempt; a retry that would start after it is not made. It is
+    what ends a run of 429s, which do not count against max_attempts; None
+    lifts it.
+    """
+
+    def __init__(self, max_attempts=MAX_RETRIES, base=INITIAL_BACKOFF, max_backoff=MAX_BACKOFF, deadline=DEFAULT_DEADLINE,
+                 classify=is_retryable):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.classify = classify
+
+    def next_delay(self, previous_delay):
+        return min(self.max_backoff, random.uniform(self.base, max(previous_delay, self.base) * 3))
+
+    def delay_for(self, error, previous_delay):
+        """Backoff before the next attempt; none after a 429, since the rate limiter queues it."""
+        return 0 if is_rate_limited(error) else self.next_delay(previous_delay)
+
+    def should_retry(self, error, attempts, started, delay):
+        """attempts counts failures other than 429s: being queued by the rate limiter is not a failed try."""
+        if attempts >= self.max_attempts or not self.classify(error):
+            return False
+        return self.deadline is None or time.monotonic() - started + delay <= self.deadline
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+class _Attempts:
+    """The retry bookkeeping of one call, shared by call, submit and call_async."""
+
+    def __init__(self, policy, label, on_retry=None):
+        self.policy = policy
+        self.label = label
+        self.on_retry = on_retry
+        self.started = time.monotonic()
+        self.attempts = 0
+        self.throttled = 0
+        self.delay = 0
+
+    def after(self, result):
+        """
+        Account for one attempt's result. Returns (outcome, None) when the call is
+        over, else (None, delay) with the seconds to wait before the next attempt.
+        """
+        self.attempts += 1
+        if not is_failure(result):
+            return RetryOutcome(result, self.attempts, False), None
+        error = str(result["error"])
+        self.throttled += is_rate_limited(error)
+        delay = self.policy.delay_for(error, self.delay)
+        if not self.policy.should_retry(error, self.attempts - self.throttled, self.started, delay):
+            return RetryOutcome(result, self.attempts, not self.policy.classify(error)), None
+        logging.warning(f"Retrying {self.label} (attempt {self.attempts}) in {delay:.1f}s: {error}")
+        count_retry(error, delay)
+        if self.on_retry:
+            # A failing progress hook must not lose the send (or leave a caller waiting forever).
+            try:
+                self.on_retry(self.attempts, delay, error)
+            except Exception:
+                logging.exception(f"on_retry hook for {self.label} failed")
+        self.delay = delay or self.delay
+        return None, delay
+
+
+class RetryScheduler:
+    """
+    Runs calls with retries, inline (call) or in the background (submit).
+
+    For submit, pending retries are heap entries, not threads: one timer thread
+    pops due ones and hands them to a bounded executor, so thousands of
+    backed-off requests cost memory, not threads. call_later exposes the timer
+    for other delayed work.
+    """
+
+    def __init__(self, workers=ATTEMPT_WORKERS, rate_limiter=None, name="retry"):
+        self.rate_limiter = rate_limiter or ratelimit.limiter
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{name}-attempt")
+        self._heap = []
+        self._counter = itertools.count()
+        self._wakeup = threading.Condition()
+        self._timer = None
+
+    def pending(self):
+        return len(self._heap)
+
+    def call_later(self, delay, callback):
+        """Run callback on the executor after delay seconds."""
+        with self._wakeup:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), callback))
+            if self._timer is None:
+                self._timer = threading.Thread(target=self._run_timer, name=f"{self.name}-timer", daemon=True)
+                self._timer.start()
+            self._wakeup.notify()
+
+    def _run_timer(self):
+        while True:
+            with self._wakeup:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._wakeup.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, callback = heapq.heappop(self._heap)
+            self._executor.submit(callback)
+
+    def submit(self, func, policy=DEFAULT_POLICY, label="request", on_retry=None, bucket=None):
+        """
+        Call func() until it succeeds, fails fatally, or the policy gives up,
+        without blocking the caller: attempts run on the executor and backoffs
+        are timer entries.
+
+        func returns a Nomi-style result (a dict with "error" on failure).
+        on_retry(attempts, delay, error) is called whenever a retry is scheduled.
+        With bucket (a ratelimit family, e.g. "chat"), each attempt first takes
+        its token and waits for its slot on the timer, so no executor thread
+        sleeps in the rate limiter; func's request then goes straight out.
+        Returns a Future resolving to RetryOutcome(result, attempts, fatal); it is
+        resolved with the exception if func (or anything else in an attempt) raises.
+        Cancelling it stops further attempts (one already running completes).
+        """
+        future = Future()
+        attempts = _Attempts(policy, label, on_retry)
+
+        def attempt(reserved=False):
+            if future.cancelled():
+                return
+            try:
+                if bucket is not None:
+                    wait = self.rate_limiter.paused_for(bucket) if reserved else self.rate_limiter.reserve(bucket)
+                    if wait > 0:
+                        self.call_later(wait, lambda: attempt(reserved=True))
+                        return
+                with self.rate_limiter.prepaid(bucket):
+                    result = func()
+                outcome, delay = attempts.after(result)
+                if outcome is not None:
+                    future.set_result(outcome)
+                else:
+                    self.call_later(delay, attempt)
+            except BaseException as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        self._executor.submit(attempt)
+        return future
+
+    def call(self, func, policy=DEFAULT_POLICY, label="request", on_retry=None):
+        """
+        Blocking form of submit, run on the calling thread: returns the RetryOutcome.
+        The caller's thread sleeps through the backoffs (and through rate-limit
+        waits, in ratelimit.RateLimitedAdapter); exceptions from func propagate.
+        """
+        attempts = _Attempts(policy, label, on_retry)
+        while True:
+            outcome, delay = attempts.after(func())
+            if outcome is not None:
+                return outcome
+            time.sleep(delay)
+
+
+scheduler = RetryScheduler()
+
+
+def chain(future, callback):
+    """
+    A Future resolving to callback(future) once future is done, run on the
+    thread that completes it; if callback raises, the Future holds the
+    exception. Cancelling the returned Future cancels future too.
+    """
+    chained = Future()
+
+    def done(finished):
+        if chained.cancelled():
+            return
+        try:
+            result = callback(finished)
+        except BaseException as e:
+            settle = partial(chained.set_exception, e)
+        else:
+            settle = partial(chained.set_result, result)
+        try:
+            settle()
+        except InvalidStateError:
+            pass  # Cancelled while callback ran
+
+    chained.add_done_callback(lambda chained: chained.cancelled() and future.cancel())
+    future.add_done_callback(done)
+    return chained
+
+
+async def call_async(func, policy=DEFAULT_POLICY, label="request"):
+    """asyncio form of RetryScheduler.call for coroutine functions; the event loop is the timer."""
+    attempts = _Attempts(policy, label)
+    while True:
+        outcome, delay = attempts.after(await func())
+        if outcome is not None:
+            return outcome
+        await asyncio.sleep(delay)
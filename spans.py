@@ -0,0 +1,209 @@
+"""
+Per-stage timings of one send (fetch, markdown, compress, encode, chunk,
+send, ...), kept in a ring buffer for the debug endpoints.
+
+A Trace collects stages by name; a stage entered many times (one send per
+chunk) accumulates its count, wall time and CPU time. Times are exclusive:
+a stage nested inside another on the same thread is not counted twice, so
+the streaming pipeline (chunk(encode(compressed))) attributes each
+generator's own work to it. CPU time is per thread (time.thread_time), so
+stages run on a background thread, like the prefetch encoder, are measured
+there.
+
+Every helper takes trace=None as "not tracing" and then costs nothing:
+
+    trace = spans.Trace("send", mode="URL")
+    with spans.span(trace, "fetch"):
+        html = fetch(url)
+    for chunk in spans.iterate(trace, "chunk", chunks):
+        ...
+    trace.finish(200)
+"""
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from uuid import uuid4
+
+TRACE_BUFFER_SIZE = 200  # Finished traces kept for /debug/send_traces
+
+_perf_counter = time.perf_counter
+_thread_time = time.thread_time
+
+
+class Stage:
+    __slots__ = ("name", "count", "wall", "cpu", "attrs")
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.attrs = {}
+
+    def to_dict(self):
+        return dict(self.attrs, stage=self.name, count=self.count,
+                    wall_ms=round(self.wall * 1000, 3), cpu_ms=round(self.cpu * 1000, 3))
+
+
+class Trace:
+    def __init__(self, kind, **attrs):
+        self.id = uuid4().hex
+        self.kind = kind
+        self.attrs = attrs
+        self.created = time.time()
+        self.status = None
+        self.wall = None
+        self.stages = {}
+        self._started = _perf_counter()
+        self._lock = threading.Lock()
+        self._frames = threading.local()
+
+    def stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            with self._lock:
+                stage = self.stages.setdefault(name, Stage(name))
+        return stage
+
+    def add(self, name, wall, cpu=0.0, count=1, **attrs):
+        """Account time measured elsewhere (e.g. a scheduled retry sleep) to a stage."""
+        stage = self.stage(name)
+        with self._lock:
+            stage.count += count
+            stage.wall += wall
+            stage.cpu += cpu
+            for key, value in attrs.items():
+                stage.attrs[key] = stage.attrs.get(key, 0) + value
+
+    def set(self, **attrs):
+        """Record sizes and other facts about the whole send (payload bytes, chunk count, ...)."""
+        with self._lock:
+            self.attrs.update(attrs)
+
+    def _stack(self):
+        try:
+            return self._frames.stack
+        except AttributeError:
+            self._frames.stack = []
+            return self._frames.stack
+
+    def _enter(self):
+        frame = [0.0, 0.0, _perf_counter(), _thread_time()]  # Nested wall, nested CPU, start wall, start CPU
+        self._stack().append(frame)
+        return frame
+
+    def _exit(self, name, frame, **attrs):
+        wall, cpu = _perf_counter() - frame[2], _thread_time() - frame[3]
+        stack = self._stack()
+        stack.pop()
+        if stack:
+            stack[-1][0] += wall
+            stack[-1][1] += cpu
+        self.add(name, wall - frame[0], max(cpu - frame[1], 0.0), **attrs)
+
+    def finish(self, status):
+        self.status = status
+        self.wall = _perf_counter() - self._started
+        return self
+
+    def to_dict(self):
+        with self._lock:
+            stages = [stage.to_dict() for stage in self.stages.values()]
+            attrs = dict(self.attrs)
+        return dict(attrs, trace_id=self.id, kind=self.kind, created=self.created, status=self.status,
+                    wall_ms=round(self.wall * 1000, 3) if self.wall is not None else None, stages=stages)
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "frame")
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.frame = self.trace._enter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace._exit(self.name, self.frame, **self.attrs)
+
+
+def span(trace, name, **attrs):
+    """Context manager timing its body as one entry of stage name (attrs are summed into the stage)."""
+    return nullcontext() if trace is None else _Span(trace, name, attrs)
+
+
+def wrap(trace, name, func):
+    """func, with each call timed as stage name (on whichever thread calls it)."""
+    if trace is None:
+        return func
+
+    def timed(*args, **kwargs):
+        with _Span(trace, name, {}):
+            return func(*args, **kwargs)
+    return timed
+
+
+def iterate(trace, name, iterable, size=None):
+    """Pass iterable through, timing each next() as stage name; size(item) is summed into its "bytes"."""
+    if trace is None:
+        return iterable
+    return _iterate(trace, name, iterable, size)
+
+
+def _iterate(trace, name, iterable, size):
+    iterator = iter(iterable)
+    while True:
+        frame = trace._enter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            trace._exit(name, frame, count=0)
+            return
+        except BaseException:
+            trace._exit(name, frame)
+            raise
+        if size is None:
+            trace._exit(name, frame)
+        else:
+            trace._exit(name, frame, bytes=size(item))
+        yield item
+
+
+class TraceBuffer:
+    """The last size finished traces, newest first on read."""
+
+    def __init__(self, size=TRACE_BUFFER_SIZE):
+        self._traces = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        with self._lock:
+            self._traces.append(trace)
+
+    def recent(self, limit=None):
+        with self._lock:
+            traces = list(self._traces)
+        traces.reverse()
+        return traces[:limit] if limit else traces
+
+    def summary(self, traces=None):
+        """Per stage, totals over traces (default: all kept): sends it appeared in, wall and CPU ms."""
+        stages = {}
+        for trace in self.recent() if traces is None else traces:
+            for stage in trace.to_dict()["stages"]:
+                total = stages.setdefault(stage["stage"], {"sends": 0, "count": 0, "wall_ms": 0.0, "cpu_ms": 0.0})
+                total["sends"] += 1
+                total["count"] += stage["count"]
+                total["wall_ms"] += stage["wall_ms"]
+                total["cpu_ms"] += stage["cpu_ms"]
+        for total in stages.values():
+            total["wall_ms"], total["cpu_ms"] = round(total["wall_ms"], 3), round(total["cpu_ms"], 3)
+        return dict(sorted(stages.items(), key=lambda item: -item[1]["wall_ms"]))
+
+    def get(self, trace_id):
+        with self._lock:
+            return next((trace for trace in self._traces if trace.id == trace_id), None)
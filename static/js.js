@@ -13,7 +13,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const stopLoopButton = document.getElementById('stopLoopButton'); // Button to stop a NOMI interaction loop
     const themeSwitch = document.getElementById('themeSwitch'); // Switch to toggle dark/light theme
     const themeLabel = document.getElementById('themeLabel'); // Label to display the current theme
-    const receiveButton = document.getElementById('receiveButton'); // Placeholder for future "receive" functionality
+    const receiveButton = document.getElementById('receiveButton'); // Button to toggle live receiving of the selected room's messages
 
     // Variables for speech recognition
     let isRecording = false; // Flag to track if recording is active
@@ -53,6 +53,109 @@ document.addEventListener('DOMContentLoaded', () => {
     // Call load functions when the DOM is fully loaded
     loadRooms();
 
+    const JOB_POLL_INTERVAL = 1000; // Milliseconds between /jobs/<id> polls when EventSource is unavailable
+
+    /**
+     * Reads the response of /send or /send_direct_message. A 202 means the send was
+     * queued as a background job: follow its progress (live over Server-Sent Events,
+     * or by polling /jobs/<id>) in the chatbox and resolve with the job's result, so
+     * callers handle the same body as before.
+     */
+    function resolveSendJob(response) {
+        return response.json().then(data => {
+            if (response.status !== 202 || !data.job_id) {
+                return data;
+            }
+            const progress = document.createElement('p');
+            progress.classList.add('status-message');
+            progress.textContent = 'Sending...';
+            chatbox.appendChild(progress);
+            const follow = window.EventSource ? followJobEvents : pollJob;
+            return follow(data, progress).finally(() => progress.remove());
+        });
+    }
+
+    /**
+     * Renders per-chunk events from /jobs/<id>/events as they arrive: chunk progress,
+     * latency, retries and any reply text the NOMI sends back along the way.
+     */
+    function followJobEvents(data, progress) {
+        return new Promise((resolve, reject) => {
+            const source = new EventSource(`${data.status_url}/events`);
+            let total = 0;
+            let sent = 0;
+            let replyElement = null;
+            const parse = event => JSON.parse(event.data);
+
+            source.addEventListener('queued', event => {
+                total = parse(event).total_chunks;
+            });
+            source.addEventListener('sent', event => {
+                const chunk = parse(event);
+                sent += 1;
+                if (total > 1) {
+                    const eta = chunk.eta !== null ? `, about ${Math.ceil(chunk.eta)}s left` : '';
+                    progress.textContent = `Sent chunk ${chunk.chunk} of ${total} in ${Math.round(chunk.latency * 1000)} ms (${sent}/${total}${eta})`;
+                }
+            });
+            source.addEventListener('skipped', () => {
+                sent += 1;
+            });
+            source.addEventListener('retrying', event => {
+                const chunk = parse(event);
+                progress.textContent = `Chunk ${chunk.chunk} failed (attempt ${chunk.attempts}), retrying in ${chunk.delay.toFixed(1)}s...`;
+            });
+            source.addEventListener('failed', event => {
+                const chunk = parse(event);
+                progress.textContent = `Chunk ${chunk.chunk} failed: ${chunk.error}`;
+            });
+            source.addEventListener('reply', event => {
+                if (!replyElement) {
+                    replyElement = document.createElement('p');
+                    replyElement.classList.add('bot-message');
+                    chatbox.appendChild(replyElement);
+                }
+                replyElement.textContent = parse(event).text;
+            });
+            source.addEventListener('finished', event => {
+                source.close();
+                if (replyElement) {
+                    replyElement.remove(); // The caller renders the final reply
+                }
+                resolve(parse(event).result);
+            });
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    // The browser gave up reconnecting: fall back to polling
+                    pollJob(data, progress).then(resolve, reject);
+                }
+            };
+        });
+    }
+
+    function pollJob(data, progress) {
+        return new Promise((resolve, reject) => {
+            const poll = () => {
+                fetch(data.status_url)
+                    .then(jobResponse => jobResponse.json())
+                    .then(job => {
+                        if (job.result !== undefined || job.status === undefined) {
+                            // Finished (or the job is unknown): hand back its result or error
+                            resolve(job.result !== undefined ? job.result : job);
+                            return;
+                        }
+                        if (job.total_chunks > 1) {
+                            const eta = job.eta !== null ? `, about ${Math.ceil(job.eta)}s left` : '';
+                            progress.textContent = `Sending chunk ${job.chunks_sent + 1} of ${job.total_chunks}${eta}...`;
+                        }
+                        setTimeout(poll, JOB_POLL_INTERVAL);
+                    })
+                    .catch(reject);
+            };
+            poll();
+        });
+    }
+
     /**
      * Event listener for the sendButton to send a user message or a direct message to Collin.
      */
@@ -83,7 +186,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     message: userMessage,
                 }),
             })
-            .then(response => response.json())
+            .then(resolveSendJob)
             .then(data => {
                 console.log('Direct Message Response:', data);
                 let responseText = '';
@@ -122,7 +225,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     mode: mode
                 }),
             })
-            .then(response => response.json())
+            .then(resolveSendJob)
             .then(data => {
                 console.log('Nomi Reply Received from Server:', data);
                 if (data.response && data.response.replyMessage && data.response.replyMessage.text) {
@@ -383,8 +486,69 @@ document.addEventListener('DOMContentLoaded', () => {
         themeLabel.textContent = document.body.classList.contains('dark-mode') ? '🌑 Dark Mode' : '🌞 Light Mode';
     });
 
-    // Placeholder for future receive button functionality
+    // Live receiving of the selected room's messages over /rooms/<uuid>/events
+    let roomSource = null; // EventSource of the room being received, null when receiving is off
+
+    function renderRoomMessage(message) {
+        const messageElement = document.createElement('p');
+        messageElement.classList.add(message.sender === 'user' || message.fromUser ? 'user-message' : 'bot-message');
+        const sender = message.name || (message.nomi && message.nomi.name) || '';
+        messageElement.textContent = sender ? `${sender}: ${message.text}` : message.text;
+        chatbox.appendChild(messageElement);
+        chatbox.scrollTop = chatbox.scrollHeight;
+    }
+
+    function stopReceiving() {
+        if (roomSource) {
+            roomSource.close();
+            roomSource = null;
+        }
+        receiveButton.classList.remove('active');
+    }
+
+    function startReceiving() {
+        const roomUuid = roomSelect.value;
+        if (!roomUuid || roomUuid === 'main_chat_dm') {
+            alert('Please select a room to receive messages from.');
+            return;
+        }
+        const parse = event => JSON.parse(event.data);
+        roomSource = new EventSource(`/rooms/${roomUuid}/events`);
+        receiveButton.classList.add('active');
+
+        roomSource.addEventListener('snapshot', event => {
+            parse(event).messages.forEach(renderRoomMessage);
+        });
+        roomSource.addEventListener('message', event => {
+            renderRoomMessage(parse(event));
+        });
+        roomSource.addEventListener('reassembled', event => {
+            const stream = parse(event);
+            renderRoomMessage({text: `[${stream.kind}, ${stream.chunks} chunks reassembled]\n${stream.text}`});
+        });
+        roomSource.addEventListener('error', event => {
+            if (event.data) { // Upstream poll failed; the server keeps retrying
+                console.error('Error receiving room messages:', parse(event).error);
+            } else if (event.target.readyState === EventSource.CLOSED) { // Refused, e.g. receiving is disabled on the server
+                stopReceiving();
+                alert('Receiving room messages is not available.');
+            }
+        });
+    }
+
     receiveButton.addEventListener('click', () => {
-        alert('Receive messages functionality will be implemented in the future.');
+        if (roomSource) {
+            stopReceiving();
+        } else {
+            startReceiving();
+        }
+    });
+
+    // Follow the newly selected room if receiving is on
+    roomSelect.addEventListener('change', () => {
+        if (roomSource) {
+            stopReceiving();
+            startReceiving();
+        }
     });
 });
\ No newline at end of file
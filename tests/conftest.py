@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture
+def mock_nomi():
+    """A local mock NOMI API (mock_nomi.py) with no added latency; configure it through its attributes."""
+    import mock_nomi
+    mock = mock_nomi.MockNomi(latency=0, reply_latency=0).start()
+    yield mock
+    mock.stop()
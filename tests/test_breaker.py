@@ -0,0 +1,181 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import breaker
+import ratelimit
+
+ROOM = "11111111-2222-4333-8444-555555555555"
+
+
+def failing():
+    raise ValueError("upstream down")
+
+
+def open_breaker(circuit):
+    for _ in range(circuit.failure_threshold):
+        with pytest.raises(ValueError):
+            circuit.call(failing)
+
+
+def test_opens_after_consecutive_failures():
+    circuit = breaker.CircuitBreaker("test", failure_threshold=3, recovery_timeout=60)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            circuit.call(failing)
+    assert circuit.state == breaker.CLOSED
+    with pytest.raises(ValueError):
+        circuit.call(failing)
+    assert circuit.state == breaker.OPEN
+    with pytest.raises(breaker.CircuitOpenError) as raised:
+        circuit.call(lambda: "not called")
+    assert breaker.is_circuit_open(raised.value)
+    assert circuit.snapshot()["rejected"] == 1
+
+
+def test_success_resets_the_failure_count():
+    circuit = breaker.CircuitBreaker("test", failure_threshold=2, recovery_timeout=60)
+    with pytest.raises(ValueError):
+        circuit.call(failing)
+    assert circuit.call(lambda: "ok") == "ok"
+    with pytest.raises(ValueError):
+        circuit.call(failing)
+    assert circuit.state == breaker.CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    circuit = breaker.CircuitBreaker("test", failure_threshold=2, recovery_timeout=0.1)
+    open_breaker(circuit)
+    time.sleep(0.15)
+    circuit.before_call()  # The probe
+    assert circuit.state == breaker.HALF_OPEN
+    with pytest.raises(breaker.CircuitOpenError):
+        circuit.before_call()  # A second call while the probe is out
+    circuit.record_failure()  # A failed probe opens it again at once
+    assert circuit.state == breaker.OPEN
+    with pytest.raises(breaker.CircuitOpenError):
+        circuit.before_call()
+
+
+def test_recovers_after_a_successful_probe():
+    circuit = breaker.CircuitBreaker("test", failure_threshold=2, recovery_timeout=0.1)
+    open_breaker(circuit)
+    time.sleep(0.15)
+    assert circuit.call(lambda: "ok") == "ok"
+    assert circuit.state == breaker.CLOSED
+    assert circuit.call(lambda: "still ok") == "still ok"
+    assert circuit.snapshot()["opened"] == 1
+
+
+def configure_mock(mock, **settings):
+    requests.post(mock.base_url[:-len("/v1")] + "/__mock/config", json=settings, timeout=10)
+
+
+def test_guarded_adapter_against_failing_upstream(mock_nomi):
+    registry = breaker.BreakerRegistry()
+    registry.configure(failure_threshold=3, recovery_timeout=0.2)
+    session = requests.Session()
+    session.mount("http://", breaker.GuardedAdapter(rate_limiter=ratelimit.RateLimiter(), breaker_registry=registry))
+
+    def send():
+        return session.post(f"{mock_nomi.base_url}/rooms/{ROOM}/chat", json={"messageText": "hi"},
+                            headers={"Authorization": "Bearer test"}, timeout=10)
+
+    configure_mock(mock_nomi, error_rate=1.0)  # Inject failures: every call answers 503
+    assert [send().status_code for _ in range(3)] == [503] * 3
+    chat = registry.get("nomi.chat")
+    assert chat.state == breaker.OPEN
+
+    reached = mock_nomi.requests
+    with pytest.raises(requests.exceptions.ConnectionError, match=breaker.OPEN_MARKER):
+        send()
+    assert mock_nomi.requests == reached  # Failed fast without calling the upstream
+    assert registry.get("nomi.rooms").state == breaker.CLOSED  # Other families are unaffected
+
+    time.sleep(0.25)
+    assert send().status_code == 503  # Half-open probe fails: open again
+    assert chat.state == breaker.OPEN
+
+    configure_mock(mock_nomi, error_rate=0)  # Upstream recovers
+    time.sleep(0.25)
+    assert send().status_code == 200  # Probe succeeds and closes the breaker
+    assert chat.state == breaker.CLOSED
+    assert [send().status_code for _ in range(3)] == [200] * 3
+    assert registry.stats()["nomi.chat"]["opened"] == 2
+
+
+def guarded_session(registry):
+    session = requests.Session()
+    session.mount("http://", breaker.GuardedAdapter(rate_limiter=ratelimit.RateLimiter(), breaker_registry=registry))
+    return session
+
+
+def test_open_breaker_bounds_in_flight_calls_and_time(mock_nomi, monkeypatch):
+    registry = breaker.BreakerRegistry()
+    registry.configure(failure_threshold=3, recovery_timeout=0.3)
+    session = guarded_session(registry)
+    in_flight, peak, lock = [0], [0], threading.Lock()
+    upstream_send = ratelimit.RateLimitedAdapter.send
+
+    def counted_send(self, *args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        try:
+            return upstream_send(self, *args, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+    monkeypatch.setattr(ratelimit.RateLimitedAdapter, "send", counted_send)
+
+    def send():
+        try:
+            return session.post(f"{mock_nomi.base_url}/rooms/{ROOM}/chat", json={"messageText": "hi"},
+                                headers={"Authorization": "Bearer test"}, timeout=10).status_code
+        except requests.exceptions.ConnectionError:
+            return None
+
+    configure_mock(mock_nomi, error_rate=1.0)
+    mock_nomi.latency = "0.2"  # A slow, failing upstream
+    assert [send() for _ in range(3)] == [503] * 3
+    assert registry.get("nomi.chat").state == breaker.OPEN
+
+    def hammer():
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            send()
+            time.sleep(0.01)
+    peak[0] = 0
+    started = time.monotonic()
+    threads = [threading.Thread(target=hammer) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] <= registry.get("nomi.chat").half_open_probes  # Only half-open probes reached the upstream
+    assert time.monotonic() - started < 1.5  # Callers failed fast instead of queueing behind the slow upstream
+
+
+def test_unexpected_error_releases_the_half_open_probe(mock_nomi, monkeypatch):
+    registry = breaker.BreakerRegistry()
+    registry.configure(failure_threshold=1, recovery_timeout=0.1)
+    session = guarded_session(registry)
+    chat = registry.get("nomi.chat")
+    chat.record_failure()
+    time.sleep(0.15)
+
+    def broken(self, *args, **kwargs):
+        raise RuntimeError("adapter bug")
+    monkeypatch.setattr(ratelimit.RateLimitedAdapter, "send", broken)
+    url = f"{mock_nomi.base_url}/rooms/{ROOM}/chat"
+    with pytest.raises(RuntimeError):
+        session.post(url, json={"messageText": "hi"}, timeout=10)  # The probe dies with a non-requests error
+    assert chat.state == breaker.OPEN
+
+    monkeypatch.undo()
+    time.sleep(0.15)
+    response = session.post(url, json={"messageText": "hi"}, headers={"Authorization": "Bearer test"}, timeout=10)
+    assert response.status_code == 200  # A new probe was let through
+    assert chat.state == breaker.CLOSED
@@ -0,0 +1,51 @@
+import outbox
+
+
+def text_chunks(total, first=1):
+    return [(seq, f"[TEXT_CHUNK {seq}/{total}] body {seq}") for seq in range(first, total + 1)]
+
+
+def deliver(box, stream, count):
+    delivery = box.delivery(stream)
+    for seq, _ in list(box.pending_chunks(stream))[:count]:
+        delivery.delivered(seq)
+    delivery.flush()
+
+
+def restart(monkeypatch):
+    """Become a new process with the same pid, as after a container restart."""
+    monkeypatch.setattr(outbox, "INSTANCE", "restarted")
+
+
+def test_interrupted_send_resumes_after_restart_with_same_pid(tmp_path, monkeypatch):
+    box = outbox.Outbox(str(tmp_path / "outbox.db"))
+    box.enqueue("s1", "room", "Text", 40, text_chunks(40))
+    deliver(box, "s1", 20)
+    assert box.resume_orphans() == []  # Still ours
+    restart(monkeypatch)
+    assert outbox.Outbox(str(tmp_path / "outbox.db")).resume_orphans() == ["s1"]
+    assert [seq for seq, _ in box.pending_chunks("s1")] == list(range(21, 41))
+
+
+def test_idempotent_retry_with_skipped_chunks_resumes(tmp_path, monkeypatch):
+    box = outbox.Outbox(str(tmp_path / "outbox.db"))
+    box.enqueue("s1", "room", "Text", 40, text_chunks(40, first=11))  # Chunks 1-10 were delivered by an earlier try
+    restart(monkeypatch)
+    assert box.resume_orphans() == ["s1"]
+    assert len(list(box.pending_chunks("s1"))) == 30
+
+
+def test_streamed_send_interrupted_while_writing_is_failed(tmp_path, monkeypatch):
+    box = outbox.Outbox(str(tmp_path / "outbox.db"), enqueue_batch=4)
+    messages = box.enqueue_streaming("s1", "room", "URL (encoded)", 10, iter(text_chunks(10)))
+    assert [next(messages) for _ in range(4)][-1][0] == 4  # Crash after one batch
+    restart(monkeypatch)
+    assert box.resume_orphans() == []
+    assert box.stream("s1").state == outbox.FAILED
+
+
+def test_streamed_send_written_in_full_resumes(tmp_path, monkeypatch):
+    box = outbox.Outbox(str(tmp_path / "outbox.db"), enqueue_batch=4)
+    assert len(list(box.enqueue_streaming("s1", "room", "URL (encoded)", 10, text_chunks(10)))) == 10
+    restart(monkeypatch)
+    assert box.resume_orphans() == ["s1"]
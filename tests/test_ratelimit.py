@@ -0,0 +1,120 @@
+import threading
+import time
+
+import requests
+
+import ratelimit
+import retry
+
+ROOM = "11111111-2222-4333-8444-555555555555"
+
+
+def session_for(limiter):
+    session = requests.Session()
+    session.mount("http://", ratelimit.RateLimitedAdapter(rate_limiter=limiter))
+    return session
+
+
+def limit_mock(mock, rate, burst):
+    """Make the mock answer requests beyond rate per second (after a burst) with 429 and Retry-After."""
+    requests.post(mock.base_url[:-len("/v1")] + "/__mock/config", json={"rate_limit": [rate, burst]}, timeout=10)
+
+
+def send(session, mock, text="hello"):
+    return session.post(f"{mock.base_url}/rooms/{ROOM}/chat", json={"messageText": text},
+                        headers={"Authorization": "Bearer test"}, timeout=10)
+
+
+def test_parse_retry_after():
+    assert ratelimit.parse_retry_after("2.5") == 2.5
+    assert ratelimit.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412470) == 10
+    assert ratelimit.parse_retry_after("soon") is None
+    assert ratelimit.parse_retry_after(None) is None
+
+
+def test_default_limiter_is_adaptive_only(mock_nomi):
+    limiter = ratelimit.RateLimiter()
+    session = session_for(limiter)
+    started = time.monotonic()
+    for _ in range(20):
+        assert send(session, mock_nomi).status_code == 200
+    assert time.monotonic() - started < 1
+    assert limiter.stats()["chat"]["waited"] == 0
+
+
+def test_retry_after_pauses_the_bucket(mock_nomi):
+    limit_mock(mock_nomi, 4, 1)  # One request, then 429 with Retry-After for about 0.25s
+    limiter = ratelimit.RateLimiter()
+    session = session_for(limiter)
+    assert send(session, mock_nomi).status_code == 200
+    throttled = send(session, mock_nomi)
+    assert throttled.status_code == 429
+    pause = float(throttled.headers["Retry-After"])
+    assert limiter.bucket("chat").paused_for() > 0
+    started = time.monotonic()
+    assert send(session, mock_nomi).status_code == 200  # Held back until the pause is over
+    assert time.monotonic() - started >= pause - 0.05
+    assert mock_nomi.throttled == 1
+    assert limiter.stats()["chat"]["throttled"] == 1
+
+
+def test_configured_limit_avoids_429s(mock_nomi):
+    limit_mock(mock_nomi, 20, 2)
+    limiter = ratelimit.RateLimiter({"chat": (15, 2)})
+    session = session_for(limiter)
+    started = time.monotonic()
+    statuses = [send(session, mock_nomi).status_code for _ in range(17)]
+    assert statuses == [200] * 17
+    assert mock_nomi.throttled == 0
+    assert time.monotonic() - started >= 15 / 15 - 0.1  # Burst of 2, then 15 per second
+
+
+def test_429_slows_a_configured_bucket():
+    limiter = ratelimit.RateLimiter({"chat": (10, 1)})
+    limiter.observe("chat", 429, {})
+    bucket = limiter.bucket("chat")
+    assert bucket.rate == 10 * ratelimit.RATE_DECREASE
+    assert 0 < bucket.paused_for() <= 1 / bucket.rate
+    limiter.observe("chat", 200, {})
+    assert bucket.rate > 10 * ratelimit.RATE_DECREASE
+
+
+def test_retry_engine_delivers_through_429s(mock_nomi):
+    limit_mock(mock_nomi, 10, 1)
+    limiter = ratelimit.RateLimiter()
+    session = session_for(limiter)
+    policy = retry.RetryPolicy(max_attempts=2, base=0.01)
+
+    def attempt():
+        response = send(session, mock_nomi)
+        if response.status_code != 200:
+            return {"error": f"Nomi API error: {response.status_code} - {response.text}"}
+        return response.json()
+
+    outcomes = [retry.scheduler.call(attempt, policy) for _ in range(5)]
+    # 429s are not failed tries: every send gets through although max_attempts is 2.
+    assert all(not retry.is_failure(outcome.result) for outcome in outcomes)
+    assert mock_nomi.throttled >= 1
+
+
+def test_submit_waits_for_the_limiter_on_the_timer(mock_nomi):
+    limiter = ratelimit.RateLimiter({"chat": (2, 1)})
+    scheduler = retry.RetryScheduler(workers=1, rate_limiter=limiter)
+    session = session_for(limiter)
+    sent = []
+
+    def attempt():
+        sent.append(threading.current_thread().name)
+        return send(session, mock_nomi).json()
+
+    started = time.monotonic()
+    limited = [scheduler.submit(attempt, bucket="chat") for _ in range(3)]
+    # The single executor thread is not parked in the limiter: unrelated work runs at once.
+    assert scheduler.submit(lambda: {"ok": True}).result(timeout=1).result == {"ok": True}
+    assert time.monotonic() - started < 0.3
+    for future in limited:
+        assert not retry.is_failure(future.result(timeout=5).result)
+    assert time.monotonic() - started >= 2 / 2 - 0.1  # Burst of 1, then 2 per second
+    assert limiter.stats()["chat"]["acquired"] == 3  # The adapter used the tokens submit reserved
+    assert limiter.stats()["chat"]["waited"] == 2
+    assert len(sent) == 3
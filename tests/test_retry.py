@@ -0,0 +1,54 @@
+import threading
+import time
+
+import retry
+
+
+def flaky(failures):
+    """func failing the first `failures` calls with a retryable error."""
+    calls = []
+
+    def attempt():
+        calls.append(1)
+        return {"error": "Nomi API error: 503"} if len(calls) <= failures else {"ok": True}
+    return attempt
+
+
+def test_pending_retries_do_not_hold_threads():
+    scheduler = retry.RetryScheduler(workers=4)
+    policy = retry.RetryPolicy(max_attempts=3, base=0.3, max_backoff=0.3)
+    before = threading.active_count()
+    futures = [scheduler.submit(flaky(1), policy) for _ in range(2000)]
+    time.sleep(0.1)
+    assert scheduler.pending() > 1000  # Backing off on the timer heap...
+    assert threading.active_count() <= before + 5  # ...with only the pool and the timer running
+    outcomes = [future.result(timeout=30) for future in futures]
+    assert all(outcome.result == {"ok": True} and outcome.attempts == 2 for outcome in outcomes)
+
+
+def test_cancel_stops_further_attempts():
+    scheduler = retry.RetryScheduler(workers=1)
+    attempt = flaky(100)
+    future = scheduler.submit(attempt, retry.RetryPolicy(max_attempts=100, base=0.1, max_backoff=0.1))
+    time.sleep(0.05)
+    assert future.cancel()
+    time.sleep(0.3)
+    assert future.cancelled()
+
+
+def test_chain_resolves_with_the_callback_result():
+    scheduler = retry.RetryScheduler(workers=1)
+    chained = retry.chain(scheduler.submit(flaky(0)), lambda done: done.result().attempts)
+    assert chained.result(timeout=5) == 1
+    failed = retry.chain(scheduler.submit(flaky(0)), lambda done: 1 / 0)
+    assert isinstance(failed.exception(timeout=5), ZeroDivisionError)
+
+
+def test_default_policy_gives_up_on_endless_429s(monkeypatch):
+    monkeypatch.setattr(retry.ratelimit.limiter, "enabled", True)
+    policy = retry.RetryPolicy(deadline=0.3)
+    started = time.monotonic()
+    outcome = retry.scheduler.call(lambda: {"error": "Nomi API error: 429 - slow down"}, policy)
+    assert outcome.attempts > policy.max_attempts  # 429s are not failed tries...
+    assert time.monotonic() - started < 2  # ...but the deadline still ends them
+    assert retry.DEFAULT_POLICY.deadline is not None
@@ -1,8 +1,32 @@
 import json
 import base64
+import queue
+import threading
 import zlib
+from collections import namedtuple
 import requests
 from markdownify import markdownify as md
+import chunk_codecs
+import spans
+
+
+def iter_chunks(data, max_chunk_size=450):
+    """
+  Lazily yields consecutive slices of at most max_chunk_size items.
+
+  Args:
+      data: A string, or bytes-like data (bytes, bytearray, memoryview).
+      max_chunk_size: The maximum size of each chunk (default: 450).
+
+  Yields:
+      str slices for str input. Bytes-like input is wrapped in a memoryview,
+      so each chunk is a zero-copy view into the original buffer.
+  """
+    if isinstance(data, (bytes, bytearray)):
+        data = memoryview(data)
+    step = max(max_chunk_size, 1)
+    for start in range(0, len(data), step):
+        yield data[start:start + step]
 
 
 def chunk_data(data, max_chunk_size=450):
@@ -10,39 +34,30 @@ def chunk_data(data, max_chunk_size=450):
   Chunks the provided data into smaller pieces of a specified maximum size.
 
   Args:
-      data: The data to be chunked (usually a string).
-      max_chunk_size: The maximum size of each chunk (default: 850 characters).
+      data: The data to be chunked (a string or bytes-like data).
+      max_chunk_size: The maximum size of each chunk (default: 450).
 
   Returns:
-      A list of data chunks.
+      A list of data chunks. See iter_chunks for the types produced.
   """
-
-    chunks = []
-    current_chunk = ""
-    for char in data:
-        current_chunk += char
-        if len(current_chunk) >= max_chunk_size:
-            chunks.append(current_chunk)
-            current_chunk = ""
-    if current_chunk:
-        chunks.append(current_chunk)
-
-    return chunks
+    return list(iter_chunks(data, max_chunk_size))
 
 
 def escape_content(content):
     escaped_content = json.dumps(content)  # Escape for JSON
     return escaped_content
 
-def compress_content(content):
+def compress_content(content, codec=None):
     # You CANNOT directly embed the compressed data (bytes) in JSON:
     # json_data = {"compressed": compressed_data}  # This will raise a TypeError
-    compressed_content = zlib.compress(content)
-    return compressed_content
+    if codec is None:
+        return zlib.compress(content)
+    return chunk_codecs.get_codec(codec).compress(content)
 
-def decompress_content(content):
-    decompressed_content = zlib.decompress(content)
-    return decompressed_content
+def decompress_content(content, codec=None):
+    if codec is None:
+        return zlib.decompress(content)
+    return chunk_codecs.get_codec(codec).decompress(content)
 
 def encode_b64(content):
     #encodes compressed content into a TEXT representation
@@ -51,6 +66,164 @@ def encode_b64(content):
 def decode_b64(content):
     return base64.b64decode(content)
 
+STREAM_BLOCK_SIZE = 64 * 1024  # Bytes of input fed to the compressor per step
+
+
+def iter_utf8(text, block_size=STREAM_BLOCK_SIZE):
+    # Slicing the str (not the bytes) keeps multi-byte characters intact.
+    for start in range(0, len(text), block_size):
+        yield text[start:start + block_size].encode('utf-8')
+
+def format_chunk_header(kind, index, total, tag=None):
+    """'[KIND i/n]', or '[KIND i/n tag]' when a decoder needs extra information (e.g. the codec)."""
+    if tag:
+        return f"[{kind} {index}/{total} {tag}]"
+    return f"[{kind} {index}/{total}]"
+
+def iter_encode(blocks, encoding=None):
+    """Incremental encode_b64 (or another chunk_codecs encoding): encodes block-aligned runs so the output matches a one-shot encode."""
+    encoding = chunk_codecs.get_encoding(encoding)
+    carry = b""
+    for block in blocks:
+        if carry:
+            block = carry + block
+        aligned = len(block) - len(block) % encoding.block_size
+        if aligned:
+            yield encoding.encode(memoryview(block)[:aligned])
+        carry = bytes(block[aligned:])
+    if carry:
+        yield encoding.encode(carry)
+
+def iter_rechunk(blocks, max_chunk_size=450, escaped=b""):
+    """
+  Re-cut a stream of bytes blocks into chunks of exactly max_chunk_size (the last may be shorter).
+  With escaped (characters JSON escapes, see chunk_codecs.Encoding), each of them counts
+  twice, so a chunk holding some is cut shorter to keep its escaped length within max_chunk_size.
+  """
+    if escaped:
+        yield from _rechunk_escaped(blocks, max_chunk_size, escaped)
+        return
+    pending = b""
+    for block in blocks:
+        pending = pending + block if pending else block
+        usable = len(pending) - len(pending) % max_chunk_size
+        yield from iter_chunks(memoryview(pending)[:usable], max_chunk_size)
+        pending = pending[usable:]
+    if pending:
+        yield memoryview(pending)
+
+def _escaped_cut(data, start, max_chunk_size, escaped):
+    """End of the longest chunk from start whose escaped length fits in max_chunk_size."""
+    end = min(start + max_chunk_size, len(data))
+    while True:
+        size = end - start + sum(data.count(char, start, end) for char in escaped)
+        if size <= max_chunk_size:
+            return end
+        end -= size - max_chunk_size
+
+def _rechunk_escaped(blocks, max_chunk_size, escaped):
+    pending = b""
+    for block in blocks:
+        pending = pending + block if pending else bytes(block)
+        start = 0
+        # A chunk is final once max_chunk_size characters are available after its start.
+        while len(pending) - start >= max_chunk_size:
+            end = _escaped_cut(pending, start, max_chunk_size, escaped)
+            yield memoryview(pending)[start:end]
+            start = end
+        pending = pending[start:]
+    start = 0
+    while start < len(pending):
+        end = _escaped_cut(pending, start, max_chunk_size, escaped)
+        yield memoryview(pending)[start:end]
+        start = end
+
+def encoded_chunk_count(compressed_size, max_chunk_size=450, encoding=None):
+    """Number of chunks a payload of compressed_size bytes turns into once text-encoded."""
+    encoded_size = chunk_codecs.get_encoding(encoding).encoded_length(compressed_size)
+    return -(-encoded_size // max_chunk_size)
+
+EncodedStream = namedtuple("EncodedStream", ["total_chunks", "codec", "encoding", "compressed_bytes", "chunks"])
+
+def stream_encoded_chunks(text, max_chunk_size=450, codec=None, encoding=None, trace=None):
+    """
+  Compresses text once, then streams encode -> chunk over the compressed bytes.
+
+  The compressed payload is kept (it is smaller than the text, which is in memory
+  anyway), so the chunk total (the "n" in [ENCODED_CHUNK i/n]) is exact without a
+  second compression pass. With codec="auto" several codecs are tried and the one
+  giving the fewest chunks is kept.
+
+  Returns:
+      EncodedStream(total_chunks, codec, encoding, compressed_bytes, chunks), where
+      compressed_bytes is the size of the codec's output and chunks yields bytes-like
+      chunks (text in encoding.charset) identical to
+      chunk_data(encode_b64(compress_content(text.encode('utf-8'), codec)), max_chunk_size)
+      for the default base64 encoding.
+
+  With a trace (spans.Trace), compression and each streaming stage (encode,
+  chunk) are timed as they run.
+  """
+    encoding = chunk_codecs.get_encoding(encoding)
+    with spans.span(trace, "compress"):
+        if codec == chunk_codecs.AUTO_CODEC:
+            codec, compressed = chunk_codecs.select_codec(
+                lambda: iter_utf8(text), lambda size: encoded_chunk_count(size, max_chunk_size, encoding.name),
+                input_size=len(text))
+        else:
+            codec = chunk_codecs.get_codec(codec)
+            compressed = chunk_codecs.compress_blocks(codec.name, iter_utf8(text))
+    if encoding.escaped:
+        # Chunk lengths depend on where the escaped characters fall, so count them with an extra encode pass.
+        with spans.span(trace, "count_chunks"):
+            total_chunks = sum(1 for _ in iter_rechunk(
+                iter_encode(iter_chunks(compressed, STREAM_BLOCK_SIZE), encoding.name), max_chunk_size, encoding.escaped))
+    else:
+        total_chunks = encoded_chunk_count(len(compressed), max_chunk_size, encoding.name)
+    encoded = spans.iterate(trace, "encode", iter_encode(iter_chunks(compressed, STREAM_BLOCK_SIZE), encoding.name))
+    chunks = spans.iterate(trace, "chunk", iter_rechunk(encoded, max_chunk_size, encoding.escaped), size=len)
+    return EncodedStream(total_chunks, codec, encoding, len(compressed), chunks)
+
+def prefetch(iterable, depth=4):
+    """
+  Produces items from iterable on a background thread, up to depth items ahead,
+  so the consumer (e.g. a network send) overlaps with the producer (e.g. compression).
+  """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        # Give up once the consumer has gone away, instead of blocking forever.
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is done:
+                if error:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
 def fetch_url_html_content(url):
     try:
         response = requests.get(url)